@@ -7,6 +7,7 @@ from baselines import logger
 from baselines.common import set_global_seeds, explained_variance
 from baselines.common import tf_util
 from baselines.common.policies import build_policy
+from baselines.common.vec_env.double_buffered_vec_env import DoubleBufferedVecEnv
 
 
 from baselines.a2c.utils import Scheduler, find_trainable_variables
@@ -40,8 +41,9 @@ class Model(object):
 
 
         with tf.variable_scope('a2c_model', reuse=tf.AUTO_REUSE):
-            # step_model is used for sampling
-            step_model = policy(nenvs, 1, sess)
+            # step_model is used for sampling, stepped on one half of the
+            # environments at a time with a DoubleBufferedVecEnv
+            step_model = policy(None if isinstance(env, DoubleBufferedVecEnv) else nenvs, 1, sess)
 
             # train_model is used to train our network
             train_model = policy(nbatch, nsteps, sess)
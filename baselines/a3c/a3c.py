@@ -4,14 +4,11 @@ import numpy as np
 import tensorflow as tf
 from model import LSTMPolicy
 import six.moves.queue as queue
-import scipy.signal
 import threading
 import distutils.version
+from baselines.common.advantages import gae, discounted_returns
 use_tf12_api = distutils.version.LooseVersion(tf.VERSION) >= distutils.version.LooseVersion('0.12.0')
 
-def discount(x, gamma):
-    return scipy.signal.lfilter([1], [1, -gamma], x[::-1], axis=0)[::-1]
-
 def process_rollout(rollout, gamma, lambda_=1.0):
     """
     given a rollout, compute its returns and the advantage
@@ -19,14 +16,13 @@ def process_rollout(rollout, gamma, lambda_=1.0):
     batch_si = np.asarray(rollout.states)
     batch_a = np.asarray(rollout.actions)
     rewards = np.asarray(rollout.rewards)
-    vpred_t = np.asarray(rollout.values + [rollout.r])
+    # the rollout is a piece of a single episode, bootstrapped with rollout.r
+    dones = np.zeros(len(rewards), dtype=bool)
 
-    rewards_plus_v = np.asarray(rollout.rewards + [rollout.r])
-    batch_r = discount(rewards_plus_v, gamma)[:-1]
-    delta_t = rewards + gamma * vpred_t[1:] - vpred_t[:-1]
+    batch_r = discounted_returns(rewards, dones, rollout.r, False, gamma)
     # this formula for the advantage comes "Generalized Advantage Estimation":
     # https://arxiv.org/abs/1506.02438
-    batch_adv = discount(delta_t, gamma * lambda_)
+    batch_adv, _ = gae(rewards, rollout.values, dones, rollout.r, False, gamma, lambda_)
 
     features = rollout.features[0]
     return Batch(batch_si, batch_a, batch_adv, batch_r, rollout.terminal, features)
@@ -8,6 +8,7 @@ from baselines import logger
 from collections import deque
 from baselines.common import set_global_seeds, explained_variance
 from baselines.common.policies import build_policy
+from baselines.common.vec_env.double_buffered_vec_env import DoubleBufferedVecEnv
 from baselines.common.tf_util import get_session, save_variables, load_variables
 
 # from baselines.a2c.runner import Runner
@@ -22,12 +23,13 @@ class Model(object):
 
     def __init__(self, policy, ob_space, ac_space, nenvs,total_timesteps, nprocs=32, nsteps=20,
                  ent_coef=0.01, vf_coef=0.5, vf_fisher_coef=1.0, lr=0.25, max_grad_norm=0.5,
-                 kfac_clip=0.001, lrschedule='linear', is_async=True):
+                 kfac_clip=0.001, lrschedule='linear', is_async=True, double_buffered=False):
 
         self.sess = sess = get_session()
         nbatch = nenvs * nsteps
         with tf.variable_scope('acktr_model', reuse=tf.AUTO_REUSE):
-            self.model = step_model = policy(nenvs, 1, sess=sess)
+            # stepped on one half of the environments at a time with a DoubleBufferedVecEnv
+            self.model = step_model = policy(None if double_buffered else nenvs, 1, sess=sess)
             self.model2 = train_model = policy(nenvs*nsteps, nsteps, sess=sess)
 
         A = train_model.pdtype.sample_placeholder([None])
@@ -113,7 +115,8 @@ def learn(network, env, seed, total_timesteps=int(40e6), gamma=0.99, log_interva
     make_model = lambda : Model(policy, ob_space, ac_space, nenvs, total_timesteps, nprocs=nprocs, nsteps
                                 =nsteps, ent_coef=ent_coef, vf_coef=vf_coef, vf_fisher_coef=
                                 vf_fisher_coef, lr=lr, max_grad_norm=max_grad_norm, kfac_clip=kfac_clip,
-                                lrschedule=lrschedule, is_async=is_async)
+                                lrschedule=lrschedule, is_async=is_async,
+                                double_buffered=isinstance(env, DoubleBufferedVecEnv))
 
     model = make_model()
 
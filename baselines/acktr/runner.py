@@ -1,5 +1,5 @@
 import numpy as np
-from baselines.a2c.utils import discount_with_dones
+from baselines.common.advantages import discounted_returns
 from baselines.common.runners import AbstractEnvRunner
 
 class Runner(AbstractEnvRunner):
@@ -23,26 +23,18 @@ class Runner(AbstractEnvRunner):
         mb_obs, mb_rewards, mb_actions, mb_values, mb_dones = [],[],[],[],[]
         mb_states = self.states
         epinfos = []
-        for n in range(self.nsteps):
-            # Given observations, take action and value (V(s))
-            # We already have self.obs because Runner superclass run self.obs[:] = env.reset() on init
-            actions, values, states, _ = self.model.step(self.obs, S=self.states, M=self.dones)
-
+        # Given observations, take action and value (V(s)), then take actions in env and look the results
+        # We already have self.obs because Runner superclass run self.obs[:] = env.reset() on init
+        for obs, dones, (actions, values, _, _), rewards, infos in self.run_steps():
             # Append the experiences
-            mb_obs.append(np.copy(self.obs))
+            mb_obs.append(obs)
             mb_actions.append(actions)
             mb_values.append(values)
-            mb_dones.append(self.dones)
+            mb_dones.append(dones)
 
-            # Take actions in env and look the results
-            obs, rewards, dones, infos = self.env.step(actions)
             for info in infos:
                 maybeepinfo = info.get('episode')
                 if maybeepinfo: epinfos.append(maybeepinfo)
-
-            self.states = states
-            self.dones = dones
-            self.obs = obs
             mb_rewards.append(rewards)
         mb_dones.append(self.dones)
 
@@ -53,21 +45,12 @@ class Runner(AbstractEnvRunner):
         mb_values = np.asarray(mb_values, dtype=np.float32).swapaxes(1, 0)
         mb_dones = np.asarray(mb_dones, dtype=np.bool).swapaxes(1, 0)
         mb_masks = mb_dones[:, :-1]
-        mb_dones = mb_dones[:, 1:]
 
 
         if self.gamma > 0.0:
             # Discount/bootstrap off value fn
-            last_values = self.model.value(self.obs, S=self.states, M=self.dones).tolist()
-            for n, (rewards, dones, value) in enumerate(zip(mb_rewards, mb_dones, last_values)):
-                rewards = rewards.tolist()
-                dones = dones.tolist()
-                if dones[-1] == 0:
-                    rewards = discount_with_dones(rewards+[value], dones+[0], self.gamma)[:-1]
-                else:
-                    rewards = discount_with_dones(rewards, dones, self.gamma)
-
-                mb_rewards[n] = rewards
+            last_values = self.model.value(self.obs, S=self.states, M=self.dones)
+            mb_rewards = discounted_returns(mb_rewards.T, mb_masks.T, last_values, self.dones, self.gamma).T
 
         mb_actions = mb_actions.reshape(self.batch_action_shape)
 
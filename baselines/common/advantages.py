@@ -0,0 +1,114 @@
+"""
+Generalized advantage estimation and discounted returns of rollouts, shared
+by the on-policy algorithms.
+
+All functions take arrays of shape (nsteps,) or (nsteps, nenvs), and dones
+flags that tell whether the observation of a step is the first one of an
+episode, as returned by env.reset() or by env.step() after the end of the
+previous episode. The observation after the last step is given by
+last_values and last_dones.
+"""
+
+import numpy as np
+
+
+def masked_discount(x, nonterminal, gamma):
+    """
+    Discounted sums along the first axis of x that stop at episode ends.
+
+    Parameters
+    ----------
+    x: ndarray
+        values to discount, of shape (nsteps,) + batch shape
+    nonterminal: ndarray
+        0 where the episode ends after the step and 1 elsewhere, of the shape of x
+    gamma: float
+        discount factor
+
+    Returns
+    -------
+    y: ndarray of float64 of the shape of x, satisfying
+
+        y[t] = x[t] + gamma * nonterminal[t] * y[t+1], with y[nsteps] = 0
+    """
+    x = np.asarray(x, dtype=np.float64)
+    nsteps, batch_shape = x.shape[0], x.shape[1:]
+    # the steps are split in about sqrt(nsteps) chunks, which are discounted
+    # all at once step by step, and then chained from the last one to the first
+    size = max(int(np.sqrt(nsteps)), 1)
+    nchunks = -(-nsteps // size)
+    padded = (nchunks * size,) + batch_shape
+    y = np.zeros(padded)
+    y[:nsteps] = x
+    a = np.zeros(padded)
+    a[:nsteps] = gamma * np.asarray(nonterminal)
+    # step t of all chunks is y[t]
+    y = np.ascontiguousarray(y.reshape((nchunks, size) + batch_shape).swapaxes(0, 1))
+    a = np.ascontiguousarray(a.reshape((nchunks, size) + batch_shape).swapaxes(0, 1))
+    # y becomes the discounted sum up to the end of the chunk, and a the discount of the next chunk
+    for t in range(size - 2, -1, -1):
+        y[t] += a[t] * y[t + 1]
+        a[t] *= a[t + 1]
+    for c in range(nchunks - 2, -1, -1):
+        y[0, c] += a[0, c] * y[0, c + 1]
+    y[1:, :-1] += a[1:, :-1] * y[0, 1:]
+    return y.swapaxes(0, 1).reshape(padded)[:nsteps]
+
+
+def _next(x, last):
+    """
+    x shifted one step back along the first axis, with last as the last step.
+    """
+    x = np.asarray(x)
+    return np.concatenate([x[1:], np.broadcast_to(last, (1,) + x.shape[1:])])
+
+
+def gae(rewards, values, dones, last_values, last_dones, gamma, lam):
+    """
+    Generalized advantage estimation, https://arxiv.org/abs/1506.02438
+
+    Parameters
+    ----------
+    rewards: ndarray
+        rewards of every step, of shape (nsteps,) or (nsteps, nenvs)
+    values: ndarray
+        value estimates of the observation of every step, of the shape of rewards
+    dones: ndarray
+        whether the observation of every step starts an episode, of the shape of rewards
+    last_values: ndarray or float
+        value estimates of the observation after the last step
+    last_dones: ndarray or bool
+        whether the observation after the last step starts an episode
+    gamma: float
+        discount factor
+    lam: float
+        GAE(lambda) factor
+
+    Returns
+    -------
+    advs: ndarray of float32
+        GAE(lambda) advantages, of the shape of rewards
+    returns: ndarray of float32
+        TD(lambda) returns advs + values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    nonterminal = 1.0 - _next(dones, last_dones)
+    deltas = rewards + gamma * nonterminal * _next(values, last_values) - values
+    advs = masked_discount(deltas, nonterminal, gamma * lam)
+    return advs.astype(np.float32), (advs + values).astype(np.float32)
+
+
+def discounted_returns(rewards, dones, last_values, last_dones, gamma):
+    """
+    Discounted returns of every step, bootstrapped with last_values for the
+    episodes that do not end within the rollout. The arguments are the same
+    as for gae().
+
+    Returns
+    -------
+    returns: ndarray of float32 of the shape of rewards
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    nonterminal = 1.0 - _next(dones, last_dones)
+    bootstrap = gamma * nonterminal * _next(np.zeros_like(rewards), last_values)
+    return masked_discount(rewards + bootstrap, nonterminal, gamma).astype(np.float32)
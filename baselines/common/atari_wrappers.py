@@ -95,12 +95,19 @@ class EpisodicLifeEnv(gym.Wrapper):
         return obs
 
 class MaxAndSkipEnv(gym.Wrapper):
-    def __init__(self, env, skip=4):
-        """Return only every `skip`-th frame"""
+    def __init__(self, env, skip=4, max_pool=True):
+        """Return only every `skip`-th frame.
+
+        With max_pool=False, the last two frames are returned as they are,
+        stacked along a new first axis, for VecMaxAndSkip to max-pool them.
+        """
         gym.Wrapper.__init__(self, env)
         # most recent raw observations (for max pooling across time steps)
         self._obs_buffer = np.zeros((2,)+env.observation_space.shape, dtype=np.uint8)
         self._skip       = skip
+        self._max_pool   = max_pool
+        if not max_pool:
+            self.observation_space = spaces.Box(low=0, high=255, shape=self._obs_buffer.shape, dtype=np.uint8)
 
     def step(self, action):
         """Repeat action, sum reward, and max over last observations."""
@@ -115,12 +122,17 @@ class MaxAndSkipEnv(gym.Wrapper):
                 break
         # Note that the observation on the done=True frame
         # doesn't matter
+        if not self._max_pool:
+            return self._obs_buffer.copy(), total_reward, done, info
         max_frame = self._obs_buffer.max(axis=0)
 
         return max_frame, total_reward, done, info
 
     def reset(self, **kwargs):
-        return self.env.reset(**kwargs)
+        obs = self.env.reset(**kwargs)
+        if not self._max_pool:
+            return np.stack([obs, obs])
+        return obs
 
 class ClipRewardEnv(gym.RewardWrapper):
     def __init__(self, env):
@@ -256,23 +268,27 @@ class LazyFrames(object):
     def __getitem__(self, i):
         return self._force()[..., i]
 
-def make_atari(env_id, max_episode_steps=None):
+def make_atari(env_id, max_episode_steps=None, max_pool=True):
     env = gym.make(env_id)
     assert 'NoFrameskip' in env.spec.id
     env = NoopResetEnv(env, noop_max=30)
-    env = MaxAndSkipEnv(env, skip=4)
+    env = MaxAndSkipEnv(env, skip=4, max_pool=max_pool)
     if max_episode_steps is not None:
         env = TimeLimit(env, max_episode_steps=max_episode_steps)
     return env
 
-def wrap_deepmind(env, episode_life=True, clip_rewards=True, frame_stack=False, scale=False):
+def wrap_deepmind(env, episode_life=True, clip_rewards=True, frame_stack=False, scale=False, warp_frame=True):
     """Configure environment for DeepMind-style Atari.
+
+    With warp_frame=False and clip_rewards=False, the frames and rewards are
+    left for vec_atari_wrappers.wrap_deepmind_vec to process.
     """
     if episode_life:
         env = EpisodicLifeEnv(env)
     if 'FIRE' in env.unwrapped.get_action_meanings():
         env = FireResetEnv(env)
-    env = WarpFrame(env)
+    if warp_frame:
+        env = WarpFrame(env)
     if scale:
         env = ScaledFloatFrame(env)
     if clip_rewards:
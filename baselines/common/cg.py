@@ -1,12 +1,20 @@
 import numpy as np
-def cg(f_Ax, b, cg_iters=10, callback=None, verbose=False, residual_tol=1e-10):
+
+def cg(f_Ax, b, cg_iters=10, callback=None, verbose=False, residual_tol=1e-10, f_Minvx=None, return_info=False):
     """
     Demmel p 312
+
+    f_Minvx, if given, applies the inverse of a preconditioner M to a
+    vector, and the iterations stop once r.dot(M^-1 r) falls below
+    residual_tol after an update - at least one iteration is run. With
+    return_info=True, also return a dict with the number of iterations
+    run, the last residual and whether it converged before cg_iters.
     """
-    p = b.copy()
     r = b.copy()
+    z = r if f_Minvx is None else f_Minvx(r)
+    p = z.copy()
     x = np.zeros_like(b)
-    rdotr = r.dot(r)
+    rdotz = r.dot(z)
 
     fmtstr =  "%10i %10.3g %10.3g"
     titlestr =  "%10s %10s %10s"
@@ -15,20 +23,56 @@ def cg(f_Ax, b, cg_iters=10, callback=None, verbose=False, residual_tol=1e-10):
     for i in range(cg_iters):
         if callback is not None:
             callback(x)
-        if verbose: print(fmtstr % (i, rdotr, np.linalg.norm(x)))
-        z = f_Ax(p)
-        v = rdotr / p.dot(z)
+        if verbose: print(fmtstr % (i, rdotz, np.linalg.norm(x)))
+        Ap = f_Ax(p)
+        v = rdotz / p.dot(Ap)
         x += v*p
-        r -= v*z
-        newrdotr = r.dot(r)
-        mu = newrdotr/rdotr
-        p = r + mu*p
+        r -= v*Ap
+        z = r if f_Minvx is None else f_Minvx(r)
+        newrdotz = r.dot(z)
+        mu = newrdotz/rdotz
+        p = z + mu*p
 
-        rdotr = newrdotr
-        if rdotr < residual_tol:
+        rdotz = newrdotz
+        if rdotz < residual_tol:
             break
 
     if callback is not None:
         callback(x)
-    if verbose: print(fmtstr % (i+1, rdotr, np.linalg.norm(x)))  # pylint: disable=W0631
+    if verbose:
+        print(fmtstr % (i+1, rdotz, np.linalg.norm(x)))
+        if i+1 < cg_iters: print("converged after %i iterations" % (i+1))
+    if return_info:
+        return x, {"iters": i+1, "residual": rdotz, "converged": rdotz < residual_tol}
     return x
+
+def tf_cg(f_Ax, b, cg_iters=10, residual_tol=1e-10, f_Minvx=None):
+    """
+    Conjugate gradient in the graph, as cg does but in a tf.while_loop -
+    f_Ax and f_Minvx build the products of a vector tensor, and a whole
+    solve takes a single session call. At least one iteration is run.
+
+    Returns the solution, the number of iterations run and the last
+    residual.
+    """
+    import tensorflow as tf
+    precondition = (lambda r: r) if f_Minvx is None else f_Minvx
+    r = b
+    z = precondition(r)
+    rdotz = tf.reduce_sum(r * z)
+
+    def body(i, x, r, p, rdotz):
+        Ap = f_Ax(p)
+        v = rdotz / tf.reduce_sum(p * Ap)
+        x += v*p
+        r -= v*Ap
+        z = precondition(r)
+        newrdotz = tf.reduce_sum(r * z)
+        p = z + (newrdotz / rdotz) * p
+        return i + 1, x, r, p, newrdotz
+
+    i, x, _, _, rdotz = tf.while_loop(
+        lambda i, x, r, p, rdotz: tf.logical_and(i < cg_iters, tf.logical_or(tf.equal(i, 0), rdotz >= residual_tol)),
+        body, [tf.constant(0), tf.zeros_like(b), r, z, rdotz],
+        back_prop=False, parallel_iterations=1)
+    return x, i, rdotz
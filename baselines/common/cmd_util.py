@@ -17,6 +17,9 @@ from baselines.common.atari_wrappers import make_atari, wrap_deepmind
 from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
 from baselines.common.vec_env.shmem_vec_env import ShmemVecEnv
 from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
+from baselines.common.vec_env.vec_cpu_monitor import VecCpuMonitor
+from baselines.common.vec_env.vec_atari_wrappers import wrap_deepmind_vec
+from baselines.common.cpu_affinity import plan_affinity, pin_to_cores
 from baselines.common import retro_wrappers
 from baselines.common.wrappers import ClipActionsWrapper
 
@@ -28,11 +31,35 @@ def make_vec_env(env_id, env_type, num_env, seed,
                  flatten_dict_observations=True,
                  gamestate=None,
                  initializer=None,
-                 force_dummy=False):
+                 force_dummy=False,
+                 envs_per_worker=1,
+                 cpu_affinity=None,
+                 learner_cores=None,
+                 vec_preprocessing=False):
     """
     Create a wrapped, monitored SubprocVecEnv for Atari and MuJoCo.
+    With envs_per_worker > 1, every subprocess steps that many environments.
+
+    With cpu_affinity='auto' or a list of cores, learner_cores of these cores
+    (by default all the ones left over by the workers) are reserved for the
+    calling process (the learner) and every worker is pinned to one of the
+    others, see cpu_affinity.plan_affinity. The learner
+    is pinned before the shared observation buffers are allocated, so they
+    are placed on its NUMA node. The CPU utilisation of the learner and of
+    every worker is logged through VecCpuMonitor.
+
+    With vec_preprocessing=True, Atari environments only skip frames in the
+    workers, and the max-pooling, warping and reward clipping of
+    wrap_deepmind run on the whole batch in the main process, see
+    vec_atari_wrappers.wrap_deepmind_vec.
     """
     wrapper_kwargs = wrapper_kwargs or {}
+    if vec_preprocessing:
+        assert env_type == 'atari', 'vec_preprocessing is only available for Atari'
+        assert not wrapper_kwargs.get('frame_stack') and not wrapper_kwargs.get('scale'), \
+            'use VecFrameStack instead of frame_stack and scale in the policy with vec_preprocessing'
+        clip_rewards = wrapper_kwargs.get('clip_rewards', True)
+        wrapper_kwargs = dict(wrapper_kwargs, warp_frame=False, clip_rewards=False)
     env_kwargs = env_kwargs or {}
     mpi_rank = MPI.COMM_WORLD.Get_rank() if MPI else 0
     seed = seed + 10000 * mpi_rank if seed is not None else None
@@ -50,17 +77,38 @@ def make_vec_env(env_id, env_type, num_env, seed,
             wrapper_kwargs=wrapper_kwargs,
             env_kwargs=env_kwargs,
             logger_dir=logger_dir,
-            initializer=initializer
+            initializer=initializer,
+            max_pool=not vec_preprocessing
         )
 
     set_global_seeds(seed)
     if not force_dummy and num_env > 1:
-        return ShmemVecEnv([make_thunk(i + start_index, initializer=initializer) for i in range(num_env)])
+        if cpu_affinity is not None:
+            num_workers = (num_env + envs_per_worker - 1) // envs_per_worker
+            learner, workers = plan_affinity(num_workers, learner_cores,
+                                             cores=None if cpu_affinity == 'auto' else cpu_affinity)
+            pin_to_cores(learner)
+            initializer = _pinning_initializer(workers, envs_per_worker, start_index, initializer)
+        env = ShmemVecEnv([make_thunk(i + start_index, initializer=initializer) for i in range(num_env)],
+                          envs_per_worker=envs_per_worker)
+        if cpu_affinity is not None:
+            env = VecCpuMonitor(env)
     else:
-        return DummyVecEnv([make_thunk(i + start_index, initializer=None) for i in range(num_env)])
+        env = DummyVecEnv([make_thunk(i + start_index, initializer=None) for i in range(num_env)])
+    if vec_preprocessing:
+        env = wrap_deepmind_vec(env, clip_rewards=clip_rewards)
+    return env
+
+
+def _pinning_initializer(worker_cores, envs_per_worker, start_index, initializer=None):
+    def pin_worker(mpi_rank=0, subrank=0):
+        pin_to_cores(worker_cores[(subrank - start_index) // envs_per_worker])
+        if initializer is not None:
+            initializer(mpi_rank=mpi_rank, subrank=subrank)
+    return pin_worker
 
 
-def make_env(env_id, env_type, mpi_rank=0, subrank=0, seed=None, reward_scale=1.0, gamestate=None, flatten_dict_observations=True, wrapper_kwargs=None, env_kwargs=None, logger_dir=None, initializer=None):
+def make_env(env_id, env_type, mpi_rank=0, subrank=0, seed=None, reward_scale=1.0, gamestate=None, flatten_dict_observations=True, wrapper_kwargs=None, env_kwargs=None, logger_dir=None, initializer=None, max_pool=True):
     if initializer is not None:
         initializer(mpi_rank=mpi_rank, subrank=subrank)
 
@@ -73,7 +121,7 @@ def make_env(env_id, env_type, mpi_rank=0, subrank=0, seed=None, reward_scale=1.
         env_id = re.sub('.*:', '', env_id)
         importlib.import_module(module_name)
     if env_type == 'atari':
-        env = make_atari(env_id)
+        env = make_atari(env_id, max_pool=max_pool)
     elif env_type == 'retro':
         import retro
         gamestate = gamestate or retro.State.DEFAULT
@@ -0,0 +1,118 @@
+"""
+Placement of the learner and of environment worker processes on cores,
+so that workers do not compete with the TensorFlow threads of the learner.
+Pinning needs os.sched_setaffinity and the NUMA topology and CPU times are
+read from /sys and /proc, so outside of Linux pinning is skipped and no CPU
+times are reported.
+"""
+
+import glob
+import os
+import re
+
+from baselines import logger
+
+
+def available_cores():
+    """
+    Sorted list of the cores the current process may run on.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def parse_cpulist(cpulist):
+    """
+    Parse a Linux cpulist such as '0-3,8,10-11' into a list of cores.
+    """
+    cores = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cores.extend(range(int(first), int(last or first) + 1))
+    return cores
+
+
+def numa_nodes():
+    """
+    List of the cores of every NUMA node, or a single node with all the
+    available cores if the topology is unknown.
+    """
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node*/cpulist'),
+                       key=lambda p: int(re.search(r'node(\d+)', p).group(1))):
+        with open(path) as f:
+            nodes.append(parse_cpulist(f.read()))
+    return nodes or [available_cores()]
+
+
+def plan_affinity(num_workers, learner_cores=None, cores=None, nodes=None):
+    """
+    Split cores between the learner and num_workers environment workers.
+
+    Cores are taken node by node, starting with the NUMA node that has the
+    most of them, so that the learner and as many workers as possible share
+    a node. The learner gets the first learner_cores cores and every worker
+    one of the others, round-robin if there are more workers than cores.
+    By default the learner keeps all the cores that no worker needs, but at
+    least one, so that its TensorFlow thread pools are not limited to a
+    single core. If there are not enough cores to reserve any, all processes
+    share them.
+
+    Parameters
+    ----------
+    num_workers: int
+        number of worker processes
+    learner_cores: int or None
+        number of cores reserved for the learner, by default all the cores
+        left over by the workers
+    cores: list of int or None
+        cores to use, by default all the cores available to this process
+    nodes: list of list of int or None
+        cores of every NUMA node, read from /sys by default
+
+    Returns
+    -------
+    learner: list of int
+        cores of the learner
+    workers: list of list of int
+        cores of every worker
+    """
+    cores = set(available_cores() if cores is None else cores)
+    nodes = [[c for c in node if c in cores] for node in (numa_nodes() if nodes is None else nodes)]
+    ordered = [c for node in sorted(nodes, key=len, reverse=True) for c in node]
+    ordered += sorted(cores.difference(ordered))
+    if learner_cores is None:
+        learner_cores = max(len(ordered) - num_workers, 1)
+    if len(ordered) <= learner_cores:
+        logger.warn('Only {} cores for the learner and {} env workers, not reserving any'.format(
+            len(ordered), num_workers))
+        return ordered, [ordered] * num_workers
+    learner, env_cores = ordered[:learner_cores], ordered[learner_cores:]
+    return learner, [[env_cores[i % len(env_cores)]] for i in range(num_workers)]
+
+
+def pin_to_cores(cores, pid=0):
+    """
+    Restrict the process pid (by default the current one) to the given cores.
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(pid, cores)
+    else:
+        logger.warn('Cannot pin processes to cores on this platform')
+
+
+def process_cpu_time(pid):
+    """
+    User plus system CPU time in seconds of the process pid, or None if it
+    cannot be read.
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            fields = f.read().rpartition(')')[2].split()
+    except OSError:
+        return None
+    # utime and stime are the 14th and 15th fields, the ones after the command are from the 3rd on
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
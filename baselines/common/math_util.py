@@ -60,6 +60,34 @@ def unflatten_vector(vec, shapes):
         i += size
     return arrs
 
+def shifted_moments(x, shift, out=None):
+    """
+    Mean and variance in float64 of x over its first axis. With shift close
+    to the mean, e.g. the running mean, the variance is computed in a single
+    pass from the sums of x - shift and of its square. When the mean of the
+    batch is far from shift, e.g. on the first update, those sums cancel out
+    and the variance is computed again from the centered values instead.
+
+    Returns the mean, the variance and x - shift, which is written to out
+    (a float64 array of the shape of x) if given.
+    """
+    # casting in a separate copy is much faster than in np.subtract
+    if out is None:
+        delta = np.array(x, dtype=np.float64)
+    else:
+        delta = out
+        delta[...] = x
+    np.subtract(delta, shift, out=delta)
+    n = delta.shape[0]
+    delta_mean = delta.sum(axis=0) / n
+    mean_sq = np.square(delta_mean)
+    var = np.einsum('i...,i...->...', delta, delta) / n - mean_sq
+    # the relative error of var grows with mean_sq / var
+    if np.any(mean_sq > var):
+        centered = delta - delta_mean
+        var = np.einsum('i...,i...->...', centered, centered) / n
+    return shift + delta_mean, np.maximum(var, 0.0), delta
+
 def discount_with_boundaries(X, New, gamma):
     """
     X: 2d array of floats, time x features
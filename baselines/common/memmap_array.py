@@ -0,0 +1,160 @@
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+
+class MemmapArray(object):
+    def __init__(self, shape, dtype='float32', storage_dir=None, cache_rows=1024):
+        """Array backed by a memory-mapped file, for buffers larger than RAM.
+
+        Rows are read straight from the mapping, so the operating system's
+        page cache keeps the recently sampled regions in memory. Writes to
+        single rows go to an in-RAM block of `cache_rows` consecutive rows,
+        which is written back in one piece when a row outside of it is set.
+        Ring buffers write rows in order, so the hot write region stays in
+        RAM and the file only sees large sequential writes.
+
+        Only non-negative integer indices, integer index arrays and slices
+        are supported, which is all the replay buffers need.
+
+        Parameters
+        ----------
+        shape: tuple
+            shape of the array, the first axis is the row axis
+        dtype: np.dtype
+            type of the elements
+        storage_dir: str or None
+            directory of the backing file, defaults to the system temporary
+            directory. The file is unlinked right away and disappears together
+            with the array.
+        cache_rows: int
+            number of consecutive rows kept in RAM for writing, 0 disables
+            the cache
+        """
+        self.shape = tuple(shape)
+        fd, filename = tempfile.mkstemp(prefix='baselines-', suffix='.mmap', dir=storage_dir)
+        os.close(fd)
+        self._data = np.memmap(filename, dtype=dtype, mode='w+', shape=self.shape)
+        # the mapping stays valid once the name is gone
+        os.unlink(filename)
+        self.dtype = self._data.dtype
+
+        self._cache_rows = min(cache_rows, self.shape[0])
+        self._cache = np.empty((self._cache_rows,) + self.shape[1:], dtype=self.dtype) if self._cache_rows else None
+        self._cache_start = None
+        self._dirty = False
+
+    def __len__(self):
+        return self.shape[0]
+
+    def flush(self):
+        """Write the cached rows back to the mapping."""
+        if self._dirty:
+            end = min(self._cache_start + self._cache_rows, self.shape[0])
+            self._data[self._cache_start:end] = self._cache[:end - self._cache_start]
+            self._dirty = False
+
+    def _invalidate(self):
+        self.flush()
+        self._cache_start = None
+
+    def _cache_row(self, idx):
+        start = idx - idx % self._cache_rows
+        if start != self._cache_start:
+            self.flush()
+            end = min(start + self._cache_rows, self.shape[0])
+            self._cache[:end - start] = self._data[start:end]
+            self._cache_start = start
+        return idx - start
+
+    def __setitem__(self, idx, value):
+        if self._cache is not None and isinstance(idx, (int, np.integer)):
+            self._cache[self._cache_row(idx)] = value
+            self._dirty = True
+        else:
+            self._invalidate()
+            self._data[idx] = value
+
+    def __getitem__(self, idx):
+        if self._cache is None or self._cache_start is None:
+            return self._data[idx]
+        if isinstance(idx, (int, np.integer)):
+            if self._cache_start <= idx < self._cache_start + self._cache_rows:
+                return self._cache[idx - self._cache_start]
+            return self._data[idx]
+        if isinstance(idx, slice):
+            self.flush()
+            return self._data[idx]
+        idx = np.asarray(idx)
+        out = self._data[idx]
+        cached = (idx >= self._cache_start) & (idx < self._cache_start + self._cache_rows)
+        if np.any(cached):
+            out[cached] = self._cache[idx[cached] - self._cache_start]
+        return out
+
+
+def allocate(shape, dtype='float32', storage_dir=None, cache_rows=1024):
+    """Zero-initialized buffer storage: a numpy array, or a MemmapArray
+    in `storage_dir` when it is given.
+    """
+    if storage_dir is None:
+        return np.zeros(shape, dtype=dtype)
+    return MemmapArray(shape, dtype=dtype, storage_dir=storage_dir, cache_rows=cache_rows)
+
+
+def save_arrays(path, arrays, state):
+    """Save a buffer to directory `path`: every entry of the `arrays` dict as
+    an uncompressed .npy file and the python objects in `state` as a pickle.
+
+    Files are written under a temporary name and then moved in place, so a
+    buffer that was loaded from `path` with load_array can be saved back to it.
+    The state is written last and marks a complete save.
+    """
+    clear_saved_state(path)
+    state_file = os.path.join(path, 'state.pkl')
+    for name, array in arrays.items():
+        filename = os.path.join(path, name + '.npy')
+        with open(filename + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(filename + '.tmp', filename)
+    with open(state_file + '.tmp', 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def has_saved_state(path):
+    return os.path.exists(os.path.join(path, 'state.pkl'))
+
+
+def clear_saved_state(path):
+    """Create directory `path` if needed and remove the state that marks a
+    complete save, before overwriting the files of a save there."""
+    os.makedirs(path, exist_ok=True)
+    state_file = os.path.join(path, 'state.pkl')
+    if os.path.exists(state_file):
+        os.remove(state_file)
+
+
+def load_state(path):
+    with open(os.path.join(path, 'state.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+def load_array(path, name, capacity=None, storage_dir=None, cache_rows=1024):
+    """Load an array saved by save_arrays.
+
+    If the saved array already has `capacity` rows and no storage_dir is
+    given, the file is mapped copy-on-write: nothing is read up front and
+    later writes stay in memory. Otherwise the rows are copied into fresh
+    storage with `capacity` rows (see allocate).
+    """
+    array = np.load(os.path.join(path, name + '.npy'), mmap_mode='c')
+    if capacity is None:
+        capacity = len(array)
+    if storage_dir is None and len(array) == capacity:
+        return array
+    out = allocate((capacity,) + array.shape[1:], dtype=array.dtype, storage_dir=storage_dir, cache_rows=cache_rows)
+    out[:len(array)] = array
+    return out
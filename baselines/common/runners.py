@@ -1,5 +1,8 @@
+import time
 import numpy as np
 from abc import ABC, abstractmethod
+from baselines import logger
+from baselines.common.vec_env.double_buffered_vec_env import DoubleBufferedVecEnv
 
 class AbstractEnvRunner(ABC):
     def __init__(self, *, env, model, nsteps):
@@ -12,8 +15,176 @@ class AbstractEnvRunner(ABC):
         self.nsteps = nsteps
         self.states = model.initial_state
         self.dones = [False for _ in range(nenv)]
+        self.double_buffered = isinstance(env, DoubleBufferedVecEnv)
+        if self.double_buffered:
+            assert self.states is None, 'Double-buffered stepping does not support recurrent policies'
 
     @abstractmethod
     def run(self):
         raise NotImplementedError
 
+    def run_steps(self):
+        """
+        Step the model and the environments for nsteps steps, updating
+        self.obs, self.states and self.dones.
+
+        Yields a tuple (obs, masks, model_outputs, rewards, infos) per step,
+        where obs is a copy of the observations the model was evaluated on,
+        masks the dones before the step and model_outputs the tuple returned
+        by model.step.
+
+        If the env is a DoubleBufferedVecEnv, one half of the environments is
+        stepped while the model is evaluated on the observations of the other
+        half, so the act model has to be built with a batch size of None. The
+        fraction of the environment time hidden behind the model is logged as
+        misc/env_overlap.
+        """
+        if self.double_buffered:
+            yield from self._run_steps_double_buffered()
+            return
+        for _ in range(self.nsteps):
+            obs, masks = self.obs.copy(), self.dones
+            outputs = self.model.step(self.obs, S=self.states, M=self.dones)
+            self.states = outputs[2]
+            self.obs[:], rewards, self.dones, infos = self.env.step(outputs[0])
+            yield obs, masks, outputs, rewards, infos
+
+    def _run_steps_double_buffered(self):
+        halves, slices = self.env.halves, self.env.slices
+        self.dones = np.array(self.dones, dtype=bool)
+        env_time = blocked_time = 0.0
+        started = [0.0, 0.0]
+        pending = None
+
+        def wait(h):
+            nonlocal env_time, blocked_time
+            tstart = time.perf_counter()
+            obs, rewards, dones, infos = halves[h].step_wait()
+            tend = time.perf_counter()
+            blocked_time += tend - tstart
+            env_time += tend - started[h]
+            self.obs[slices[h]] = obs
+            self.dones[slices[h]] = dones
+            return rewards, infos
+
+        for t in range(self.nsteps):
+            step = [self.obs.copy(), self.dones.copy(), None, None, [None] * self.nenv]
+            for h, half in enumerate(slices):
+                outputs = self.model.step(self.obs[half], S=None, M=self.dones[half])
+                if h == 0:
+                    step[2] = tuple(out if out is None else np.zeros((self.nenv,) + np.shape(out)[1:], dtype=np.asarray(out).dtype)
+                                    for out in outputs)
+                else:
+                    # the second half was still stepping when the copy was taken
+                    step[0][half] = self.obs[half]
+                    step[1][half] = self.dones[half]
+                for out, out_half in zip(step[2], outputs):
+                    if out is not None:
+                        out[half] = out_half
+                started[h] = time.perf_counter()
+                halves[h].step_async(step[2][0][half])
+                if h == 0 and pending is not None:
+                    yield self._finish_step(pending, wait(1), slices[1])
+                if h == 1:
+                    rewards, infos = wait(0)
+                    step[3] = np.zeros(self.nenv, dtype=np.asarray(rewards).dtype)
+                    step[3][slices[0]] = rewards
+                    step[4][slices[0]] = infos
+            pending = step
+        yield self._finish_step(pending, wait(1), slices[1])
+        if env_time > 0:
+            logger.logkv_mean('misc/env_overlap', 1.0 - blocked_time / env_time)
+
+    @staticmethod
+    def _finish_step(step, result, half):
+        rewards, infos = result
+        step[3][half] = rewards
+        step[4][half] = infos
+        return tuple(step)
+
+
+
+class AsyncEnvRunner(AbstractEnvRunner):
+    """
+    Runner for an AsyncVecEnv that acts on partial batches: whenever some
+    environments finish their step, actions are computed for them and they
+    are sent off again right away, so fast environments never wait for slow
+    ones.
+
+    Every environment contributes nsteps transitions to a rollout. An
+    environment that is done early keeps going and fills up to nsteps
+    transitions of the next rollout, taken with the current parameters.
+    The policy is evaluated on the observations of all environments, so its
+    batch size stays fixed, and only the rows of the ready ones are used.
+    Recurrent policies are not supported.
+    """
+    def __init__(self, *, env, model, nsteps):
+        super().__init__(env=env, model=model, nsteps=nsteps)
+        assert self.states is None, 'AsyncEnvRunner does not support recurrent policies'
+        self.dones = np.zeros(self.nenv, dtype=bool)
+        # the first nsteps rows belong to the current rollout, the others to the next one
+        self.buffers = None
+        self.positions = np.zeros(self.nenv, dtype=np.int64)
+        self.ready = list(range(self.nenv))
+        self.last_values = np.zeros(self.nenv, dtype=np.float32)
+        self.last_dones = np.zeros(self.nenv, dtype=bool)
+
+    def _allocate(self, actions, values, neglogpacs):
+        shape = (2 * self.nsteps, self.nenv)
+        self.buffers = {
+            'obs': np.zeros(shape + self.obs.shape[1:], dtype=self.obs.dtype),
+            'actions': np.zeros(shape + actions.shape[1:], dtype=actions.dtype),
+            'values': np.zeros(shape, dtype=np.float32),
+            'neglogpacs': np.zeros(shape, dtype=np.float32),
+            'rewards': np.zeros(shape, dtype=np.float32),
+            'dones': np.zeros(shape, dtype=bool),
+        }
+
+    def collect(self):
+        """
+        Run the environments until every one of them has contributed nsteps
+        transitions to the current rollout.
+
+        Returns a dict of arrays of shape (nsteps, nenv, ...) with the keys
+        obs, actions, values, neglogpacs, rewards and dones (done before the
+        step, i.e. the masks), the dict of bootstrap values and dones of shape
+        (nenv,) after the last step of every environment (keys last_values and
+        last_dones) and the list of episode infos.
+        """
+        nsteps, epinfos = self.nsteps, []
+        while True:
+            ids = np.array([env_id for env_id in self.ready if self.positions[env_id] < 2 * nsteps], dtype=np.int64)
+            if len(ids):
+                actions, values, _, neglogpacs = self.model.step(self.obs, S=self.states, M=self.dones)
+                if self.buffers is None:
+                    self._allocate(actions, values, neglogpacs)
+                pos = self.positions[ids]
+                crossing = ids[pos == nsteps]
+                self.last_values[crossing] = values[crossing]
+                self.last_dones[crossing] = self.dones[crossing]
+                for key, value in [('obs', self.obs), ('actions', actions), ('values', values),
+                                   ('neglogpacs', neglogpacs), ('dones', self.dones)]:
+                    self.buffers[key][pos, ids] = value[ids]
+                self.env.send(actions[ids], ids)
+                self.ready = [env_id for env_id in self.ready if self.positions[env_id] >= 2 * nsteps]
+            # checked after sending, so that the bootstrap values of the
+            # environments that complete the rollout last are computed as well
+            if self.positions.min() >= nsteps:
+                break
+
+            obs, rewards, dones, infos, ids = self.env.recv()
+            self.buffers['rewards'][self.positions[ids], ids] = rewards
+            self.positions[ids] += 1
+            self.obs[ids] = obs
+            self.dones[ids] = dones
+            self.ready.extend(ids.tolist())
+            for info in infos:
+                maybeepinfo = info.get('episode')
+                if maybeepinfo: epinfos.append(maybeepinfo)
+
+        rollout = {key: buf[:nsteps].copy() for key, buf in self.buffers.items()}
+        last = {'last_values': self.last_values.copy(), 'last_dones': self.last_dones.copy()}
+        for buf in self.buffers.values():
+            buf[:nsteps] = buf[nsteps:]
+        self.positions -= nsteps
+        return rollout, last, epinfos
@@ -1,6 +1,7 @@
 import tensorflow as tf
 import numpy as np
 from baselines.common.tf_util import get_session
+from baselines.common.math_util import shifted_moments
 
 class RunningMeanStd(object):
     # https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
@@ -10,10 +11,8 @@ class RunningMeanStd(object):
         self.count = epsilon
 
     def update(self, x):
-        batch_mean = np.mean(x, axis=0)
-        batch_var = np.var(x, axis=0)
-        batch_count = x.shape[0]
-        self.update_from_moments(batch_mean, batch_var, batch_count)
+        batch_mean, batch_var, _ = shifted_moments(x, self.mean)
+        self.update_from_moments(batch_mean, batch_var, x.shape[0])
 
     def update_from_moments(self, batch_mean, batch_var, batch_count):
         self.mean, self.var, self.count = update_mean_var_count_from_moments(
@@ -66,10 +65,10 @@ class TfRunningMeanStd(object):
         self.mean, self.var, self.count = self.sess.run([self._mean, self._var, self._count])
 
     def update(self, x):
-        batch_mean = np.mean(x, axis=0)
-        batch_var = np.var(x, axis=0)
-        batch_count = x.shape[0]
+        batch_mean, batch_var, _ = shifted_moments(x, self.mean)
+        self.update_from_moments(batch_mean, batch_var, x.shape[0])
 
+    def update_from_moments(self, batch_mean, batch_var, batch_count):
         new_mean, new_var, new_count = update_mean_var_count_from_moments(self.mean, self.var, self.count, batch_mean, batch_var, batch_count)
 
         self.sess.run(self.update_ops, feed_dict={
@@ -99,6 +98,17 @@ def test_runningmeanstd():
 
         np.testing.assert_allclose(ms1, ms2)
 
+def test_shifted_moments_large_offset():
+    rng = np.random.RandomState(0)
+    for offset in [0.0, 1e6, 1e8]:
+        x = offset + rng.randn(64, 3)
+        shifts = [np.zeros(3), x.mean(axis=0), offset + rng.randn(3)]
+        for shift in shifts:
+            mean, var, delta = shifted_moments(x, shift)
+            np.testing.assert_allclose(mean, x.mean(axis=0), rtol=1e-12)
+            np.testing.assert_allclose(var, x.var(axis=0), rtol=1e-6)
+            np.testing.assert_array_equal(delta, x - shift)
+
 def test_tf_runningmeanstd():
     for (x1, x2, x3) in [
         (np.random.randn(3), np.random.randn(4), np.random.randn(5)),
@@ -1,4 +1,4 @@
-import operator
+import numpy as np
 
 
 class SegmentTree(object):
@@ -20,17 +20,18 @@ class SegmentTree(object):
         ---------
         capacity: int
             Total size of the array - must be a power of two.
-        operation: lambda obj, obj -> obj
-            and operation for combining elements (eg. sum, max)
+        operation: numpy ufunc
+            and operation for combining elements (eg. np.add, np.maximum)
             must form a mathematical group together with the set of
-            possible values for array elements (i.e. be associative)
+            possible values for array elements (i.e. be associative).
+            It is applied elementwise to whole tree levels by `set`.
         neutral_element: obj
             neutral element for the operation above. eg. float('-inf')
             for max and 0 for sum.
         """
         assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
         self._capacity = capacity
-        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._value = np.full(2 * capacity, neutral_element, dtype=np.float64)
         self._operation = operation
 
     def _reduce_helper(self, start, end, node, node_start, node_end):
@@ -85,16 +86,42 @@ class SegmentTree(object):
             )
             idx //= 2
 
+    def set(self, idxs, vals):
+        """Batch version of `__setitem__`.
+
+        Updates all the leaves first and then recomputes the affected
+        nodes one tree level at a time, so the cost is O(lg capacity)
+        vectorized operations instead of O(len(idxs) * lg capacity)
+        python steps. If an index is repeated the last value wins.
+
+        Parameters
+        ----------
+        idxs: np.array
+            indexes of the array elements to set
+        vals: np.array
+            new values of the elements, same length as idxs
+        """
+        idxs = np.asarray(idxs, dtype=np.int64) + self._capacity
+        self._value[idxs] = vals
+        # all leaves are at the same depth, so their parents are too; shared
+        # parents are simply recomputed to the same value more than once
+        for _ in range(self._capacity.bit_length() - 1):
+            idxs //= 2
+            self._value[idxs] = self._operation(
+                self._value[2 * idxs],
+                self._value[2 * idxs + 1]
+            )
+
     def __getitem__(self, idx):
-        assert 0 <= idx < self._capacity
-        return self._value[self._capacity + idx]
+        assert np.all(0 <= idx) and np.all(idx < self._capacity)
+        return self._value[self._capacity + np.asarray(idx)]
 
 
 class SumSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(SumSegmentTree, self).__init__(
             capacity=capacity,
-            operation=operator.add,
+            operation=np.add,
             neutral_element=0.0
         )
 
@@ -110,32 +137,36 @@ class SumSegmentTree(SegmentTree):
         allows to sample indexes according to the discrete
         probability efficiently.
 
+        A whole batch of prefix sums can be passed at once, in which
+        case the tree is descended one level at a time for all of them.
+
         Parameters
         ----------
-        perfixsum: float
+        perfixsum: float or np.array
             upperbound on the sum of array prefix
 
         Returns
         -------
-        idx: int
+        idx: int or np.array
             highest index satisfying the prefixsum constraint
         """
-        assert 0 <= prefixsum <= self.sum() + 1e-5
-        idx = 1
-        while idx < self._capacity:  # while non-leaf
-            if self._value[2 * idx] > prefixsum:
-                idx = 2 * idx
-            else:
-                prefixsum -= self._value[2 * idx]
-                idx = 2 * idx + 1
-        return idx - self._capacity
+        prefixsum = np.array(prefixsum, dtype=np.float64)
+        assert np.all(0 <= prefixsum) and np.all(prefixsum <= self._value[1] + 1e-5)
+        idx = np.ones_like(prefixsum, dtype=np.int64)
+        for _ in range(self._capacity.bit_length() - 1):  # while non-leaf
+            left = self._value[2 * idx]
+            go_right = left <= prefixsum
+            prefixsum -= np.where(go_right, left, 0.0)
+            idx = 2 * idx + go_right
+        idx -= self._capacity
+        return idx if idx.ndim else int(idx)
 
 
 class MinSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(MinSegmentTree, self).__init__(
             capacity=capacity,
-            operation=min,
+            operation=np.minimum,
             neutral_element=float('inf')
         )
 
@@ -0,0 +1,89 @@
+import timeit
+
+import numpy as np
+import pytest
+
+from baselines.common.advantages import gae, discounted_returns, masked_discount
+
+
+def _loop_gae(rewards, values, dones, last_values, last_dones, gamma, lam):
+    # reversed loop over the steps that ppo2.runner.Runner used before
+    nsteps = len(rewards)
+    advs = np.zeros_like(rewards)
+    lastgaelam = 0
+    for t in reversed(range(nsteps)):
+        if t == nsteps - 1:
+            nextnonterminal = 1.0 - last_dones
+            nextvalues = last_values
+        else:
+            nextnonterminal = 1.0 - dones[t+1]
+            nextvalues = values[t+1]
+        delta = rewards[t] + gamma * nextvalues * nextnonterminal - values[t]
+        advs[t] = lastgaelam = delta + gamma * lam * nextnonterminal * lastgaelam
+    return advs
+
+
+def _rollout(nsteps, nenvs, done_prob=0.02, seed=0):
+    rng = np.random.RandomState(seed)
+    shape = (nsteps, nenvs) if nenvs else (nsteps,)
+    rewards = rng.randn(*shape).astype(np.float32)
+    values = rng.randn(*shape).astype(np.float32)
+    dones = rng.rand(*shape) < done_prob
+    last_values = np.asarray(rng.randn(*shape[1:]), dtype=np.float32)
+    last_dones = np.asarray(rng.rand(*shape[1:]) < 0.5)
+    return rewards, values, dones, last_values, last_dones
+
+
+@pytest.mark.parametrize('nsteps,nenvs', [(1, 4), (5, 16), (7, 0), (128, 8), (2048, 0), (2048, 8)])
+@pytest.mark.parametrize('gamma,lam', [(0.99, 0.95), (1.0, 1.0), (0.0, 0.95)])
+def test_gae(nsteps, nenvs, gamma, lam):
+    rewards, values, dones, last_values, last_dones = _rollout(nsteps, nenvs)
+    advs, returns = gae(rewards, values, dones, last_values, last_dones, gamma, lam)
+    expected = _loop_gae(rewards, values, dones, last_values, last_dones, gamma, lam)
+    assert advs.dtype == returns.dtype == np.float32
+    np.testing.assert_allclose(advs, expected, rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(returns, expected + values, rtol=1e-4, atol=1e-4)
+
+
+def test_gae_segment():
+    """
+    Test the single environment segments of trpo_mpi and ppo1, whose
+    nextvpred is already zeroed when the next observation starts an episode.
+    """
+    rewards, values, dones, _, _ = _rollout(1000, 0, done_prob=0.1)
+    nextvpred = 0.0
+    advs, returns = gae(rewards, values, dones, nextvpred, False, 0.99, 0.95)
+    np.testing.assert_allclose(advs, _loop_gae(rewards, values, dones, nextvpred, 0.0, 0.99, 0.95),
+                               rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize('nenvs', [0, 4])
+def test_discounted_returns(nenvs):
+    rewards, values, dones, last_values, last_dones = _rollout(200, nenvs, done_prob=0.05)
+    returns = discounted_returns(rewards, dones, last_values, last_dones, 0.9)
+    # returns are the advantages for zero values and lam = 1, apart from the bootstrap
+    expected = _loop_gae(rewards, np.zeros_like(values), dones, last_values, last_dones, 0.9, 1.0)
+    np.testing.assert_allclose(returns, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_masked_discount():
+    gamma = 0.9
+    x = np.array([1.0, 2.0, 3.0, 4.0])
+    nonterminal = np.array([1.0, 1.0, 0.0, 1.0])
+    np.testing.assert_allclose(masked_discount(x, nonterminal, gamma), [
+        1 + gamma * 2 + gamma ** 2 * 3,
+        2 + gamma * 3,
+        3,
+        4
+    ])
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('nenvs', [1, 8, 64])
+def test_gae_benchmark(nenvs):
+    nsteps = 2048
+    rollout = _rollout(nsteps, nenvs)
+    number = 10
+    loop = timeit.timeit(lambda: _loop_gae(*rollout, 0.99, 0.95), number=number) / number
+    vectorized = timeit.timeit(lambda: gae(*rollout, 0.99, 0.95), number=number) / number
+    print('{} steps x {} envs: loop {:8.3f} ms, gae {:8.3f} ms'.format(nsteps, nenvs, 1e3 * loop, 1e3 * vectorized))
@@ -0,0 +1,60 @@
+import time
+
+import gym
+import numpy as np
+
+from baselines.common.runners import AsyncEnvRunner
+from baselines.common.vec_env.async_vec_env import AsyncVecEnv
+
+
+class CounterEnv(gym.Env):
+    """
+    Observes its id and the number of steps so far, and sleeps
+    longer for larger ids.
+    """
+    def __init__(self, env_id):
+        self.env_id = env_id
+        self.t = 0
+        self.observation_space = gym.spaces.Box(low=0, high=1e6, shape=(2,), dtype=np.float32)
+        self.action_space = gym.spaces.Discrete(2)
+
+    def step(self, action):
+        time.sleep(0.002 * self.env_id)
+        self.t += 1
+        done = self.t % 7 == 0
+        return np.array([self.env_id, self.t], dtype=np.float32), float(self.t), done, {}
+
+    def reset(self):
+        return np.array([self.env_id, self.t], dtype=np.float32)
+
+
+class CounterModel(object):
+    initial_state = None
+
+    def step(self, obs, S=None, M=None):
+        values = obs[:, 1] * 10
+        return np.zeros(len(obs), dtype=np.int64), values, None, -values
+
+
+class CollectRunner(AsyncEnvRunner):
+    def run(self):
+        return self.collect()
+
+
+def test_async_env_runner():
+    nenv, nsteps = 4, 5
+    env = AsyncVecEnv([lambda env_id=env_id: CounterEnv(env_id) for env_id in range(nenv)], batch_size=1)
+    try:
+        runner = CollectRunner(env=env, model=CounterModel(), nsteps=nsteps)
+        for rollout_idx in range(3):
+            rollout, last, _ = runner.run()
+            # every environment contributes consecutive steps, whatever its speed
+            counters = np.broadcast_to(np.arange(nsteps)[:, None] + rollout_idx * nsteps, (nsteps, nenv))
+            np.testing.assert_array_equal(rollout['obs'][..., 0], np.broadcast_to(np.arange(nenv), (nsteps, nenv)))
+            np.testing.assert_array_equal(rollout['obs'][..., 1], counters)
+            np.testing.assert_array_equal(rollout['rewards'], counters + 1)
+            np.testing.assert_array_equal(rollout['values'], 10 * counters)
+            np.testing.assert_array_equal(rollout['dones'], (counters % 7 == 0) & (counters > 0))
+            np.testing.assert_array_equal(last['last_values'], 10 * (rollout_idx + 1) * nsteps)
+    finally:
+        env.close()
@@ -0,0 +1,108 @@
+import time
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from baselines.common.cg import cg, tf_cg
+from baselines.common.tf_util import make_session
+
+
+def _spd_system(n, cond, seed=0):
+    # symmetric positive definite matrix with a badly scaled diagonal
+    rng = np.random.RandomState(seed)
+    q = rng.randn(n, n) / np.sqrt(n)
+    scale = np.logspace(0, np.log10(cond), n)
+    A = np.diag(scale) + 0.1 * q.dot(q.T) * np.sqrt(np.outer(scale, scale))
+    return A, rng.randn(n)
+
+
+def test_cg():
+    A, b = _spd_system(20, 10.0)
+    x, info = cg(A.dot, b, cg_iters=100, return_info=True)
+    np.testing.assert_allclose(A.dot(x), b, rtol=1e-4, atol=1e-4)
+    assert info["converged"] and info["iters"] <= 20
+
+
+def test_cg_preconditioned():
+    A, b = _spd_system(50, 1e4)
+    _, info = cg(A.dot, b, cg_iters=200, return_info=True)
+    diag = np.diag(A)
+    x, info_precond = cg(A.dot, b, cg_iters=200, f_Minvx=lambda r: r / diag, return_info=True)
+    np.testing.assert_allclose(A.dot(x), b, rtol=1e-4, atol=1e-4)
+    assert info_precond["converged"]
+    assert info_precond["iters"] < info["iters"]
+
+
+def test_cg_early_exit():
+    A, b = _spd_system(20, 10.0)
+    calls = []
+    def f_Ax(p):
+        calls.append(p)
+        return A.dot(p)
+    _, info = cg(f_Ax, b, cg_iters=10, residual_tol=1e300, return_info=True)
+    assert info["iters"] == 1 and len(calls) == 1
+
+
+def test_cg_tiny_gradient():
+    # b.dot(b) is already below residual_tol, but a step still has to be taken
+    A, b = _spd_system(20, 10.0)
+    b = 1e-7 * b
+    x = cg(A.dot, b, cg_iters=10)
+    assert np.all(np.isfinite(x)) and np.any(x != 0)
+
+    with tf.Graph().as_default():
+        b_ph = tf.placeholder(tf.float64, [None])
+        f_Ax = lambda p: tf.squeeze(tf.matmul(A, p[:, None]), 1)
+        x, iters, _ = tf_cg(f_Ax, b_ph, cg_iters=10)
+        x, iters = make_session().run([x, iters], {b_ph: b})
+    assert iters == 1
+    assert np.all(np.isfinite(x)) and np.any(x != 0)
+
+
+@pytest.mark.parametrize('precondition', [False, True])
+def test_tf_cg(precondition):
+    A, b = _spd_system(30, 100.0)
+    A, b = A.astype(np.float32), b.astype(np.float32)
+    diag = np.diag(A)
+    x_ref, info = cg(A.dot, b, cg_iters=8, f_Minvx=(lambda r: r / diag) if precondition else None, return_info=True)
+
+    with tf.Graph().as_default():
+        b_ph = tf.placeholder(tf.float32, [None])
+        f_Ax = lambda p: tf.squeeze(tf.matmul(A, p[:, None]), 1)
+        f_Minvx = (lambda r: r / diag) if precondition else None
+        x, iters, residual = tf_cg(f_Ax, b_ph, cg_iters=8, f_Minvx=f_Minvx)
+        x, iters, residual = make_session().run([x, iters, residual], {b_ph: b})
+
+    assert iters == info["iters"]
+    np.testing.assert_allclose(residual, info["residual"], rtol=1e-3)
+    np.testing.assert_allclose(x, x_ref, rtol=1e-3, atol=1e-4)
+
+
+@pytest.mark.slow
+def test_cg_benchmark():
+    n, cg_iters, nrepeats = 500, 10, 5
+    A, b = _spd_system(n, 100.0)
+    A, b = A.astype(np.float32), b.astype(np.float32)
+
+    with tf.Graph().as_default():
+        A_var = tf.Variable(A)
+        p_ph = tf.placeholder(tf.float32, [None])
+        f_Ax = lambda p: tf.squeeze(tf.matmul(A_var, p[:, None]), 1)
+        Ap = f_Ax(p_ph)
+        x = tf_cg(f_Ax, p_ph, cg_iters=cg_iters, residual_tol=0)[0]
+        sess = make_session()
+        sess.run(A_var.initializer)
+
+        def time_min(fn):
+            times = []
+            for _ in range(nrepeats):
+                tstart = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - tstart)
+            return min(times)
+        session_per_product = time_min(lambda: cg(lambda p: sess.run(Ap, {p_ph: p}), b, cg_iters=cg_iters, residual_tol=0))
+        single_session = time_min(lambda: sess.run(x, {p_ph: b}))
+
+    print('{} iterations of cg on {} unknowns: session per product {:8.2f} ms, tf_cg {:8.2f} ms'.format(
+        cg_iters, n, 1e3 * session_per_product, 1e3 * single_session))
@@ -0,0 +1,66 @@
+import os
+
+import gym
+import numpy as np
+import pytest
+
+from baselines import logger
+from baselines.common.cpu_affinity import parse_cpulist, plan_affinity, process_cpu_time
+from baselines.common.vec_env import SubprocVecEnv, VecCpuMonitor
+
+
+def test_parse_cpulist():
+    assert parse_cpulist('0-3,8,10-11\n') == [0, 1, 2, 3, 8, 10, 11]
+    assert parse_cpulist('5') == [5]
+
+
+def test_plan_affinity():
+    nodes = [[0, 1, 2, 3], [4, 5, 6, 7, 8, 9]]
+    learner, workers = plan_affinity(7, learner_cores=2, cores=range(10), nodes=nodes)
+    # the larger node hosts the learner and the first workers
+    assert learner == [4, 5]
+    assert workers == [[6], [7], [8], [9], [0], [1], [2]]
+
+    learner, workers = plan_affinity(5, learner_cores=1, cores=[1, 2, 5], nodes=nodes)
+    assert learner == [1]
+    assert workers == [[2], [5], [2], [5], [2]]
+
+    learner, workers = plan_affinity(3, learner_cores=2, cores=[0, 1], nodes=nodes)
+    assert learner == [0, 1] and workers == [[0, 1]] * 3
+
+    # by default the learner keeps the cores the workers leave over
+    learner, workers = plan_affinity(4, cores=range(10), nodes=nodes)
+    assert learner == [4, 5, 6, 7, 8, 9]
+    assert workers == [[0], [1], [2], [3]]
+
+    learner, workers = plan_affinity(12, cores=range(10), nodes=nodes)
+    assert learner == [4]
+    assert len(workers) == 12 and [4] not in workers
+
+
+class BusyEnv(gym.Env):
+    observation_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    action_space = gym.spaces.Discrete(2)
+
+    def step(self, action):
+        sum(range(200000))
+        return np.zeros(1, dtype=np.float32), 0.0, False, {}
+
+    def reset(self):
+        return np.zeros(1, dtype=np.float32)
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason='needs /proc')
+def test_vec_cpu_monitor():
+    assert process_cpu_time(os.getpid()) > 0
+    env = VecCpuMonitor(SubprocVecEnv([BusyEnv, BusyEnv]), interval=0.0)
+    try:
+        env.reset()
+        for _ in range(20):
+            env.step(np.zeros(2, dtype=np.int64))
+        kvs = logger.getkvs()
+        assert set(kvs) >= {'misc/learner_cpu', 'misc/worker_cpu/0', 'misc/worker_cpu/1'}
+        assert 0.0 < kvs['misc/worker_cpu/0'] <= 1.5
+    finally:
+        env.close()
+        logger.dumpkvs()
@@ -0,0 +1,88 @@
+import gym
+import numpy as np
+import pytest
+
+from baselines import logger
+from baselines.common.runners import AbstractEnvRunner
+from baselines.common.vec_env import DoubleBufferedVecEnv, DummyVecEnv
+
+
+class WalkEnv(gym.Env):
+    """
+    Moves by the action, which is the parity of the observation,
+    and is done every few steps.
+    """
+    def __init__(self, env_id):
+        self.env_id = env_id
+        self.t = 0
+        self.pos = float(env_id)
+        self.observation_space = gym.spaces.Box(low=-1e6, high=1e6, shape=(2,), dtype=np.float32)
+        self.action_space = gym.spaces.Discrete(2)
+
+    def step(self, action):
+        self.t += 1
+        self.pos += 1 + 2 * action
+        done = self.t % (3 + self.env_id) == 0
+        info = {'episode': {'r': self.pos}} if done else {}
+        return self._obs(), self.pos, done, info
+
+    def reset(self):
+        return self._obs()
+
+    def _obs(self):
+        return np.array([self.env_id, self.pos], dtype=np.float32)
+
+
+class ParityModel(object):
+    initial_state = None
+
+    def step(self, obs, S=None, M=None):
+        actions = obs[:, 1].astype(np.int64) % 2
+        values = obs[:, 1] + 100 * np.asarray(M)
+        return actions, values, None, -values
+
+
+class StepRunner(AbstractEnvRunner):
+    def run(self):
+        obs, masks, outputs, rewards, infos = zip(*self.run_steps())
+        actions, values, _, neglogpacs = zip(*outputs)
+        return [np.array(x) for x in (obs, masks, actions, values, neglogpacs, rewards, infos)]
+
+
+@pytest.mark.parametrize('split', [1, 2, 4])
+def test_double_buffered_matches_lockstep(split):
+    nenv, nsteps = 5, 12
+    make = lambda env_ids: DummyVecEnv([lambda env_id=env_id: WalkEnv(env_id) for env_id in env_ids])
+    lockstep = StepRunner(env=make(range(nenv)), model=ParityModel(), nsteps=nsteps)
+    double = StepRunner(env=DoubleBufferedVecEnv(make(range(split)), make(range(split, nenv))),
+                        model=ParityModel(), nsteps=nsteps)
+    assert double.double_buffered
+    for _ in range(2):
+        for x, y in zip(lockstep.run(), double.run()):
+            np.testing.assert_array_equal(x, y)
+        np.testing.assert_array_equal(lockstep.obs, double.obs)
+        np.testing.assert_array_equal(lockstep.dones, double.dones)
+    overlap = logger.getkvs()['misc/env_overlap']
+    assert 0.0 <= overlap <= 1.0
+    logger.dumpkvs()
+
+
+class CountingModel(ParityModel):
+    def __init__(self):
+        self.rows = []
+
+    def step(self, obs, S=None, M=None):
+        self.rows.append(len(obs))
+        return super().step(obs, S, M)
+
+
+def test_double_buffered_steps_model_on_halves():
+    nenv, split, nsteps = 5, 2, 6
+    make = lambda env_ids: DummyVecEnv([lambda env_id=env_id: WalkEnv(env_id) for env_id in env_ids])
+    model = CountingModel()
+    runner = StepRunner(env=DoubleBufferedVecEnv(make(range(split)), make(range(split, nenv))),
+                        model=model, nsteps=nsteps)
+    runner.run()
+    # every environment is evaluated once per step
+    assert model.rows == [split, nenv - split] * nsteps
+    logger.dumpkvs()
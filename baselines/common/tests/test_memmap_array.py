@@ -0,0 +1,81 @@
+import tempfile
+import timeit
+
+import numpy as np
+import pytest
+
+from baselines.common.memmap_array import MemmapArray
+from baselines.ddpg.memory import Memory
+from baselines.her.replay_buffer import ReplayBuffer as HerReplayBuffer
+
+
+@pytest.mark.parametrize('cache_rows', [0, 1, 7, 64])
+def test_memmap_array_matches_ndarray(cache_rows):
+    rng = np.random.RandomState(0)
+    expected = np.zeros((50, 3), dtype=np.float32)
+    with tempfile.TemporaryDirectory() as td:
+        array = MemmapArray(expected.shape, dtype=np.float32, storage_dir=td, cache_rows=cache_rows)
+        for i in range(120):
+            value = rng.rand(3)
+            if i % 10 == 9:
+                idxs = rng.randint(50, size=4)
+                expected[idxs] = value
+                array[idxs] = value
+            else:
+                expected[i % 50] = value
+                array[i % 50] = value
+
+            idxs = rng.randint(50, size=(6, 2))
+            np.testing.assert_array_equal(array[idxs], expected[idxs])
+            np.testing.assert_array_equal(array[i % 50], expected[i % 50])
+        np.testing.assert_array_equal(array[:], expected)
+
+
+@pytest.mark.slow
+def test_memory_sample_benchmark():
+    limit, batch_size, obs_shape = 100000, 256, (64,)
+    with tempfile.TemporaryDirectory() as td:
+        for storage_dir in [None, td]:
+            memory = Memory(limit, action_shape=(6,), observation_shape=obs_shape, storage_dir=storage_dir)
+            obs, action = np.ones(obs_shape), np.ones(6)
+            append = timeit.timeit(lambda: memory.append(obs, action, 1.0, obs, 0.0), number=limit) / limit
+            sample = timeit.timeit(lambda: memory.sample(batch_size), number=1000) / 1000
+            print('{:8s}: append {:8.3f} us, sample({}) {:8.3f} ms'.format(
+                'memmap' if storage_dir else 'RAM', 1e6 * append, batch_size, 1e3 * sample))
+
+
+@pytest.mark.parametrize('n', [5, 25])
+def test_memory_save_load(tmpdir, n):
+    saved, loaded = Memory(20, (2,), (3,)), Memory(20, (2,), (3,))
+    for i in range(n):
+        saved.append(np.full(3, i), np.full(2, i), i, np.full(3, i + 1), 0.0)
+    saved.save(str(tmpdir))
+    loaded.load(str(tmpdir))
+    for name, buf in saved._ring_buffers().items():
+        other = loaded._ring_buffers()[name]
+        assert (buf.start, buf.length) == (other.start, other.length)
+        np.testing.assert_array_equal(buf.get_batch(np.arange(len(buf))), other.get_batch(np.arange(len(other))))
+
+
+def test_her_replay_buffer_write_cache(tmpdir):
+    shapes = {'o': (3, 2), 'u': (2, 1)}
+    ram = HerReplayBuffer(shapes, 16, 2, sample_transitions=None)
+    mapped = HerReplayBuffer(shapes, 16, 2, sample_transitions=None, storage_dir=str(tmpdir), cache_rows=4)
+    rng = np.random.RandomState(0)
+    for i in range(6):
+        episodes = {key: rng.rand(2, *shape) for key, shape in shapes.items()}
+        # once full, both buffers replace the same random episodes
+        np.random.seed(i)
+        ram.store_episode(episodes)
+        np.random.seed(i)
+        mapped.store_episode(episodes)
+        if i == 1:
+            # episodes written while the buffer fills up stay in the write cache
+            assert mapped.buffers['o']._dirty
+    for key in shapes:
+        np.testing.assert_array_equal(mapped.buffers[key][:], ram.buffers[key][:])
+
+
+if __name__ == '__main__':
+    test_memmap_array_matches_ndarray(7)
+    test_memory_sample_benchmark()
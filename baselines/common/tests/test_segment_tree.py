@@ -95,9 +95,34 @@ def test_max_interval_tree():
     assert np.isclose(tree.min(3, 4), 3.0)
 
 
+def test_batch_set():
+    rng = np.random.RandomState(0)
+    for tree_cls in [SumSegmentTree, MinSegmentTree]:
+        batch, single = tree_cls(64), tree_cls(64)
+        for _ in range(10):
+            idxs = rng.randint(64, size=20)
+            vals = rng.rand(20)
+            batch.set(idxs, vals)
+            for idx, val in zip(idxs, vals):
+                single[idx] = val
+            np.testing.assert_allclose(batch._value, single._value)
+
+
+def test_batch_prefixsum_idx():
+    tree = SumSegmentTree(4)
+
+    tree.set([0, 1, 2, 3], [0.5, 1.0, 1.0, 3.0])
+
+    masses = np.array([0.00, 0.55, 0.99, 1.51, 3.00, 5.50])
+    np.testing.assert_array_equal(tree.find_prefixsum_idx(masses), [0, 1, 1, 2, 3, 3])
+    assert [tree.find_prefixsum_idx(m) for m in masses] == [0, 1, 1, 2, 3, 3]
+
+
 if __name__ == '__main__':
     test_tree_set()
     test_tree_set_overlap()
     test_prefixsum_idx()
     test_prefixsum_idx2()
     test_max_interval_tree()
+    test_batch_set()
+    test_batch_prefixsum_idx()
@@ -0,0 +1,67 @@
+import timeit
+
+import numpy as np
+import pytest
+
+from baselines.deepq.replay_buffer import PrioritizedReplayBuffer, RankBasedPrioritizedReplayBuffer
+
+BUFFER_SIZE = 2 ** 17
+BATCH_SIZES = [32, 64, 128, 256, 512, 1024]
+
+
+def _make_buffer(buffer_class=PrioritizedReplayBuffer):
+    buffer = buffer_class(BUFFER_SIZE, alpha=0.6)
+    obs = np.zeros(4, dtype=np.float32)
+    for i in range(BUFFER_SIZE):
+        buffer.add(obs, 0, 0.0, obs, 0.0)
+    rng = np.random.RandomState(0)
+    for _ in range(BUFFER_SIZE // 1024):
+        buffer.update_priorities(rng.randint(BUFFER_SIZE, size=1024), rng.rand(1024) + 1e-6)
+    return buffer
+
+
+def _loop_weights(buffer, idxes, beta):
+    # per-index computation that sample() used before vectorization
+    weights = []
+    p_min = buffer._it_min.min() / buffer._it_sum.sum()
+    max_weight = (p_min * len(buffer)) ** (-beta)
+    for idx in idxes:
+        p_sample = buffer._it_sum[idx] / buffer._it_sum.sum()
+        weights.append((p_sample * len(buffer)) ** (-beta) / max_weight)
+    return np.array(weights)
+
+
+@pytest.mark.slow
+def test_prioritized_sample_benchmark():
+    buffer = _make_buffer()
+    number = 20
+    for batch_size in BATCH_SIZES:
+        sample = timeit.timeit(lambda: buffer.sample(batch_size, beta=0.4), number=number) / number
+        idxes = buffer._sample_proportional(batch_size)
+        update = timeit.timeit(lambda: buffer.update_priorities(idxes, np.ones(batch_size)), number=number) / number
+        loop = timeit.timeit(lambda: _loop_weights(buffer, idxes, 0.4), number=number) / number
+        print('batch {:5d}: sample {:8.3f} ms, update_priorities {:8.3f} ms, per-index weights {:8.3f} ms'.format(
+            batch_size, 1e3 * sample, 1e3 * update, 1e3 * loop))
+
+        _, _, _, _, _, weights, idxes = buffer.sample(batch_size, beta=0.4)
+        np.testing.assert_allclose(weights, _loop_weights(buffer, idxes, 0.4))
+
+
+@pytest.mark.slow
+def test_rank_based_sample_benchmark():
+    buffer = _make_buffer(RankBasedPrioritizedReplayBuffer)
+    number = 20
+    for batch_size in BATCH_SIZES:
+        sample = timeit.timeit(lambda: buffer.sample(batch_size, beta=0.4), number=number) / number
+        idxes = buffer.sample(batch_size, beta=0.4)[-1]
+        update = timeit.timeit(lambda: buffer.update_priorities(idxes, np.random.rand(batch_size) + 1e-6),
+                               number=number) / number
+        print('batch {:5d}: rank-based sample {:8.3f} ms, update_priorities {:8.3f} ms'.format(
+            batch_size, 1e3 * sample, 1e3 * update))
+    sort = timeit.timeit(buffer.sort, number=number) / number
+    print('rank-based sort of {} priorities {:8.3f} ms'.format(BUFFER_SIZE, 1e3 * sort))
+
+
+if __name__ == '__main__':
+    test_prioritized_sample_benchmark()
+    test_rank_based_sample_benchmark()
@@ -3,6 +3,8 @@ import tensorflow as tf
 from baselines.common.tf_util import (
     function,
     initialize,
+    linesearch_candidates,
+    shifted_variables_getter,
     single_threaded_session
 )
 
@@ -37,6 +39,42 @@ def test_multikwargs():
             assert lin(2, 2) == 10
 
 
+def test_shifted_variables_getter():
+    with tf.Graph().as_default():
+        with tf.variable_scope("model"):
+            w = tf.get_variable("w", initializer=tf.constant([[1.0, 2.0], [3.0, 4.0]]))
+            b = tf.get_variable("b", initializer=tf.constant([1.0]))
+        shift = tf.placeholder(tf.float32, [4])
+        with tf.variable_scope("model", reuse=True, custom_getter=shifted_variables_getter([w], shift)):
+            w_shifted = tf.get_variable("w")
+            b_shifted = tf.get_variable("b")
+
+        with single_threaded_session() as sess:
+            initialize()
+            w_val, b_val = sess.run([w_shifted, b_shifted], {shift: [1.0, 0.0, 0.0, -1.0]})
+            assert (w_val == [[2.0, 2.0], [3.0, 3.0]]).all()
+            assert b_shifted is b and b_val == 1.0
+
+
+def test_linesearch_candidates():
+    with tf.Graph().as_default():
+        with tf.variable_scope("model"):
+            w = tf.get_variable("w", initializer=tf.constant([1.0, 2.0]))
+        fullstep = tf.placeholder(tf.float32, [2])
+        def build_outputs():
+            v = tf.get_variable("w")
+            return [tf.reduce_sum(v), v[0]]
+        candidates = linesearch_candidates(build_outputs, [w], fullstep, 3, scope="model")
+
+        with single_threaded_session() as sess:
+            initialize()
+            values = sess.run(candidates, {fullstep: [4.0, 0.0]})
+            assert values.shape == (3, 2)
+            assert (values == [[7.0, 5.0], [5.0, 3.0], [4.0, 2.0]]).all()
+
+
 if __name__ == '__main__':
     test_function()
     test_multikwargs()
+    test_shifted_variables_getter()
+    test_linesearch_candidates()
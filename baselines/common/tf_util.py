@@ -4,7 +4,7 @@ import copy
 import os
 import functools
 import collections
-import multiprocessing
+from baselines.common.cpu_affinity import available_cores
 
 def switch(condition, then_expression, else_expression):
     """Switches between two operations depending on a scalar value (int or bool).
@@ -56,9 +56,10 @@ def get_session(config=None):
     return sess
 
 def make_session(config=None, num_cpu=None, make_default=False, graph=None):
-    """Returns a session that will use <num_cpu> CPU's only"""
+    """Returns a session that will use <num_cpu> CPU's only, by default the cores
+    the process may run on, e.g. after cmd_util.make_vec_env reserved them"""
     if num_cpu is None:
-        num_cpu = int(os.getenv('RCALL_NUM_CPU', multiprocessing.cpu_count()))
+        num_cpu = int(os.getenv('RCALL_NUM_CPU', len(available_cores())))
     if config is None:
         config = tf.ConfigProto(
             allow_soft_placement=True,
@@ -261,6 +262,36 @@ class GetFlat(object):
     def __call__(self):
         return tf.get_default_session().run(self.op)
 
+def shifted_variables_getter(var_list, flat_shift):
+    """Custom getter for tf.variable_scope, that reads every variable of var_list
+    as the variable plus its part of the flat tensor flat_shift - to build a model
+    at other parameters without assigning them. Other variables are unchanged."""
+    shifted = {}
+    start = 0
+    for v in var_list:
+        size = numel(v)
+        shifted[v.name] = v + tf.reshape(flat_shift[start:start + size], var_shape(v))
+        start += size
+
+    def getter(getter, *args, **kwargs):
+        v = getter(*args, **kwargs)
+        return shifted.get(v.name, v)
+    return getter
+
+def linesearch_candidates(build_outputs, var_list, fullstep, ncandidates, scope=None):
+    """Stack the outputs of build_outputs() at the parameters var_list + .5 ** i * fullstep, for the
+    ncandidates step sizes of a backtracking line search, into a [ncandidates, noutputs] tensor - so
+    that all of them are evaluated in one session call. build_outputs builds the model in the variable
+    scope scope (by default the current one), reusing its variables. Every candidate is a copy of the
+    model run on the whole input, so this takes about ncandidates times the memory of one evaluation."""
+    if scope is None:
+        scope = tf.get_variable_scope()
+    candidates = []
+    for i in range(ncandidates):
+        with tf.variable_scope(scope, reuse=True, custom_getter=shifted_variables_getter(var_list, .5 ** i * fullstep)):
+            candidates.append(tf.stack(build_outputs()))
+    return tf.stack(candidates)
+
 def flattenallbut0(x):
     return tf.reshape(x, [-1, intprod(x.get_shape().as_list()[1:])])
 
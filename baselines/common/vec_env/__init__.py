@@ -1,10 +1,13 @@
-from .vec_env import AlreadySteppingError, NotSteppingError, VecEnv, VecEnvWrapper, VecEnvObservationWrapper, CloudpickleWrapper
+from .vec_env import AlreadySteppingError, NotSteppingError, WorkerError, VecEnv, VecEnvWrapper, VecEnvObservationWrapper, CloudpickleWrapper
+from .async_vec_env import AsyncVecEnv
+from .double_buffered_vec_env import DoubleBufferedVecEnv
 from .dummy_vec_env import DummyVecEnv
 from .shmem_vec_env import ShmemVecEnv
 from .subproc_vec_env import SubprocVecEnv
+from .vec_cpu_monitor import VecCpuMonitor
 from .vec_frame_stack import VecFrameStack
 from .vec_monitor import VecMonitor
 from .vec_normalize import VecNormalize
 from .vec_remove_dict_obs import VecExtractDictObs
 
-__all__ = ['AlreadySteppingError', 'NotSteppingError', 'VecEnv', 'VecEnvWrapper', 'VecEnvObservationWrapper', 'CloudpickleWrapper', 'DummyVecEnv', 'ShmemVecEnv', 'SubprocVecEnv', 'VecFrameStack', 'VecMonitor', 'VecNormalize', 'VecExtractDictObs']
+__all__ = ['AlreadySteppingError', 'NotSteppingError', 'WorkerError', 'VecEnv', 'VecEnvWrapper', 'VecEnvObservationWrapper', 'CloudpickleWrapper', 'AsyncVecEnv', 'DoubleBufferedVecEnv', 'DummyVecEnv', 'ShmemVecEnv', 'SubprocVecEnv', 'VecCpuMonitor', 'VecFrameStack', 'VecMonitor', 'VecNormalize', 'VecExtractDictObs']
@@ -0,0 +1,122 @@
+import multiprocessing as mp
+from multiprocessing.connection import wait
+
+import numpy as np
+from .vec_env import VecEnv, CloudpickleWrapper, clear_mpi_env_vars
+from .subproc_vec_env import worker, _flatten_obs
+
+
+class AsyncVecEnv(VecEnv):
+    """
+    VecEnv that runs every environment in its own subprocess and hands out
+    the results of the first environments to finish their step, so that fast
+    environments do not wait for slow ones.
+
+    Besides the usual lockstep step_async/step_wait, environments are stepped
+    individually: send() starts steps of some environments and recv() returns
+    the results of the first batch_size of the running steps to finish,
+    together with the ids of their environments.
+    """
+    def __init__(self, env_fns, batch_size=None, context='spawn'):
+        """
+        Arguments:
+
+        env_fns: iterable of callables -  functions that create environments to run in subprocesses. Need to be cloud-pickleable
+        batch_size: int - number of results recv() waits for, defaults to half of the environments
+        """
+        self.closed = False
+        nenvs = len(env_fns)
+        self.batch_size = batch_size or max(1, nenvs // 2)
+        ctx = mp.get_context(context)
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(nenvs)])
+        self.ps = [ctx.Process(target=worker, args=(work_remote, remote, CloudpickleWrapper([env_fn])))
+                   for (work_remote, remote, env_fn) in zip(self.work_remotes, self.remotes, env_fns)]
+        for p in self.ps:
+            p.daemon = True  # if the main process crashes, we should not cause things to hang
+            with clear_mpi_env_vars():
+                p.start()
+        for remote in self.work_remotes:
+            remote.close()
+        self.remote_ids = {remote: i for i, remote in enumerate(self.remotes)}
+        self.in_flight = set()
+
+        self.remotes[0].send(('get_spaces_spec', None))
+        observation_space, action_space, self.spec = self.remotes[0].recv()
+        self.viewer = None
+        VecEnv.__init__(self, nenvs, observation_space, action_space)
+
+    def send(self, actions, env_ids):
+        """
+        Start a step of the environments env_ids with the given actions.
+        None of them may have a step running.
+        """
+        self._assert_not_closed()
+        for action, env_id in zip(actions, env_ids):
+            assert env_id not in self.in_flight, 'environment {} is already stepping'.format(env_id)
+            self.remotes[env_id].send(('step', [action]))
+            self.in_flight.add(env_id)
+
+    def recv(self, batch_size=None):
+        """
+        Wait for the first batch_size (by default self.batch_size) running
+        steps to finish, or for all of them if fewer are running.
+
+        Returns (obs, rews, dones, infos, env_ids), where the results of
+        environment env_ids[i] are at position i.
+        """
+        self._assert_not_closed()
+        batch_size = min(batch_size or self.batch_size, len(self.in_flight))
+        assert batch_size > 0, 'no environment is stepping'
+        results, env_ids = [], []
+        while len(env_ids) < batch_size:
+            for remote in wait([self.remotes[i] for i in self.in_flight]):
+                if len(env_ids) == batch_size:
+                    break
+                env_id = self.remote_ids[remote]
+                results.extend(remote.recv())
+                env_ids.append(env_id)
+                self.in_flight.remove(env_id)
+        obs, rews, dones, infos = zip(*results)
+        return _flatten_obs(obs), np.stack(rews), np.stack(dones), infos, np.array(env_ids)
+
+    def step_async(self, actions):
+        self.send(actions, range(self.num_envs))
+
+    def step_wait(self):
+        obs, rews, dones, infos, env_ids = self.recv(batch_size=self.num_envs)
+        order = np.argsort(env_ids)
+        if isinstance(obs, dict):
+            obs = {k: v[order] for k, v in obs.items()}
+        else:
+            obs = obs[order]
+        return obs, rews[order], dones[order], tuple(infos[i] for i in order)
+
+    def reset(self):
+        self._assert_not_closed()
+        if self.in_flight:
+            self.recv(batch_size=len(self.in_flight))
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        return _flatten_obs([ob for remote in self.remotes for ob in remote.recv()])
+
+    def close_extras(self):
+        self.closed = True
+        for env_id in self.in_flight:
+            self.remotes[env_id].recv()
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for p in self.ps:
+            p.join()
+
+    def get_images(self):
+        self._assert_not_closed()
+        for pipe in self.remotes:
+            pipe.send(('render', None))
+        return [img for pipe in self.remotes for img in pipe.recv()]
+
+    def _assert_not_closed(self):
+        assert not self.closed, "Trying to operate on an AsyncVecEnv after calling close()"
+
+    def __del__(self):
+        if not self.closed:
+            self.close()
@@ -0,0 +1,45 @@
+import numpy as np
+from .vec_env import VecEnv
+
+
+class DoubleBufferedVecEnv(VecEnv):
+    """
+    VecEnv made of two VecEnvs, which AbstractEnvRunner steps alternately:
+    one half of the environments steps while the policy is evaluated on the
+    observations of the other half (see AbstractEnvRunner.run_steps).
+
+    Used like any other VecEnv, step_async/step_wait step both halves at
+    once and concatenate the results. Wrappers that have to see every step,
+    such as VecNormalize or VecMonitor, have to wrap the halves, since
+    runners step the halves directly.
+    """
+    def __init__(self, venv0, venv1):
+        assert venv0.observation_space == venv1.observation_space
+        assert venv0.action_space == venv1.action_space
+        self.halves = (venv0, venv1)
+        VecEnv.__init__(self, venv0.num_envs + venv1.num_envs, venv0.observation_space, venv0.action_space)
+        self.slices = (slice(0, venv0.num_envs), slice(venv0.num_envs, self.num_envs))
+
+    def reset(self):
+        return _concat_obs([venv.reset() for venv in self.halves])
+
+    def step_async(self, actions):
+        for venv, half in zip(self.halves, self.slices):
+            venv.step_async(actions[half])
+
+    def step_wait(self):
+        obs, rews, dones, infos = zip(*[venv.step_wait() for venv in self.halves])
+        return _concat_obs(obs), np.concatenate(rews), np.concatenate(dones), infos[0] + infos[1]
+
+    def close_extras(self):
+        for venv in self.halves:
+            venv.close()
+
+    def get_images(self):
+        return [img for venv in self.halves for img in venv.get_images()]
+
+
+def _concat_obs(obs):
+    if isinstance(obs[0], dict):
+        return {k: np.concatenate([o[k] for o in obs]) for k in obs[0]}
+    return np.concatenate(obs)
@@ -3,8 +3,10 @@ An interface for asynchronous vectorized environments.
 """
 
 import multiprocessing as mp
+import time
 import numpy as np
-from .vec_env import VecEnv, CloudpickleWrapper, clear_mpi_env_vars
+from .vec_env import VecEnv, CloudpickleWrapper, WorkerError, clear_mpi_env_vars
+from .subproc_vec_env import recv_from_worker
 import ctypes
 from baselines import logger
 
@@ -16,18 +18,74 @@ _NP_TO_CT = {np.float32: ctypes.c_float,
              np.uint8: ctypes.c_char,
              np.bool: ctypes.c_bool}
 
+# commands a worker finds in its shared slot when woken up
+_CMD_PIPE = 0
+_CMD_STEP = 1
+
+
+class _StepSlots(object):
+    """
+    Shared memory for the actions, rewards and dones of all environments,
+    plus the semaphores through which the parent starts a step of a worker
+    and the worker reports back.
+    """
+
+    def __init__(self, ctx, num_envs, num_workers, action_space):
+        self._specs = {
+            'actions': ((num_envs,) + action_space.shape, np.dtype(action_space.dtype)),
+            'rews': ((num_envs,), np.dtype(np.float64)),
+            'dones': ((num_envs,), np.dtype(np.bool_)),
+        }
+        self._bufs = {name: ctx.RawArray(ctypes.c_byte, int(np.prod(shape)) * dtype.itemsize)
+                      for name, (shape, dtype) in self._specs.items()}
+        self.cmds = ctx.RawArray(ctypes.c_int8, num_workers)
+        self.has_infos = ctx.RawArray(ctypes.c_bool, num_workers)
+        self.start = [ctx.Semaphore(0) for _ in range(num_workers)]
+        self.finish = [ctx.Semaphore(0) for _ in range(num_workers)]
+
+    def arrays(self):
+        return {name: np.frombuffer(self._bufs[name], dtype=dtype).reshape(shape)
+                for name, (shape, dtype) in self._specs.items()}
+
 
 class ShmemVecEnv(VecEnv):
     """
     Optimized version of SubprocVecEnv that uses shared variables to communicate observations.
     """
 
-    def __init__(self, env_fns, spaces=None, context='spawn'):
+    def __init__(self, env_fns, spaces=None, context='spawn', envs_per_worker=1, borrow_obs=False,
+                 shared_step=False, step_timeout=None, auto_restart=False):
         """
         If you don't specify observation_space, we'll have to create a dummy
         environment to get it.
+
+        With envs_per_worker > 1, every subprocess steps that many consecutive
+        environments sequentially and writes their observations into one
+        shared block, so there is one message per worker instead of per env.
+
+        The observations of all environments live in one shared array of
+        shape (num_envs,) + obs_shape per key. reset() and step_wait() return
+        a copy of it, or with borrow_obs=True the shared array itself. A
+        borrowed observation is only valid until the next call to reset() or
+        step_async(), which is fine for callers that copy it right away (see
+        ppo2.runner.Runner); borrow_obs can also be set after construction.
+
+        With shared_step=True, actions, rewards and dones are exchanged through
+        shared arrays as well, and a step is started and awaited through one
+        semaphore pair per worker instead of pipe messages. Infos are only
+        pickled when one of the worker's environments returns a non-empty one,
+        e.g. when Monitor reports the 'episode' at the end of an episode.
+        Requires an action space with a fixed shape and dtype.
+
+        A worker that dies, or does not answer a step or reset within
+        step_timeout seconds, raises a WorkerError. With auto_restart=True it
+        is replaced by a new process with new instances of its environments
+        instead, whose step reports done=True and info['worker_restarted']=True.
+        The new process gets as long as it needs to start.
         """
-        ctx = mp.get_context(context)
+        self.ctx = ctx = mp.get_context(context)
+        self.step_timeout = step_timeout
+        self.auto_restart = auto_restart
         if spaces:
             observation_space, action_space = spaces
         else:
@@ -39,95 +97,225 @@ class ShmemVecEnv(VecEnv):
                 del dummy
         VecEnv.__init__(self, len(env_fns), observation_space, action_space)
         self.obs_keys, self.obs_shapes, self.obs_dtypes = obs_space_info(observation_space)
-        self.obs_bufs = [
-            {k: ctx.Array(_NP_TO_CT[self.obs_dtypes[k].type], int(np.prod(self.obs_shapes[k]))) for k in self.obs_keys}
-            for _ in env_fns]
-        self.parent_pipes = []
-        self.procs = []
-        with clear_mpi_env_vars():
-            for env_fn, obs_buf in zip(env_fns, self.obs_bufs):
-                wrapped_fn = CloudpickleWrapper(env_fn)
-                parent_pipe, child_pipe = ctx.Pipe()
-                proc = ctx.Process(target=_subproc_worker,
-                            args=(child_pipe, parent_pipe, wrapped_fn, obs_buf, self.obs_shapes, self.obs_dtypes, self.obs_keys))
-                proc.daemon = True
-                self.procs.append(proc)
-                self.parent_pipes.append(parent_pipe)
-                proc.start()
-                child_pipe.close()
+        env_fns = [env_fns[i:i + envs_per_worker] for i in range(0, len(env_fns), envs_per_worker)]
+        self.worker_slices = [slice(i, i + len(fns)) for i, fns in zip(range(0, self.num_envs, envs_per_worker), env_fns)]
+        self.obs_bufs = {k: ctx.Array(_NP_TO_CT[self.obs_dtypes[k].type], self.num_envs * int(np.prod(self.obs_shapes[k])))
+                         for k in self.obs_keys}
+        self.obs_np = {k: np.frombuffer(self.obs_bufs[k].get_obj(), dtype=self.obs_dtypes[k]).reshape(
+                       (self.num_envs,) + self.obs_shapes[k]) for k in self.obs_keys}
+        self.borrow_obs = borrow_obs
+        self.step_slots = None
+        if shared_step:
+            self.step_slots = _StepSlots(ctx, self.num_envs, len(env_fns), action_space)
+            self.step_np = self.step_slots.arrays()
+        self.env_fns = [CloudpickleWrapper(fns) for fns in env_fns]
+        self.parent_pipes, self.procs = [None] * len(env_fns), [None] * len(env_fns)
+        for worker in range(len(env_fns)):
+            self._start_worker(worker)
         self.waiting_step = False
         self.viewer = None
 
+    def _start_worker(self, worker):
+        parent_pipe, child_pipe = self.ctx.Pipe()
+        proc = self.ctx.Process(target=_subproc_worker,
+                    args=(child_pipe, parent_pipe, self.env_fns[worker], self.obs_bufs, self.worker_slices[worker],
+                          self.obs_shapes, self.obs_dtypes, self.obs_keys, self.step_slots, worker))
+        proc.daemon = True
+        with clear_mpi_env_vars():
+            proc.start()
+        child_pipe.close()
+        self.parent_pipes[worker], self.procs[worker] = parent_pipe, proc
+
+    def _restart_worker(self, worker, error):
+        """
+        Replace a worker that failed with the given WorkerError and reset
+        its environments, whose observations are written to the shared
+        arrays.
+        """
+        if not self.auto_restart:
+            raise WorkerError('ShmemVecEnv worker {} {}'.format(worker, error)) from error
+        logger.warn('Restarting ShmemVecEnv worker {}, which {}'.format(worker, error))
+        self.procs[worker].terminate()
+        self.procs[worker].join()
+        self.parent_pipes[worker].close()
+        if self.step_slots is not None:
+            # drop the wake-ups the failed worker left behind
+            for sem in (self.step_slots.start[worker], self.step_slots.finish[worker]):
+                while sem.acquire(False):
+                    pass
+        self._start_worker(worker)
+        self._send(worker, ('reset', None))
+        # starting a process can take longer than a step, so only wait for the reset without a timeout
+        recv_from_worker(self.parent_pipes[worker], self.procs[worker])
+
+    def _send(self, worker, msg):
+        if self.step_slots is not None:
+            # wake the worker up to read the pipe
+            self.step_slots.cmds[worker] = _CMD_PIPE
+            self.step_slots.start[worker].release()
+        try:
+            self.parent_pipes[worker].send(msg)
+        except (BrokenPipeError, ConnectionError):
+            pass  # the worker died, which _recv will report
+
+    def _recv(self, worker, restart=True):
+        """
+        Receive the answer of a worker, or None if the worker failed
+        and was restarted.
+        """
+        try:
+            return recv_from_worker(self.parent_pipes[worker], self.procs[worker], self.step_timeout)
+        except WorkerError as e:
+            if not restart:
+                raise
+            self._restart_worker(worker, e)
+            return None
+
+    def _wait_finish(self, worker):
+        deadline = None if self.step_timeout is None else time.monotonic() + self.step_timeout
+        while True:
+            poll_time = 1.0 if deadline is None else min(1.0, max(deadline - time.monotonic(), 0.0))
+            if self.step_slots.finish[worker].acquire(timeout=poll_time):
+                return
+            if not self.procs[worker].is_alive():
+                raise WorkerError('died')
+            if deadline is not None and time.monotonic() >= deadline:
+                raise WorkerError('did not answer within {} seconds'.format(self.step_timeout))
+
     def reset(self):
         if self.waiting_step:
             logger.warn('Called reset() while waiting for the step to complete')
             self.step_wait()
-        for pipe in self.parent_pipes:
-            pipe.send(('reset', None))
-        return self._decode_obses([pipe.recv() for pipe in self.parent_pipes])
+        for worker in range(len(self.parent_pipes)):
+            self._send(worker, ('reset', None))
+        return self._decode_obses([self._recv(worker) for worker in range(len(self.parent_pipes))])
 
     def step_async(self, actions):
-        assert len(actions) == len(self.parent_pipes)
-        for pipe, act in zip(self.parent_pipes, actions):
-            pipe.send(('step', act))
+        assert len(actions) == self.num_envs
+        if self.step_slots is not None:
+            self.step_np['actions'][:] = actions
+            for worker, start in enumerate(self.step_slots.start):
+                self.step_slots.cmds[worker] = _CMD_STEP
+                start.release()
+        else:
+            for worker, worker_slice in enumerate(self.worker_slices):
+                self._send(worker, ('step', actions[worker_slice]))
+        self.waiting_step = True
 
     def step_wait(self):
-        outs = [pipe.recv() for pipe in self.parent_pipes]
+        self.waiting_step = False
+        if self.step_slots is not None:
+            return self._step_wait_shared()
+        outs = []
+        for worker, worker_slice in enumerate(self.worker_slices):
+            out = self._recv(worker)
+            if out is None:
+                out = [(None, 0.0, True, {'worker_restarted': True}) for _ in range(worker_slice.stop - worker_slice.start)]
+            outs.extend(out)
         obs, rews, dones, infos = zip(*outs)
         return self._decode_obses(obs), np.array(rews), np.array(dones), infos
 
+    def _step_wait_shared(self):
+        infos = [{} for _ in range(self.num_envs)]
+        for worker, worker_slice in enumerate(self.worker_slices):
+            try:
+                self._wait_finish(worker)
+                worker_infos = self._recv(worker, restart=False) if self.step_slots.has_infos[worker] else []
+            except WorkerError as e:
+                self._restart_worker(worker, e)
+                self.step_np['rews'][worker_slice] = 0.0
+                self.step_np['dones'][worker_slice] = True
+                worker_infos = [(i, {'worker_restarted': True}) for i in range(worker_slice.stop - worker_slice.start)]
+            for i, info in worker_infos:
+                infos[worker_slice.start + i] = info
+        return (self._decode_obses(None), self.step_np['rews'].copy(), self.step_np['dones'].copy(),
+                tuple(infos))
+
     def close_extras(self):
         if self.waiting_step:
-            self.step_wait()
-        for pipe in self.parent_pipes:
-            pipe.send(('close', None))
-        for pipe in self.parent_pipes:
-            pipe.recv()
+            try:
+                self.step_wait()
+            except WorkerError:
+                pass
+        for worker in range(len(self.parent_pipes)):
+            self._send(worker, ('close', None))
+        for worker, pipe in enumerate(self.parent_pipes):
+            try:
+                recv_from_worker(pipe, self.procs[worker], self.step_timeout)
+            except WorkerError:
+                pass
             pipe.close()
         for proc in self.procs:
-            proc.join()
+            proc.join(self.step_timeout)
+            if proc.is_alive():
+                proc.terminate()
 
     def get_images(self, mode='human'):
-        for pipe in self.parent_pipes:
-            pipe.send(('render', None))
-        return [pipe.recv() for pipe in self.parent_pipes]
+        for worker in range(len(self.parent_pipes)):
+            self._send(worker, ('render', None))
+        return [img for pipe in self.parent_pipes for img in pipe.recv()]
 
     def _decode_obses(self, obs):
-        result = {}
-        for k in self.obs_keys:
-
-            bufs = [b[k] for b in self.obs_bufs]
-            o = [np.frombuffer(b.get_obj(), dtype=self.obs_dtypes[k]).reshape(self.obs_shapes[k]) for b in bufs]
-            result[k] = np.array(o)
+        if self.borrow_obs:
+            result = dict(self.obs_np)
+        else:
+            result = {k: self.obs_np[k].copy() for k in self.obs_keys}
         return dict_to_obs(result)
 
 
-def _subproc_worker(pipe, parent_pipe, env_fn_wrapper, obs_bufs, obs_shapes, obs_dtypes, keys):
+def _subproc_worker(pipe, parent_pipe, env_fn_wrappers, obs_bufs, obs_slice, obs_shapes, obs_dtypes, keys,
+                    step_slots=None, worker=0):
     """
-    Control a single environment instance using IPC and
-    shared memory.
+    Control the environment instances of one worker using IPC and
+    shared memory. The environments are stepped sequentially and every
+    command is answered with a single message, except for steps through
+    step_slots, which are answered through shared memory.
     """
-    def _write_obs(maybe_dict_obs):
+    obs_np = {k: np.frombuffer(obs_bufs[k].get_obj(), dtype=obs_dtypes[k]).reshape((-1,) + obs_shapes[k])[obs_slice]
+              for k in keys}
+
+    def _write_obs(i, maybe_dict_obs):
         flatdict = obs_to_dict(maybe_dict_obs)
         for k in keys:
-            dst = obs_bufs[k].get_obj()
-            dst_np = np.frombuffer(dst, dtype=obs_dtypes[k]).reshape(obs_shapes[k])  # pylint: disable=W0212
-            np.copyto(dst_np, flatdict[k])
+            np.copyto(obs_np[k][i], flatdict[k])
+
+    def _step_env(i, env, action):
+        obs, reward, done, info = env.step(action)
+        if done:
+            obs = env.reset()
+        return _write_obs(i, obs), reward, done, info
+
+    def _step_shared():
+        infos = []
+        for i, env in enumerate(envs):
+            _, step_np['rews'][i], step_np['dones'][i], info = _step_env(i, env, step_np['actions'][i])
+            if info:
+                infos.append((i, info))
+        # the parent may only read the pipe once it is woken up, so wake it
+        # before sending, which may block on a full pipe
+        step_slots.has_infos[worker] = bool(infos)
+        step_slots.finish[worker].release()
+        if infos:
+            pipe.send(infos)
 
-    env = env_fn_wrapper.x()
+    if step_slots is not None:
+        step_np = {name: array[obs_slice] for name, array in step_slots.arrays().items()}
+    envs = [env_fn() for env_fn in env_fn_wrappers.x]
     parent_pipe.close()
     try:
         while True:
+            if step_slots is not None:
+                step_slots.start[worker].acquire()
+                if step_slots.cmds[worker] == _CMD_STEP:
+                    _step_shared()
+                    continue
             cmd, data = pipe.recv()
             if cmd == 'reset':
-                pipe.send(_write_obs(env.reset()))
+                pipe.send([_write_obs(i, env.reset()) for i, env in enumerate(envs)])
             elif cmd == 'step':
-                obs, reward, done, info = env.step(data)
-                if done:
-                    obs = env.reset()
-                pipe.send((_write_obs(obs), reward, done, info))
+                pipe.send([_step_env(i, env, action) for i, (env, action) in enumerate(zip(envs, data))])
             elif cmd == 'render':
-                pipe.send(env.render(mode='rgb_array'))
+                pipe.send([env.render(mode='rgb_array') for env in envs])
             elif cmd == 'close':
                 pipe.send(None)
                 break
@@ -136,4 +324,5 @@ def _subproc_worker(pipe, parent_pipe, env_fn_wrapper, obs_bufs, obs_shapes, obs
     except KeyboardInterrupt:
         print('ShmemVecEnv worker: got KeyboardInterrupt')
     finally:
-        env.close()
+        for env in envs:
+            env.close()
@@ -1,101 +1,157 @@
 import multiprocessing as mp
+import time
 
 import numpy as np
-from .vec_env import VecEnv, CloudpickleWrapper, clear_mpi_env_vars
+from baselines import logger
+from .vec_env import VecEnv, CloudpickleWrapper, WorkerError, clear_mpi_env_vars
 
 
-def worker(remote, parent_remote, env_fn_wrapper):
+def worker(remote, parent_remote, env_fn_wrappers):
+    """
+    Step the environments of one worker sequentially and answer every
+    command with a single message holding the results of all of them.
+    """
+    def step_env(env, action):
+        ob, reward, done, info = env.step(action)
+        if done:
+            ob = env.reset()
+        return ob, reward, done, info
+
     parent_remote.close()
-    env = env_fn_wrapper.x()
+    envs = [env_fn() for env_fn in env_fn_wrappers.x]
     try:
         while True:
             cmd, data = remote.recv()
             if cmd == 'step':
-                ob, reward, done, info = env.step(data)
-                if done:
-                    ob = env.reset()
-                remote.send((ob, reward, done, info))
+                remote.send([step_env(env, action) for env, action in zip(envs, data)])
             elif cmd == 'reset':
-                ob = env.reset()
-                remote.send(ob)
+                remote.send([env.reset() for env in envs])
             elif cmd == 'render':
-                remote.send(env.render(mode='rgb_array'))
+                remote.send([env.render(mode='rgb_array') for env in envs])
             elif cmd == 'close':
                 remote.close()
                 break
             elif cmd == 'get_spaces_spec':
-                remote.send((env.observation_space, env.action_space, env.spec))
+                remote.send((envs[0].observation_space, envs[0].action_space, envs[0].spec))
             else:
                 raise NotImplementedError
     except KeyboardInterrupt:
         print('SubprocVecEnv worker: got KeyboardInterrupt')
     finally:
-        env.close()
+        for env in envs:
+            env.close()
 
 class SubprocVecEnv(VecEnv):
     """
     VecEnv that runs multiple environments in parallel in subproceses and communicates with them via pipes.
     Recommended to use when num_envs > 1 and step() can be a bottleneck.
     """
-    def __init__(self, env_fns, spaces=None, context='spawn'):
+    def __init__(self, env_fns, spaces=None, context='spawn', envs_per_worker=1, step_timeout=None, auto_restart=False):
         """
         Arguments:
 
         env_fns: iterable of callables -  functions that create environments to run in subprocesses. Need to be cloud-pickleable
+        envs_per_worker: int - number of environments stepped sequentially by every subprocess. Consecutive
+                         environments share a worker and the last worker may get fewer of them. Larger values
+                         trade parallelism for fewer processes and messages, which pays off for cheap environments.
+        step_timeout: float - seconds to wait for a worker to answer a step or reset, None to wait forever. A restarted
+                      worker gets as long as it needs to start.
+        auto_restart: bool - replace a worker that died or timed out by a new process with new instances of its
+                      environments, whose step reports done=True and info['worker_restarted']=True. Otherwise
+                      a WorkerError is raised.
         """
-        self.waiting = False
+        self.waiting = set()  # workers whose step results have not been received
         self.closed = False
         nenvs = len(env_fns)
-        ctx = mp.get_context(context)
-        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(nenvs)])
-        self.ps = [ctx.Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
-                   for (work_remote, remote, env_fn) in zip(self.work_remotes, self.remotes, env_fns)]
-        for p in self.ps:
-            p.daemon = True  # if the main process crashes, we should not cause things to hang
-            with clear_mpi_env_vars():
-                p.start()
-        for remote in self.work_remotes:
-            remote.close()
+        self.ctx = mp.get_context(context)
+        self.step_timeout = step_timeout
+        self.auto_restart = auto_restart
+        self.env_fns = [CloudpickleWrapper(env_fns[i:i + envs_per_worker]) for i in range(0, nenvs, envs_per_worker)]
+        self.worker_slices = [slice(i, i + envs_per_worker) for i in range(0, nenvs, envs_per_worker)]
+        self.remotes, self.ps = [None] * len(self.env_fns), [None] * len(self.env_fns)
+        for i in range(len(self.env_fns)):
+            self._start_worker(i)
 
         self.remotes[0].send(('get_spaces_spec', None))
         observation_space, action_space, self.spec = self.remotes[0].recv()
         self.viewer = None
-        VecEnv.__init__(self, len(env_fns), observation_space, action_space)
+        VecEnv.__init__(self, nenvs, observation_space, action_space)
+
+    def _start_worker(self, i):
+        remote, work_remote = self.ctx.Pipe()
+        p = self.ctx.Process(target=worker, args=(work_remote, remote, self.env_fns[i]))
+        p.daemon = True  # if the main process crashes, we should not cause things to hang
+        with clear_mpi_env_vars():
+            p.start()
+        work_remote.close()
+        self.remotes[i], self.ps[i] = remote, p
+
+    def _restart_worker(self, i, error):
+        """
+        Replace worker i, which failed with the given WorkerError,
+        and return the observations after resetting its environments.
+        """
+        if not self.auto_restart:
+            raise WorkerError('SubprocVecEnv worker {} {}'.format(i, error)) from error
+        logger.warn('Restarting SubprocVecEnv worker {}, which {}'.format(i, error))
+        self.ps[i].terminate()
+        self.ps[i].join()
+        self.remotes[i].close()
+        self._start_worker(i)
+        self.remotes[i].send(('reset', None))
+        # starting a process can take longer than a step, so only wait for the reset without a timeout
+        return recv_from_worker(self.remotes[i], self.ps[i])
 
     def step_async(self, actions):
         self._assert_not_closed()
-        for remote, action in zip(self.remotes, actions):
-            remote.send(('step', action))
-        self.waiting = True
+        for remote, worker_slice in zip(self.remotes, self.worker_slices):
+            _send_to_worker(remote, ('step', actions[worker_slice]))
+        self.waiting = set(range(len(self.remotes)))
 
     def step_wait(self):
         self._assert_not_closed()
-        results = [remote.recv() for remote in self.remotes]
-        self.waiting = False
+        results = []
+        for i, (remote, p) in enumerate(zip(self.remotes, self.ps)):
+            try:
+                results.extend(recv_from_worker(remote, p, self.step_timeout))
+            except WorkerError as e:
+                self.waiting.discard(i)
+                results.extend((ob, 0.0, True, {'worker_restarted': True}) for ob in self._restart_worker(i, e))
+            self.waiting.discard(i)
         obs, rews, dones, infos = zip(*results)
         return _flatten_obs(obs), np.stack(rews), np.stack(dones), infos
 
     def reset(self):
         self._assert_not_closed()
         for remote in self.remotes:
-            remote.send(('reset', None))
-        return _flatten_obs([remote.recv() for remote in self.remotes])
+            _send_to_worker(remote, ('reset', None))
+        obs = []
+        for i, (remote, p) in enumerate(zip(self.remotes, self.ps)):
+            try:
+                obs.extend(recv_from_worker(remote, p, self.step_timeout))
+            except WorkerError as e:
+                obs.extend(self._restart_worker(i, e))
+        return _flatten_obs(obs)
 
     def close_extras(self):
         self.closed = True
-        if self.waiting:
-            for remote in self.remotes:
-                remote.recv()
+        for i in self.waiting:
+            try:
+                recv_from_worker(self.remotes[i], self.ps[i], self.step_timeout)
+            except WorkerError:
+                pass
         for remote in self.remotes:
-            remote.send(('close', None))
+            _send_to_worker(remote, ('close', None))
         for p in self.ps:
-            p.join()
+            p.join(self.step_timeout)
+            if p.is_alive():
+                p.terminate()
 
     def get_images(self):
         self._assert_not_closed()
         for pipe in self.remotes:
             pipe.send(('render', None))
-        imgs = [pipe.recv() for pipe in self.remotes]
+        imgs = _flatten_list([pipe.recv() for pipe in self.remotes])
         return imgs
 
     def _assert_not_closed(self):
@@ -105,6 +161,38 @@ class SubprocVecEnv(VecEnv):
         if not self.closed:
             self.close()
 
+def _send_to_worker(remote, msg):
+    try:
+        remote.send(msg)
+    except (BrokenPipeError, ConnectionError):
+        pass  # the worker died, which recv_from_worker will report
+
+def recv_from_worker(remote, proc, timeout=None):
+    """
+    Receive a message from the worker process proc through remote,
+    raising WorkerError if the process dies or does not send anything
+    within timeout seconds.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        poll_time = 1.0 if deadline is None else min(1.0, max(deadline - time.monotonic(), 0.0))
+        if remote.poll(poll_time):
+            try:
+                return remote.recv()
+            except (EOFError, ConnectionError):
+                raise WorkerError('died')
+        if not proc.is_alive() and not remote.poll():
+            raise WorkerError('died')
+        if deadline is not None and time.monotonic() >= deadline:
+            raise WorkerError('did not answer within {} seconds'.format(timeout))
+
+def _flatten_list(l):
+    assert isinstance(l, (list, tuple))
+    assert len(l) > 0
+    assert all([len(l_) > 0 for l_ in l])
+
+    return [l__ for l_ in l for l__ in l_]
+
 def _flatten_obs(obs):
     assert isinstance(obs, (list, tuple))
     assert len(obs) > 0
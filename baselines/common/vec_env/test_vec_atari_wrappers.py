@@ -0,0 +1,54 @@
+"""
+Tests for the vectorized Atari preprocessing.
+"""
+
+import gym
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+from baselines.common.atari_wrappers import ClipRewardEnv, MaxAndSkipEnv, WarpFrame  # noqa: E402
+from .dummy_vec_env import DummyVecEnv  # noqa: E402
+from .vec_atari_wrappers import wrap_deepmind_vec  # noqa: E402
+
+
+class RandomFrameEnv(gym.Env):
+    """
+    Returns random RGB frames and rewards.
+    """
+    observation_space = gym.spaces.Box(low=0, high=255, shape=(210, 160, 3), dtype=np.uint8)
+    action_space = gym.spaces.Discrete(2)
+
+    def __init__(self, seed):
+        self.rng = np.random.RandomState(seed)
+        self.t = 0
+
+    def step(self, action):
+        self.t += 1
+        reward = float(self.rng.randint(-3, 4))
+        return self._frame(), reward, self.t % 11 == 0, {}
+
+    def reset(self):
+        return self._frame()
+
+    def _frame(self):
+        return self.rng.randint(0, 256, size=self.observation_space.shape).astype(np.uint8)
+
+
+@pytest.mark.parametrize('num_envs', (1, 3, 200))
+def test_wrap_deepmind_vec(num_envs):
+    """
+    Test that preprocessing the batch gives the same frames and
+    rewards as the per-env wrappers.
+    """
+    per_env = DummyVecEnv([lambda seed=seed: ClipRewardEnv(WarpFrame(MaxAndSkipEnv(RandomFrameEnv(seed))))
+                           for seed in range(num_envs)])
+    batched = wrap_deepmind_vec(DummyVecEnv([lambda seed=seed: MaxAndSkipEnv(RandomFrameEnv(seed), max_pool=False)
+                                             for seed in range(num_envs)]))
+    assert batched.observation_space == per_env.observation_space
+    np.testing.assert_array_equal(batched.reset(), per_env.reset())
+    actions = np.zeros(num_envs, dtype=np.int64)
+    for _ in range(5):
+        for x, y in zip(batched.step(actions)[:3], per_env.step(actions)[:3]):
+            np.testing.assert_array_equal(x, y)
@@ -2,12 +2,20 @@
 Tests for asynchronous vectorized environments.
 """
 
+import os
+import time
+
 import gym
 import numpy as np
 import pytest
+from .async_vec_env import AsyncVecEnv
+from .double_buffered_vec_env import DoubleBufferedVecEnv
 from .dummy_vec_env import DummyVecEnv
 from .shmem_vec_env import ShmemVecEnv
+from .vec_env import WorkerError
 from .subproc_vec_env import SubprocVecEnv
+from .vec_frame_stack import VecFrameStack
+from .vec_normalize import VecNormalize
 from baselines.common.tests.test_with_mpi import with_mpi
 
 
@@ -44,7 +52,7 @@ def assert_venvs_equal(venv1, venv2, num_steps):
         venv2.close()
 
 
-@pytest.mark.parametrize('klass', (ShmemVecEnv, SubprocVecEnv))
+@pytest.mark.parametrize('klass', (ShmemVecEnv, SubprocVecEnv, AsyncVecEnv))
 @pytest.mark.parametrize('dtype', ('uint8', 'float32'))
 def test_vec_env(klass, dtype):  # pylint: disable=R0914
     """
@@ -67,6 +75,332 @@ def test_vec_env(klass, dtype):  # pylint: disable=R0914
     assert_venvs_equal(env1, env2, num_steps=num_steps)
 
 
+@pytest.mark.parametrize('klass', (ShmemVecEnv, SubprocVecEnv))
+@pytest.mark.parametrize('envs_per_worker', (2, 5))
+def test_vec_env_envs_per_worker(klass, envs_per_worker):
+    """
+    Test that stepping several environments per worker,
+    including a last worker with fewer of them, is equivalent
+    to DummyVecEnv.
+    """
+    num_envs = 5
+    shape = (3, 8)
+
+    def make_fn(seed):
+        return lambda: SimpleEnv(seed, shape, 'float32')
+    fns = [make_fn(i) for i in range(num_envs)]
+    env1 = DummyVecEnv(fns)
+    env2 = klass(fns, envs_per_worker=envs_per_worker)
+    assert_venvs_equal(env1, env2, num_steps=50)
+
+
+def test_shmem_vec_env_borrow_obs():
+    """
+    Test that borrowed observations are the shared buffer
+    itself and copies are not.
+    """
+    shape = (3, 8)
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, 'float32') for seed in range(4)]
+    env1 = DummyVecEnv(fns)
+    env2 = ShmemVecEnv(fns, envs_per_worker=2, borrow_obs=True)
+    try:
+        obs = env2.reset()
+        assert np.shares_memory(obs, env2.reset())
+        env2.borrow_obs = False
+        assert not np.shares_memory(obs, env2.reset())
+    finally:
+        env2.close()
+    env2 = ShmemVecEnv(fns, borrow_obs=True)
+    assert_venvs_equal(env1, env2, num_steps=20)
+
+
+@pytest.mark.parametrize('envs_per_worker', (1, 2))
+@pytest.mark.parametrize('dtype', ('uint8', 'float32'))
+def test_shmem_vec_env_shared_step(envs_per_worker, dtype):
+    """
+    Test that exchanging actions, rewards and dones through
+    shared memory is equivalent to DummyVecEnv.
+    """
+    shape = (3, 8)
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, dtype) for seed in range(3)]
+    env1 = DummyVecEnv(fns)
+    env2 = ShmemVecEnv(fns, envs_per_worker=envs_per_worker, shared_step=True)
+    assert_venvs_equal(env1, env2, num_steps=100)
+
+
+def test_double_buffered_vec_env():
+    """
+    Test that stepping both halves at once is equivalent
+    to DummyVecEnv.
+    """
+    shape = (3, 8)
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, 'float32') for seed in range(5)]
+    env1 = DummyVecEnv(fns)
+    env2 = DoubleBufferedVecEnv(ShmemVecEnv(fns[:2]), SubprocVecEnv(fns[2:]))
+    assert_venvs_equal(env1, env2, num_steps=50)
+
+
+def test_async_vec_env_first_ready():
+    """
+    Test that recv() returns the environments that finish
+    first, with their ids.
+    """
+    shape = (2,)
+    delays = [0.5, 0.0, 0.5, 0.0]
+    fns = [lambda seed=seed: SlowEnv(SimpleEnv(seed, shape, 'float32'), delays[seed]) for seed in range(4)]
+    env1 = DummyVecEnv(fns)
+    env2 = AsyncVecEnv(fns, batch_size=2)
+    try:
+        np.testing.assert_allclose(env1.reset(), env2.reset())
+        actions = np.ones((4,) + shape, dtype=np.float32)
+        env2.send(actions, range(4))
+        obs, rews, dones, infos, env_ids = env2.recv()
+        assert sorted(env_ids) == [1, 3]
+        outs1 = env1.step(actions)
+        np.testing.assert_allclose(obs, outs1[0][env_ids])
+        np.testing.assert_allclose(rews, outs1[1][env_ids])
+        assert list(infos) == [outs1[3][i] for i in env_ids]
+        env2.send(actions[env_ids], env_ids)
+        _, _, _, _, env_ids = env2.recv(batch_size=4)
+        assert sorted(env_ids) == [0, 1, 2, 3]
+    finally:
+        env1.close()
+        env2.close()
+
+
+def _roll_frame_stack(stackedobs, obs, news):
+    # the np.roll implementation VecFrameStack used to have, shifting by a
+    # whole frame rather than by one channel
+    stackedobs = np.roll(stackedobs, shift=-obs.shape[-1], axis=-1)
+    stackedobs[news] = 0
+    stackedobs[..., -obs.shape[-1]:] = obs
+    return stackedobs
+
+
+@pytest.mark.parametrize('lazy', (False, True))
+@pytest.mark.parametrize('nstack', (1, 4))
+def test_vec_frame_stack(lazy, nstack):
+    """
+    Test that the ring buffer of VecFrameStack stacks
+    like np.roll, including the zeroing of finished envs.
+    """
+    shape = (2, 3, 2)
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, 'float32') for seed in range(3)]
+    inner, env = DummyVecEnv(fns), VecFrameStack(DummyVecEnv(fns), nstack, lazy=lazy)
+    obs = inner.reset()
+    expected = _roll_frame_stack(np.zeros(shape[:-1] + (2 * nstack,), np.float32)[None].repeat(3, 0), obs, [])
+    stacked = env.reset()
+    np.testing.assert_array_equal(stacked, expected)
+    for _ in range(20):
+        actions = np.ones((3,) + shape, dtype=np.float32)
+        obs, _, news, _ = inner.step(actions)
+        expected = _roll_frame_stack(expected, obs, news)
+        stacked, _, _, _ = env.step(actions)
+        np.testing.assert_array_equal(stacked, expected)
+        assert np.shares_memory(stacked, env.frames) == lazy
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('num_envs', (8, 64))
+def test_vec_frame_stack_benchmark(num_envs):
+    """
+    Time the stacking of Atari frames with np.roll
+    against the ring buffer of VecFrameStack.
+    """
+    import timeit
+    obs = np.ones((num_envs, 84, 84, 1), dtype=np.uint8)
+    news = np.arange(num_envs) % 50 == 0
+    venv = DummyVecEnv([CheapEnv])
+    venv.num_envs, venv.observation_space = num_envs, gym.spaces.Box(0, 255, (84, 84, 1), dtype=np.uint8)
+    venv.step_wait = lambda: (obs, np.zeros(num_envs), news, [{}] * num_envs)
+    stackedobs = np.zeros((num_envs, 84, 84, 4), dtype=np.uint8)
+    roll = timeit.timeit(lambda: _roll_frame_stack(stackedobs, obs, news), number=200) / 200
+    for lazy in (False, True):
+        env = VecFrameStack(venv, 4, lazy=lazy)
+        ring = timeit.timeit(env.step_wait, number=200) / 200
+        print('{:3d} envs, lazy={}: np.roll {:.3f} ms, ring buffer {:.3f} ms'.format(num_envs, lazy, 1e3 * roll, 1e3 * ring))
+
+
+@pytest.mark.parametrize('klass, kwargs', ((SubprocVecEnv, {}), (ShmemVecEnv, {}),
+                                           (ShmemVecEnv, {'shared_step': True})))
+@pytest.mark.parametrize('fault', ('crash', 'hang'))
+def test_vec_env_auto_restart(klass, kwargs, fault):
+    """
+    Test that a worker that crashes or hangs is replaced,
+    with its environments reporting done, while the other
+    workers are unaffected.
+    """
+    shape = (2,)
+    fns = [lambda seed=seed: FaultyEnv(SimpleEnv(seed, shape, 'float32'), fault if seed == 1 else None, 3)
+           for seed in range(3)]
+    env1 = DummyVecEnv([lambda seed=seed: SimpleEnv(seed, shape, 'float32') for seed in range(3)])
+    env2 = klass(fns, step_timeout=1.0, auto_restart=True, **kwargs)
+    try:
+        start_obs = env1.reset()
+        env2.reset()
+        actions = np.ones((3,) + shape, dtype=np.float32)
+        for step in range(1, 5):
+            outs1, outs2 = env1.step(actions), env2.step(actions)
+            if step == 3:
+                np.testing.assert_array_equal(outs2[0][1], start_obs[1])
+                assert outs2[1][1] == 0.0 and outs2[2][1]
+                assert outs2[3][1] == {'worker_restarted': True}
+            for i in (0, 2):
+                np.testing.assert_allclose(outs1[0][i], outs2[0][i])
+                np.testing.assert_allclose(outs1[1][i], outs2[1][i])
+                assert outs1[2][i] == outs2[2][i] and outs1[3][i] == outs2[3][i]
+    finally:
+        env1.close()
+        env2.close()
+
+
+@pytest.mark.parametrize('kwargs', ({}, {'shared_step': True}))
+def test_shmem_vec_env_restart_infos(kwargs):
+    """
+    Test that the environments of a restarted worker get an info
+    dict each, so that wrappers can write into them.
+    """
+    shape = (2,)
+    fns = [lambda seed=seed: FaultyEnv(SimpleEnv(seed, shape, 'float32'), 'crash' if seed == 0 else None, 2)
+           for seed in range(4)]
+    env = ShmemVecEnv(fns, envs_per_worker=2, step_timeout=1.0, auto_restart=True, **kwargs)
+    try:
+        env.reset()
+        actions = np.ones((4,) + shape, dtype=np.float32)
+        env.step(actions)
+        infos = env.step(actions)[3]
+        assert infos[0] == infos[1] == {'worker_restarted': True}
+        infos[0]['episode'] = {'r': 1.0}
+        assert infos[1] == {'worker_restarted': True}
+    finally:
+        env.close()
+
+
+@pytest.mark.parametrize('klass', (SubprocVecEnv, ShmemVecEnv))
+def test_vec_env_worker_error(klass):
+    """
+    Test that a crashed worker raises a WorkerError
+    instead of blocking when restarts are off.
+    """
+    fns = [lambda seed=seed: FaultyEnv(SimpleEnv(seed, (2,), 'float32'), 'crash' if seed == 1 else None, 1)
+           for seed in range(2)]
+    env = klass(fns)
+    try:
+        env.reset()
+        with pytest.raises(WorkerError):
+            env.step(np.ones((2, 2), dtype=np.float32))
+    finally:
+        env.close()
+
+
+class _ReferenceNormalize(object):
+    # the statistics and normalization VecNormalize used to compute
+    def __init__(self, shape, clip=10., epsilon=1e-8):
+        self.mean, self.var, self.count = np.zeros(shape), np.ones(shape), 1e-4
+        self.clip, self.epsilon = clip, epsilon
+
+    def __call__(self, x, update=True):
+        if update:
+            batch_mean, batch_var, batch_count = np.mean(x, axis=0), np.var(x, axis=0), x.shape[0]
+            delta, tot_count = batch_mean - self.mean, self.count + batch_count
+            m2 = self.var * self.count + batch_var * batch_count + np.square(delta) * self.count * batch_count / tot_count
+            self.mean, self.var, self.count = self.mean + delta * batch_count / tot_count, m2 / tot_count, tot_count
+        return np.clip((x - self.mean) / np.sqrt(self.var + self.epsilon), -self.clip, self.clip)
+
+
+class GaussianEnv(gym.Env):
+    """
+    Observes offset and scaled Gaussian noise.
+    """
+    action_space = gym.spaces.Discrete(2)
+
+    def __init__(self, seed, dim):
+        self.rng = np.random.RandomState(seed)
+        self.observation_space = gym.spaces.Box(low=-np.inf, high=np.inf, shape=(dim,), dtype=np.float32)
+        self.offset, self.scale = 100 * self.rng.randn(dim), np.exp(self.rng.randn(dim))
+
+    def step(self, action):
+        return self.reset(), self.rng.randn(), self.rng.rand() < 0.05, {}
+
+    def reset(self):
+        return (self.offset + self.scale * self.rng.randn(*self.observation_space.shape)).astype(np.float32)
+
+
+@pytest.mark.parametrize('update_freq', (1, 3))
+def test_vec_normalize(update_freq):
+    """
+    Test that the fused statistics and normalization of
+    VecNormalize match the separate computations.
+    """
+    dim = 7
+    env = VecNormalize(DummyVecEnv([lambda seed=seed: GaussianEnv(seed, dim) for seed in range(4)]),
+                       ret=False, update_freq=update_freq)
+    inner = DummyVecEnv([lambda seed=seed: GaussianEnv(seed, dim) for seed in range(4)])
+    reference = _ReferenceNormalize((dim,))
+    np.testing.assert_allclose(env.reset(), reference(inner.reset()), rtol=1e-6, atol=1e-6)
+    actions = np.zeros(4, dtype=np.int64)
+    for step in range(1, 30):
+        obs = env.step(actions)[0]
+        np.testing.assert_allclose(obs, reference(inner.step(actions)[0], update=step % update_freq == 0),
+                                   rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(env.ob_rms.var, reference.var, rtol=1e-6)
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('num_envs, dim', ((16, 128), (64, 376)))
+def test_vec_normalize_benchmark(num_envs, dim):
+    """
+    Time the separate and the fused statistics and
+    normalization of VecNormalize.
+    """
+    import timeit
+    obs = GaussianEnv(0, dim).offset + np.random.randn(num_envs, dim).astype(np.float32)
+    env = VecNormalize(DummyVecEnv([lambda: GaussianEnv(0, dim)] * num_envs), ret=False)
+    reference = _ReferenceNormalize((dim,))
+    separate = timeit.timeit(lambda: reference(obs), number=2000) / 2000
+    fused = timeit.timeit(lambda: env._obfilt(obs), number=2000) / 2000
+    env.update_freq = 4
+    every4 = timeit.timeit(lambda: env._filter(obs, np.zeros(num_envs), np.zeros(num_envs, dtype=bool)),
+                           number=2000) / 2000
+    print('{:3d} envs x {:3d} dims: separate {:6.1f} us, fused {:6.1f} us, fused with update_freq=4 {:6.1f} us'.format(
+        num_envs, dim, 1e6 * separate, 1e6 * fused, 1e6 * every4))
+
+
+class FaultyEnv(gym.Wrapper):
+    """
+    Wrapper that kills its process or hangs at a given step.
+    """
+
+    def __init__(self, env, fault, fault_step):
+        super().__init__(env)
+        self._fault = fault
+        self._fault_step = fault_step
+        self._steps = 0
+
+    def step(self, action):
+        self._steps += 1
+        if self._steps == self._fault_step:
+            if self._fault == 'crash':
+                os._exit(1)
+            elif self._fault == 'hang':
+                time.sleep(60)
+        return self.env.step(action)
+
+
+class SlowEnv(gym.Wrapper):
+    """
+    Wrapper that delays every step.
+    """
+
+    def __init__(self, env, delay):
+        super().__init__(env)
+        self._delay = delay
+
+    def step(self, action):
+        time.sleep(self._delay)
+        return self.env.step(action)
+
+
 class SimpleEnv(gym.Env):
     """
     An environment with a pre-determined observation space
@@ -103,6 +437,45 @@ class SimpleEnv(gym.Env):
 
 
 
+class CheapEnv(gym.Env):
+    """
+    An environment that does next to nothing, to measure the
+    overhead of a vectorized environment.
+    """
+    observation_space = gym.spaces.Box(low=-1, high=1, shape=(4,), dtype=np.float32)
+    action_space = gym.spaces.Discrete(2)
+
+    def __init__(self):
+        self._obs = np.zeros(4, dtype=np.float32)
+        self._steps = 0
+
+    def step(self, action):
+        self._steps += 1
+        done = self._steps % 200 == 0
+        return self._obs, 1.0, done, {'episode': {'l': 200}} if done else {}
+
+    def reset(self):
+        return self._obs
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('num_envs', (8, 32))
+def test_shmem_vec_env_benchmark(num_envs):
+    actions = np.zeros(num_envs, dtype=np.int64)
+    for kwargs in [dict(), dict(shared_step=True)]:
+        venv = ShmemVecEnv([CheapEnv] * num_envs, **kwargs)
+        venv.reset()
+        for _ in range(100):
+            venv.step(actions)
+        num_steps = 2000
+        tstart = time.time()
+        for _ in range(num_steps):
+            venv.step(actions)
+        fps = num_steps * num_envs / (time.time() - tstart)
+        venv.close()
+        print('ShmemVecEnv {} envs {}: {:.0f} steps/sec'.format(num_envs, kwargs, fps))
+
+
 @with_mpi()
 def test_mpi_with_subprocvecenv():
     shape = (2,3,4)
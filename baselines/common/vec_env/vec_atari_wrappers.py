@@ -0,0 +1,91 @@
+"""
+Vectorized versions of the frame preprocessing of atari_wrappers, which
+process the frames of all environments at once in the main process, so that
+env workers only run the emulator. See cmd_util.make_vec_env(vec_preprocessing=True).
+"""
+
+import numpy as np
+from gym import spaces
+import cv2
+from .vec_env import VecEnvWrapper
+
+cv2.ocl.setUseOpenCL(False)
+
+
+class VecMaxAndSkip(VecEnvWrapper):
+    """
+    Max-pooling half of atari_wrappers.MaxAndSkipEnv: the environments skip
+    frames with MaxAndSkipEnv(max_pool=False), which returns the last two
+    raw frames, and this wrapper takes their maximum for all environments.
+    """
+    def __init__(self, venv):
+        wos = venv.observation_space
+        assert wos.shape[0] == 2, 'expected pairs of frames, see MaxAndSkipEnv(max_pool=False)'
+        observation_space = spaces.Box(low=wos.low[0], high=wos.high[0], dtype=wos.dtype)
+        VecEnvWrapper.__init__(self, venv, observation_space=observation_space)
+
+    def reset(self):
+        return np.maximum(*np.moveaxis(self.venv.reset(), 1, 0))
+
+    def step_wait(self):
+        obs, rews, dones, infos = self.venv.step_wait()
+        return np.maximum(*np.moveaxis(obs, 1, 0)), rews, dones, infos
+
+
+class VecWarpFrame(VecEnvWrapper):
+    """
+    atari_wrappers.WarpFrame for all environments at once. The color
+    conversion runs once on the frames stacked into one tall image, the
+    resize still runs frame by frame, as cv2 gives no faster way that
+    matches INTER_AREA exactly.
+    """
+    def __init__(self, venv, width=84, height=84, grayscale=True):
+        wos = venv.observation_space
+        assert wos.dtype == np.uint8 and len(wos.shape) == 3
+        self._width = width
+        self._height = height
+        self._grayscale = grayscale
+        observation_space = spaces.Box(low=0, high=255, shape=(height, width, 1 if grayscale else 3), dtype=np.uint8)
+        VecEnvWrapper.__init__(self, venv, observation_space=observation_space)
+
+    def _warp(self, frames):
+        nenv, h, w, c = frames.shape
+        if self._grayscale:
+            frames = cv2.cvtColor(np.ascontiguousarray(frames).reshape(nenv * h, w, c), cv2.COLOR_RGB2GRAY)
+            frames = frames.reshape(nenv, h, w)
+        out = np.empty((nenv,) + self.observation_space.shape, dtype=np.uint8)
+        for frame, warped in zip(frames, out):
+            warped[...] = cv2.resize(frame, (self._width, self._height),
+                                     interpolation=cv2.INTER_AREA).reshape(warped.shape)
+        return out
+
+    def reset(self):
+        return self._warp(self.venv.reset())
+
+    def step_wait(self):
+        obs, rews, dones, infos = self.venv.step_wait()
+        return self._warp(obs), rews, dones, infos
+
+
+class VecClipReward(VecEnvWrapper):
+    """
+    atari_wrappers.ClipRewardEnv for all environments at once.
+    """
+    def reset(self):
+        return self.venv.reset()
+
+    def step_wait(self):
+        obs, rews, dones, infos = self.venv.step_wait()
+        return obs, np.sign(rews), dones, infos
+
+
+def wrap_deepmind_vec(venv, clip_rewards=True):
+    """
+    Preprocessing of atari_wrappers.wrap_deepmind that is left out by
+    wrap_deepmind(warp_frame=False, clip_rewards=False) when the
+    environments are made with make_atari(max_pool=False).
+    """
+    venv = VecWarpFrame(VecMaxAndSkip(venv))
+    if clip_rewards:
+        venv = VecClipReward(venv)
+    return venv
@@ -0,0 +1,51 @@
+import os
+import time
+
+from . import VecEnvWrapper
+from baselines import logger
+from baselines.common.cpu_affinity import process_cpu_time
+
+
+class VecCpuMonitor(VecEnvWrapper):
+    """
+    Logs the CPU utilisation of the learner (misc/learner_cpu) and of every
+    worker process of a SubprocVecEnv, ShmemVecEnv or AsyncVecEnv
+    (misc/worker_cpu/<i>), as the fraction of a core used since the last
+    sample. Samples are taken at most every interval seconds and averaged
+    over the logger's dump period.
+    """
+    def __init__(self, venv, interval=10.0):
+        VecEnvWrapper.__init__(self, venv)
+        self.interval = interval
+        self.last_sample = None
+        self.cpu_times = {}
+
+    def _worker_pids(self):
+        venv = self.venv.unwrapped
+        procs = getattr(venv, 'procs', None) or getattr(venv, 'ps', None) or []
+        return [proc.pid for proc in procs]
+
+    def _sample(self):
+        now = time.time()
+        cpu_times = {'learner': sum(os.times()[:2])}
+        for i, pid in enumerate(self._worker_pids()):
+            cpu_times[i, pid] = process_cpu_time(pid)
+        if self.last_sample is not None:
+            elapsed = now - self.last_sample
+            for key, cpu_time in cpu_times.items():
+                # restarted workers have a new pid and are only reported from their second sample on
+                if cpu_time is not None and self.cpu_times.get(key) is not None:
+                    name = 'misc/learner_cpu' if key == 'learner' else 'misc/worker_cpu/{}'.format(key[0])
+                    logger.logkv_mean(name, (cpu_time - self.cpu_times[key]) / elapsed)
+        self.last_sample, self.cpu_times = now, cpu_times
+
+    def reset(self):
+        obs = self.venv.reset()
+        self._sample()
+        return obs
+
+    def step_wait(self):
+        obs, rews, dones, infos = self.venv.step_wait()
+        if self.last_sample is None or time.time() - self.last_sample >= self.interval:
+            self._sample()
+        return obs, rews, dones, infos
@@ -26,6 +26,13 @@ class NotSteppingError(Exception):
         Exception.__init__(self, msg)
 
 
+class WorkerError(Exception):
+    """
+    Raised when a worker process of a vectorized environment
+    dies or does not answer in time.
+    """
+
+
 class VecEnv(ABC):
     """
     An abstract asynchronous, vectorized environment.
@@ -6,30 +6,54 @@ class VecFrameStack(VecEnvWrapper):
     """
     Vectorized environment base class
     """
-    def __init__(self, venv, nstack):
+    def __init__(self, venv, nstack, lazy=False):
+        """
+        The last nstack frames of every environment are kept in a ring of
+        2 * nstack slots, every frame being written to two slots nstack
+        apart, so that the stack in channel order is always a slice of the
+        ring and a step only writes the new frame.
+
+        reset() and step_wait() return a copy of the stack, or with lazy=True
+        a view of the ring itself. A lazy observation is only valid until the
+        next call to reset() or step_wait(), which is fine for callers that
+        copy it right away (see ppo2.runner.Runner).
+        """
         self.venv = venv
         self.nstack = nstack
+        self.lazy = lazy
         wos = venv.observation_space # wrapped ob space
         low = np.repeat(wos.low, self.nstack, axis=-1)
         high = np.repeat(wos.high, self.nstack, axis=-1)
-        self.stackedobs = np.zeros((venv.num_envs,)+low.shape, low.dtype)
+        self.frames = np.zeros((venv.num_envs,) + wos.shape[:-1] + (2 * nstack, wos.shape[-1]), low.dtype)
+        self.head = nstack - 1
         observation_space = spaces.Box(low=low, high=high, dtype=venv.observation_space.dtype)
         VecEnvWrapper.__init__(self, venv, observation_space=observation_space)
 
+    @property
+    def stackedobs(self):
+        """
+        View of the current stacks, with the oldest frame first.
+        """
+        window = self.frames[..., self.head + 1:self.head + 1 + self.nstack, :]
+        return window.reshape(window.shape[:-2] + (-1,))
+
+    def _push(self, obs):
+        self.head = (self.head + 1) % self.nstack
+        self.frames[..., self.head, :] = obs
+        self.frames[..., self.head + self.nstack, :] = obs
+        return self.stackedobs if self.lazy else self.stackedobs.copy()
+
     def step_wait(self):
         obs, rews, news, infos = self.venv.step_wait()
-        self.stackedobs = np.roll(self.stackedobs, shift=-1, axis=-1)
-        for (i, new) in enumerate(news):
-            if new:
-                self.stackedobs[i] = 0
-        self.stackedobs[..., -obs.shape[-1]:] = obs
-        return self.stackedobs, rews, news, infos
+        dones = np.asarray(news, dtype=bool)
+        if dones.any():
+            self.frames[dones] = 0
+        return self._push(obs), rews, news, infos
 
     def reset(self):
         """
         Reset all environments
         """
         obs = self.venv.reset()
-        self.stackedobs[...] = 0
-        self.stackedobs[..., -obs.shape[-1]:] = obs
-        return self.stackedobs
+        self.frames[...] = 0
+        return self._push(obs)
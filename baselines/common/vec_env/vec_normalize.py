@@ -1,4 +1,5 @@
 from . import VecEnvWrapper
+from baselines.common.math_util import shifted_moments
 import numpy as np
 
 class VecNormalize(VecEnvWrapper):
@@ -6,7 +7,13 @@ class VecNormalize(VecEnvWrapper):
     Vectorized environment base class
     """
 
-    def __init__(self, venv, ob=True, ret=True, clipob=10., cliprew=10., gamma=0.99, epsilon=1e-8, use_tf=False):
+    def __init__(self, venv, ob=True, ret=True, clipob=10., cliprew=10., gamma=0.99, epsilon=1e-8, use_tf=False,
+                 update_freq=1):
+        """
+        The observation and return statistics are updated with every
+        update_freq-th batch, and all batches are normalized with the
+        latest statistics.
+        """
         VecEnvWrapper.__init__(self, venv)
         if use_tf:
             from baselines.common.running_mean_std import TfRunningMeanStd
@@ -21,6 +28,10 @@ class VecNormalize(VecEnvWrapper):
         self.ret = np.zeros(self.num_envs)
         self.gamma = gamma
         self.epsilon = epsilon
+        self.update_freq = update_freq
+        self.num_batches = 0
+        # x - mean of the current batch in float64
+        self._ob_delta = None
 
     def step_wait(self):
         """
@@ -30,12 +41,7 @@ class VecNormalize(VecEnvWrapper):
         where 'news' is a boolean vector indicating whether each element is new.
         """
         obs, rews, news, infos = self.venv.step_wait()
-        self.ret = self.ret * self.gamma + rews
-        obs = self._obfilt(obs)
-        if self.ret_rms:
-            self.ret_rms.update(self.ret)
-            rews = np.clip(rews / np.sqrt(self.ret_rms.var + self.epsilon), -self.cliprew, self.cliprew)
-        self.ret[news] = 0.
+        obs, rews = self._filter(obs, rews, news)
         return obs, rews, news, infos
 
     def step_wait_collisions(self):
@@ -46,31 +52,50 @@ class VecNormalize(VecEnvWrapper):
         where 'news' is a boolean vector indicating whether each element is new.
         """
         obs, rews, news, collisions, infos = self.venv.step_wait_collisions()
-        self.ret = self.ret * self.gamma + rews
-        obs = self._obfilt(obs)
-        if self.ret_rms:
-            self.ret_rms.update(self.ret)
-            rews = np.clip(rews / np.sqrt(self.ret_rms.var + self.epsilon), -self.cliprew, self.cliprew)
-        self.ret[news] = 0.
+        obs, rews = self._filter(obs, rews, news)
         return obs, rews, news, collisions, infos
 
     def step_wait_runtime(self):
         obs, rews, news, infos = self.venv.step_wait_runtime()
+        obs, rews = self._filter(obs, rews, news)
+        return obs, rews, news, infos
+
+    def _next_batch(self):
+        """
+        Count a batch of observations and tell whether it updates the statistics.
+        """
+        update = self.num_batches % self.update_freq == 0
+        self.num_batches += 1
+        return update
+
+    def _filter(self, obs, rews, news):
+        update = self._next_batch()
         self.ret = self.ret * self.gamma + rews
-        obs = self._obfilt(obs)
+        obs = self._obfilt(obs, update)
         if self.ret_rms:
-            self.ret_rms.update(self.ret)
+            if update:
+                self.ret_rms.update(self.ret)
             rews = np.clip(rews / np.sqrt(self.ret_rms.var + self.epsilon), -self.cliprew, self.cliprew)
         self.ret[news] = 0.
-        return obs, rews, news, infos
+        return obs, rews
 
-    def _obfilt(self, obs):
-        if self.ob_rms:
-            self.ob_rms.update(obs)
-            obs = np.clip((obs - self.ob_rms.mean) / np.sqrt(self.ob_rms.var + self.epsilon), -self.clipob, self.clipob)
+    def _obfilt(self, obs, update=True):
+        if not self.ob_rms:
             return obs
+        if self._ob_delta is None or self._ob_delta.shape != obs.shape:
+            self._ob_delta = np.empty(obs.shape, dtype=np.float64)
+        if update:
+            # the differences to the old mean give the batch moments, then are shifted to the new mean
+            old_mean = self.ob_rms.mean
+            batch_mean, batch_var, delta = shifted_moments(obs, old_mean, out=self._ob_delta)
+            self.ob_rms.update_from_moments(batch_mean, batch_var, obs.shape[0])
+            delta -= self.ob_rms.mean - old_mean
         else:
-            return obs
+            delta = self._ob_delta
+            delta[...] = obs
+            delta -= self.ob_rms.mean
+        delta *= 1.0 / np.sqrt(self.ob_rms.var + self.epsilon)
+        return np.clip(delta, -self.clipob, self.clipob)
 
     def _obfilt_run(self, obs):
         if self.ob_rms:
@@ -82,4 +107,4 @@ class VecNormalize(VecEnvWrapper):
     def reset(self):
         self.ret = np.zeros(self.num_envs)
         obs = self.venv.reset()
-        return self._obfilt(obs)
+        return self._obfilt(obs, self._next_batch())
@@ -8,6 +8,7 @@ from baselines.ddpg.models import Actor, Critic
 from baselines.ddpg.memory import Memory
 from baselines.ddpg.noise import AdaptiveParamNoiseSpec, NormalActionNoise, OrnsteinUhlenbeckActionNoise
 from baselines.common import set_global_seeds
+from baselines.common.memmap_array import has_saved_state, clear_saved_state, save_arrays, load_state
 import baselines.common.tf_util as U
 
 from baselines import logger
@@ -42,7 +43,18 @@ def learn(network, env,
           tau=0.01,
           eval_env=None,
           param_noise_adaption_interval=50,
+          memory_storage_dir=None,
+          memory_storage_cache_rows=1024,
+          memory_checkpoint_path=None,
+          memory_checkpoint_interval=1,
           **network_kwargs):
+    """
+    With memory_checkpoint_path, every memory_checkpoint_interval epochs the agent (networks, target networks,
+    normalization statistics and optimizer state), the memory and the epoch and step counters are saved together
+    to memory_checkpoint_path/rank<MPI rank>, and training resumes from there when it starts. The memory is
+    rewritten in full and synchronously on every save, up to 1e6 transitions, which stalls training for the time
+    it takes to write it to disk.
+    """
 
     set_global_seeds(seed)
 
@@ -60,7 +72,14 @@ def learn(network, env,
     nb_actions = env.action_space.shape[-1]
     assert (np.abs(env.action_space.low) == env.action_space.high).all()  # we assume symmetric actions.
 
-    memory = Memory(limit=int(1e6), action_shape=env.action_space.shape, observation_shape=env.observation_space.shape)
+    memory = Memory(limit=int(1e6), action_shape=env.action_space.shape, observation_shape=env.observation_space.shape,
+                    storage_dir=memory_storage_dir, cache_rows=memory_storage_cache_rows)
+    if memory_checkpoint_path is not None:
+        # every MPI worker has a memory of its own; the agent, the memory and the counters to resume from
+        # are saved together and the state written last marks a complete save
+        memory_checkpoint_path = os.path.join(memory_checkpoint_path, 'rank{}'.format(rank))
+        checkpoint_model_file = os.path.join(memory_checkpoint_path, 'model')
+        checkpoint_memory_dir = os.path.join(memory_checkpoint_path, 'memory')
     critic = Critic(network=network, **network_kwargs)
     actor = Actor(nb_actions, network=network, **network_kwargs)
 
@@ -99,6 +118,22 @@ def learn(network, env,
     sess = U.get_session()
     # Prepare everything.
     agent.initialize(sess)
+    epoch_start = 0
+    t = 0 # scalar
+    episodes = 0 #scalar
+    if memory_checkpoint_path is not None and has_saved_state(memory_checkpoint_path):
+        # before the graph is finalized, loading the variables adds assign ops
+        resume_state = load_state(memory_checkpoint_path)
+        U.load_variables(checkpoint_model_file, sess=sess)
+        memory.load(checkpoint_memory_dir)
+        for optimizer, (m, v, optimizer_t) in zip([agent.actor_optimizer, agent.critic_optimizer], resume_state['optimizers']):
+            optimizer.m, optimizer.v, optimizer.t = m, v, optimizer_t
+        if param_noise is not None:
+            param_noise.current_stddev = resume_state['param_noise_stddev']
+        epoch_start, t, episodes = resume_state['epoch'], resume_state['t'], resume_state['episodes']
+        episode_rewards_history.extend(resume_state['episode_rewards_history'])
+        eval_episode_rewards_history.extend(resume_state['eval_episode_rewards_history'])
+        logger.info('Resuming from epoch {} with {} transitions in the memory'.format(epoch_start, memory.nb_entries))
     sess.graph.finalize()
 
     agent.reset()
@@ -110,12 +145,7 @@ def learn(network, env,
 
     episode_reward = np.zeros(nenvs, dtype = np.float32) #vector
     episode_step = np.zeros(nenvs, dtype = int) # vector
-    episodes = 0 #scalar
-    t = 0 # scalar
-
-    epoch = 0
-
-
+    t_start = t
 
     start_time = time.time()
 
@@ -124,7 +154,7 @@ def learn(network, env,
     epoch_actions = []
     epoch_qs = []
     epoch_episodes = 0
-    for epoch in range(nb_epochs):
+    for epoch in range(epoch_start, nb_epochs):
         for cycle in range(nb_epoch_cycles):
             # Perform rollouts.
             if nenvs > 1:
@@ -152,7 +182,7 @@ def learn(network, env,
                 # Book-keeping.
                 epoch_actions.append(action)
                 epoch_qs.append(q)
-                agent.store_transition(obs, action, r, new_obs, done) #the batched data will be unrolled in memory.py's append.
+                agent.store_transition(obs, action, r, new_obs, done)
 
                 obs = new_obs
 
@@ -227,7 +257,7 @@ def learn(network, env,
         combined_stats['train/loss_critic'] = np.mean(epoch_critic_losses)
         combined_stats['train/param_noise_distance'] = np.mean(epoch_adaptive_distances)
         combined_stats['total/duration'] = duration
-        combined_stats['total/steps_per_second'] = float(t) / float(duration)
+        combined_stats['total/steps_per_second'] = float(t - t_start) / float(duration)
         combined_stats['total/episodes'] = episodes
         combined_stats['rollout/episodes'] = epoch_episodes
         combined_stats['rollout/actions_std'] = np.std(epoch_actions)
@@ -262,6 +292,17 @@ def learn(network, env,
         if rank == 0:
             logger.dump_tabular()
         logger.info('')
+        if memory_checkpoint_path is not None and (epoch + 1) % memory_checkpoint_interval == 0:
+            clear_saved_state(memory_checkpoint_path)
+            U.save_variables(checkpoint_model_file, sess=sess)
+            memory.save(checkpoint_memory_dir)
+            save_arrays(memory_checkpoint_path, {}, {
+                'epoch': epoch + 1, 't': t, 'episodes': episodes,
+                'episode_rewards_history': list(episode_rewards_history),
+                'eval_episode_rewards_history': list(eval_episode_rewards_history),
+                'optimizers': [(optimizer.m, optimizer.v, optimizer.t)
+                               for optimizer in [agent.actor_optimizer, agent.critic_optimizer]],
+                'param_noise_stddev': param_noise.current_stddev if param_noise is not None else None})
         logdir = logger.get_dir()
         if rank == 0 and logdir:
             if hasattr(env, 'get_state'):
@@ -280,11 +280,10 @@ class DDPG(object):
     def store_transition(self, obs0, action, reward, obs1, terminal1):
         reward *= self.reward_scale
 
-        B = obs0.shape[0]
-        for b in range(B):
-            self.memory.append(obs0[b], action[b], reward[b], obs1[b], terminal1[b])
-            if self.normalize_observations:
-                self.obs_rms.update(np.array([obs0[b]]))
+        self.memory.append_batch(obs0, action, reward, obs1, terminal1)
+        if self.normalize_observations:
+            # merging the batch statistics at once equals updating row by row
+            self.obs_rms.update(np.array(obs0))
 
     def train(self):
         # Get a batch.
@@ -1,12 +1,17 @@
 import numpy as np
 
+from baselines.common.memmap_array import allocate, load_array, load_state, save_arrays
+
 
 class RingBuffer(object):
-    def __init__(self, maxlen, shape, dtype='float32'):
+    def __init__(self, maxlen, shape, dtype='float32', storage_dir=None, cache_rows=1024):
         self.maxlen = maxlen
         self.start = 0
         self.length = 0
-        self.data = np.zeros((maxlen,) + shape).astype(dtype)
+        # storage_dir moves the data to a memory-mapped file, see MemmapArray
+        self.storage_dir = storage_dir
+        self.cache_rows = cache_rows
+        self.data = allocate((maxlen,) + shape, dtype=dtype, storage_dir=storage_dir, cache_rows=cache_rows)
 
     def __len__(self):
         return self.length
@@ -31,6 +36,24 @@ class RingBuffer(object):
             raise RuntimeError()
         self.data[(self.start + self.length - 1) % self.maxlen] = v
 
+    def append_batch(self, vs):
+        """Append the rows of `vs` in order, with at most two slice writes."""
+        vs = np.reshape(vs, (-1,) + self.data.shape[1:])
+        if len(vs) > self.maxlen:
+            # only the newest rows survive anyway
+            self.start = (self.start + self.length + len(vs) - self.maxlen) % self.maxlen
+            self.length = 0
+            vs = vs[-self.maxlen:]
+        n = len(vs)
+        end = (self.start + self.length) % self.maxlen
+        first = min(n, self.maxlen - end)
+        self.data[end:end + first] = vs[:first]
+        if first < n:
+            self.data[:n - first] = vs[first:]
+        overflow = max(0, self.length + n - self.maxlen)
+        self.start = (self.start + overflow) % self.maxlen
+        self.length = min(self.length + n, self.maxlen)
+
 
 def array_min2d(x):
     x = np.array(x)
@@ -40,14 +63,42 @@ def array_min2d(x):
 
 
 class Memory(object):
-    def __init__(self, limit, action_shape, observation_shape):
+    def __init__(self, limit, action_shape, observation_shape, storage_dir=None, cache_rows=1024):
         self.limit = limit
 
-        self.observations0 = RingBuffer(limit, shape=observation_shape)
-        self.actions = RingBuffer(limit, shape=action_shape)
-        self.rewards = RingBuffer(limit, shape=(1,))
-        self.terminals1 = RingBuffer(limit, shape=(1,))
-        self.observations1 = RingBuffer(limit, shape=observation_shape)
+        storage = dict(storage_dir=storage_dir, cache_rows=cache_rows)
+        self.observations0 = RingBuffer(limit, shape=observation_shape, **storage)
+        self.actions = RingBuffer(limit, shape=action_shape, **storage)
+        self.rewards = RingBuffer(limit, shape=(1,), **storage)
+        self.terminals1 = RingBuffer(limit, shape=(1,), **storage)
+        self.observations1 = RingBuffer(limit, shape=observation_shape, **storage)
+
+    def _ring_buffers(self):
+        return {
+            'observations0': self.observations0,
+            'actions': self.actions,
+            'rewards': self.rewards,
+            'terminals1': self.terminals1,
+            'observations1': self.observations1,
+        }
+
+    def save(self, path):
+        """Save the memory to directory `path` as uncompressed .npy files."""
+        buffers = self._ring_buffers()
+        # until the ring is full, `start` is 0 and only the first rows are used
+        arrays = {name: buf.data[:buf.length] for name, buf in buffers.items()}
+        state = {name: (buf.maxlen, buf.start, buf.length) for name, buf in buffers.items()}
+        save_arrays(path, arrays, state)
+
+    def load(self, path):
+        """Restore a memory saved with `save`; a full memory is mapped
+        copy-on-write from the files instead of being read.
+        """
+        state = load_state(path)
+        for name, buf in self._ring_buffers().items():
+            maxlen, buf.start, buf.length = state[name]
+            assert maxlen == buf.maxlen, "memory was saved with a different limit"
+            buf.data = load_array(path, name, buf.maxlen, storage_dir=buf.storage_dir, cache_rows=buf.cache_rows)
 
     def sample(self, batch_size):
         # Draw such that we always have a proceeding element.
@@ -78,6 +129,17 @@ class Memory(object):
         self.observations1.append(obs1)
         self.terminals1.append(terminal1)
 
+    def append_batch(self, obs0, action, reward, obs1, terminal1, training=True):
+        """Append a batch of transitions, e.g. one from every environment of a VecEnv."""
+        if not training:
+            return
+
+        self.observations0.append_batch(obs0)
+        self.actions.append_batch(action)
+        self.rewards.append_batch(reward)
+        self.observations1.append_batch(obs1)
+        self.terminals1.append_batch(terminal1)
+
     @property
     def nb_entries(self):
         return len(self.observations0)
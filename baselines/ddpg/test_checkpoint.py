@@ -0,0 +1,37 @@
+import gym
+import numpy as np
+import tensorflow as tf
+
+from baselines.common.tf_util import make_session
+from baselines.common.vec_env import DummyVecEnv
+from baselines.ddpg.ddpg import learn
+
+
+def _learn(checkpoint_path, total_timesteps):
+    def make_env():
+        env = gym.make('Pendulum-v1')
+        env.seed(0)
+        return env
+    env = DummyVecEnv([make_env])
+    make_session(make_default=True, graph=tf.Graph())
+    agent = learn('mlp', env, seed=0, total_timesteps=total_timesteps, nb_epoch_cycles=2, nb_rollout_steps=20,
+                  nb_train_steps=5, batch_size=16, noise_type='adaptive-param_0.2', memory_checkpoint_path=checkpoint_path)
+    variables = {v.name: agent.sess.run(v) for v in tf.global_variables()}
+    return agent, variables
+
+
+def test_resume_from_checkpoint(tmpdir):
+    # two epochs of 40 steps
+    saved, saved_variables = _learn(str(tmpdir), 80)
+
+    # the last save was at the end of the second epoch, so there is nothing left to train
+    resumed, resumed_variables = _learn(str(tmpdir), 80)
+    assert resumed.memory.nb_entries == saved.memory.nb_entries == 80
+    assert resumed.actor_optimizer.t == saved.actor_optimizer.t == 20
+    np.testing.assert_array_equal(resumed.critic_optimizer.m, saved.critic_optimizer.m)
+    assert resumed.param_noise.current_stddev == saved.param_noise.current_stddev
+    assert set(resumed_variables) == set(saved_variables)
+    for name, value in saved_variables.items():
+        # the param noise actors are perturbed anew by agent.reset
+        if 'param_noise_actor' not in name:
+            np.testing.assert_array_equal(resumed_variables[name], value, err_msg=name)
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from baselines.ddpg.memory import Memory, RingBuffer
+
+
+@pytest.mark.parametrize('memmap', [False, True])
+@pytest.mark.parametrize('batch_size', [1, 3, 7, 10, 25])
+def test_ring_buffer_append_batch(tmpdir, batch_size, memmap):
+    rng = np.random.RandomState(0)
+    storage_dir = str(tmpdir) if memmap else None
+    rows = RingBuffer(10, shape=(2,), storage_dir=storage_dir, cache_rows=4)
+    batched = RingBuffer(10, shape=(2,), storage_dir=storage_dir, cache_rows=4)
+    for _ in range(6):
+        vs = rng.rand(batch_size, 2)
+        for v in vs:
+            rows.append(v)
+        batched.append_batch(vs)
+        assert (rows.start, rows.length) == (batched.start, batched.length)
+        np.testing.assert_array_equal(rows.data[:], batched.data[:])
+
+
+def test_memory_append_batch():
+    rows, batched = Memory(16, (2,), (3,)), Memory(16, (2,), (3,))
+    for i in range(5):
+        obs0, action, obs1 = np.full((4, 3), i), np.full((4, 2), i), np.full((4, 3), i + 1)
+        reward, terminal1 = np.arange(4.0) + i, np.zeros(4)
+        for b in range(4):
+            rows.append(obs0[b], action[b], reward[b], obs1[b], terminal1[b])
+        batched.append_batch(obs0, action, reward, obs1, terminal1)
+
+    assert rows.nb_entries == batched.nb_entries == 16
+    for name, buf in rows._ring_buffers().items():
+        np.testing.assert_array_equal(buf.data, batched._ring_buffers()[name].data)
@@ -0,0 +1,297 @@
+"""
+Ape-X style DQN: several actor processes step their own copy of the environment
+and write transitions into a replay buffer in shared memory, while the learner
+in the main process samples from it and trains.
+
+Distributed Prioritized Experience Replay, Horgan et al., 2018
+https://arxiv.org/abs/1803.00933
+"""
+import ctypes
+import multiprocessing as mp
+import queue
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import baselines.common.tf_util as U
+from baselines import logger
+from baselines import deepq
+from baselines.common import set_global_seeds
+from baselines.common.schedules import LinearSchedule
+from baselines.common.tf_util import get_session, load_variables
+from baselines.common.vec_env.vec_env import CloudpickleWrapper, clear_mpi_env_vars
+from baselines.deepq.deepq import ActWrapper
+from baselines.deepq.models import build_q_func
+from baselines.deepq.replay_buffer import SharedReplayBuffer, SharedPrioritizedReplayBuffer
+from baselines.deepq.utils import ObservationInput
+
+
+def _q_func_vars(scope):
+    return sorted(tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=scope + "/q_func"), key=lambda v: v.name)
+
+
+def _actor_worker(actor_id, env_fn_wrapper, act_params_wrapper, replay_buffer, params, params_version,
+                  params_lock, stop, episode_queue, eps, param_sync_freq, seed):
+    """
+    Step a single environment with the latest parameters published by the
+    learner and write every transition into the shared replay buffer.
+    """
+    set_global_seeds(seed + actor_id if seed is not None else None)
+    # episode rewards left in the queue on shutdown are not needed, so do not
+    # block the exit of the process on flushing them
+    episode_queue.cancel_join_thread()
+    env = env_fn_wrapper.x()
+    sess = U.single_threaded_session()
+    sess.__enter__()
+    act = deepq.build_act(**act_params_wrapper.x)
+    set_from_flat = U.SetFromFlat(_q_func_vars("deepq"))
+    U.initialize()
+
+    theta = np.frombuffer(params, dtype=np.float32)
+    version = 0
+    obs = env.reset()
+    episode_reward = 0.0
+    try:
+        t = 0
+        while not stop.is_set():
+            if t % param_sync_freq == 0 and params_version.value != version:
+                with params_lock:
+                    version = params_version.value
+                    set_from_flat(theta.copy())
+            action = act(np.array(obs)[None], update_eps=eps)[0]
+            new_obs, rew, done, _ = env.step(action)
+            replay_buffer.add(obs, action, rew, new_obs, float(done))
+            obs = new_obs
+            episode_reward += rew
+            if done:
+                episode_queue.put(episode_reward)
+                episode_reward = 0.0
+                obs = env.reset()
+            t += 1
+    except KeyboardInterrupt:
+        print('Ape-X actor {}: got KeyboardInterrupt'.format(actor_id))
+    finally:
+        env.close()
+
+
+def _check_actors(procs):
+    """
+    Raise if an actor process exited - the actors only stop when the learner
+    tells them to, and the learner would otherwise wait on them forever.
+    """
+    for i, proc in enumerate(procs):
+        if not proc.is_alive():
+            raise RuntimeError('Ape-X actor {} exited with code {}'.format(i, proc.exitcode))
+
+
+def learn(env_fns,
+          network,
+          seed=None,
+          lr=5e-4,
+          total_timesteps=100000,
+          buffer_size=50000,
+          batch_size=32,
+          print_freq=100,
+          learning_starts=1000,
+          gamma=1.0,
+          target_network_update_freq=500,
+          param_sync_freq=50,
+          prioritized_replay=True,
+          prioritized_replay_alpha=0.6,
+          prioritized_replay_beta0=0.4,
+          prioritized_replay_beta_iters=None,
+          prioritized_replay_eps=1e-6,
+          actor_eps=0.4,
+          actor_eps_alpha=7.0,
+          context='spawn',
+          callback=None,
+          load_path=None,
+          **network_kwargs
+            ):
+    """Train a deepq model with one actor process per environment.
+
+    Parameters
+    -------
+    env_fns: list of callables
+        functions that create the environments of the actors, one actor per function.
+        Need to be cloud-pickleable, as for SubprocVecEnv.
+    network: string or a function
+        neural network to use as a q function approximator, see baselines.deepq.learn
+    seed: int or None
+        prng seed, actor i is seeded with seed + i.
+    lr: float
+        learning rate for adam optimizer
+    total_timesteps: int
+        number of env steps, summed over all actors, to run for
+    buffer_size: int
+        size of the shared replay buffer
+    batch_size: int
+        size of a batched sampled from replay buffer for training
+    print_freq: int
+        how often (in learner updates) to print out training progress
+        set to None to disable printing
+    learning_starts: int
+        how many transitions to collect before learning starts
+    gamma: float
+        discount factor
+    target_network_update_freq: int
+        update the target network every `target_network_update_freq` learner updates.
+    param_sync_freq: int
+        publish the parameters to the actors every `param_sync_freq` learner updates;
+        actors also check for new parameters every `param_sync_freq` env steps.
+    prioritized_replay: True
+        if True prioritized replay buffer will be used.
+    prioritized_replay_alpha: float
+        alpha parameter for prioritized replay buffer
+    prioritized_replay_beta0: float
+        initial value of beta for prioritized replay buffer
+    prioritized_replay_beta_iters: int
+        number of env steps over which beta will be annealed from initial value
+        to 1.0. If set to None equals to total_timesteps.
+    prioritized_replay_eps: float
+        epsilon to add to the TD errors when updating priorities.
+    actor_eps: float
+        base random action probability; actor i of N uses actor_eps ** (1 + actor_eps_alpha * i / (N - 1))
+    actor_eps_alpha: float
+        exponent spreading the exploration rates of the actors
+    context: str
+        multiprocessing context used to start the actors
+    callback: (locals, globals) -> None
+        function called at every learner update with state of the algorithm.
+        If callback returns true training stops.
+    load_path: str
+        path to load the model from. (default: None)
+    **network_kwargs
+        additional keyword arguments to pass to the network builder.
+
+    Returns
+    -------
+    act: ActWrapper
+        Wrapper over act function. Adds ability to save it and load it.
+    """
+    sess = get_session()
+    set_global_seeds(seed)
+
+    logger.log('Creating dummy env object to get spaces')
+    with logger.scoped_configure(format_strs=[]):
+        dummy = env_fns[0]()
+        observation_space, action_space = dummy.observation_space, dummy.action_space
+        dummy.close()
+        del dummy
+
+    q_func = build_q_func(network, **network_kwargs)
+
+    def make_obs_ph(name):
+        return ObservationInput(observation_space, name=name)
+
+    act, train, update_target, debug = deepq.build_train(
+        make_obs_ph=make_obs_ph,
+        q_func=q_func,
+        num_actions=action_space.n,
+        optimizer=tf.train.AdamOptimizer(learning_rate=lr),
+        gamma=gamma,
+        grad_norm_clipping=10,
+    )
+
+    act_params = {
+        'make_obs_ph': make_obs_ph,
+        'q_func': q_func,
+        'num_actions': action_space.n,
+    }
+
+    act = ActWrapper(act, act_params)
+
+    if prioritized_replay:
+        replay_buffer = SharedPrioritizedReplayBuffer(buffer_size, prioritized_replay_alpha,
+                                                      observation_space, action_space, context=context)
+        if prioritized_replay_beta_iters is None:
+            prioritized_replay_beta_iters = total_timesteps
+        beta_schedule = LinearSchedule(prioritized_replay_beta_iters,
+                                       initial_p=prioritized_replay_beta0,
+                                       final_p=1.0)
+    else:
+        replay_buffer = SharedReplayBuffer(buffer_size, observation_space, action_space, context=context)
+        beta_schedule = None
+
+    U.initialize()
+    update_target()
+    if load_path is not None:
+        load_variables(load_path)
+        logger.log('Loaded model from {}'.format(load_path))
+
+    get_flat = U.GetFlat(_q_func_vars("deepq"))
+    ctx = mp.get_context(context)
+    theta = get_flat()
+    params = ctx.RawArray(ctypes.c_float, len(theta))
+    params_version = ctx.RawValue(ctypes.c_int64, 1)
+    params_lock = ctx.Lock()
+    np.copyto(np.frombuffer(params, dtype=np.float32), theta)
+    stop = ctx.Event()
+    episode_queue = ctx.Queue()
+
+    num_actors = len(env_fns)
+    procs = []
+    with clear_mpi_env_vars():
+        for i, env_fn in enumerate(env_fns):
+            eps = actor_eps ** (1 + actor_eps_alpha * i / max(num_actors - 1, 1))
+            proc = ctx.Process(target=_actor_worker,
+                               args=(i, CloudpickleWrapper(env_fn), CloudpickleWrapper(act_params), replay_buffer,
+                                     params, params_version, params_lock, stop, episode_queue, eps,
+                                     param_sync_freq, seed))
+            proc.daemon = True
+            procs.append(proc)
+            proc.start()
+
+    episode_rewards = []
+    try:
+        while replay_buffer._num_added.value < learning_starts:
+            _check_actors(procs)
+            time.sleep(0.1)
+
+        num_updates = 0
+        tstart = time.time()
+        while replay_buffer._num_added.value < total_timesteps:
+            _check_actors(procs)
+            if callback is not None:
+                if callback(locals(), globals()):
+                    break
+            t = replay_buffer._num_added.value
+            if prioritized_replay:
+                experience = replay_buffer.sample(batch_size, beta=beta_schedule.value(t))
+                (obses_t, actions, rewards, obses_tp1, dones, weights, batch_idxes) = experience
+            else:
+                obses_t, actions, rewards, obses_tp1, dones = replay_buffer.sample(batch_size)
+                weights, batch_idxes = np.ones_like(rewards), None
+            td_errors = train(obses_t, actions, rewards, obses_tp1, dones, weights)
+            if prioritized_replay:
+                new_priorities = np.abs(td_errors) + prioritized_replay_eps
+                replay_buffer.update_priorities(batch_idxes, new_priorities)
+            num_updates += 1
+
+            if num_updates % target_network_update_freq == 0:
+                update_target()
+            if num_updates % param_sync_freq == 0:
+                with params_lock:
+                    np.copyto(np.frombuffer(params, dtype=np.float32), get_flat())
+                    params_version.value += 1
+
+            while True:
+                try:
+                    episode_rewards.append(episode_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if print_freq is not None and num_updates % print_freq == 0:
+                logger.record_tabular("steps", t)
+                logger.record_tabular("updates", num_updates)
+                logger.record_tabular("episodes", len(episode_rewards))
+                logger.record_tabular("mean 100 episode reward", round(np.mean(episode_rewards[-100:]), 1) if episode_rewards else np.nan)
+                logger.record_tabular("updates/sec", num_updates / (time.time() - tstart))
+                logger.dump_tabular()
+    finally:
+        stop.set()
+        for proc in procs:
+            proc.join()
+
+    return act
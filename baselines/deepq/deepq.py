@@ -9,12 +9,13 @@ import numpy as np
 import gym
 import baselines.common.tf_util as U
 from baselines.common.tf_util import load_variables, save_variables
+from baselines.common.memmap_array import has_saved_state, clear_saved_state, save_arrays, load_state
 from baselines import logger
 from baselines.common.schedules import LinearSchedule
 from baselines.common import set_global_seeds
 
 from baselines import deepq
-from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, RankBasedPrioritizedReplayBuffer
 from baselines.deepq.utils import ObservationInput
 
 from baselines.common.tf_util import get_session
@@ -106,14 +107,20 @@ def learn(env,
           print_freq=100,
           checkpoint_freq=10000,
           checkpoint_path=None,
+          checkpoint_replay_buffer=False,
           learning_starts=1000,
           gamma=1.0,
+          n_step=1,
           target_network_update_freq=500,
           prioritized_replay=False,
           prioritized_replay_alpha=0.6,
           prioritized_replay_beta0=0.4,
           prioritized_replay_beta_iters=None,
           prioritized_replay_eps=1e-6,
+          prioritized_replay_type='proportional',
+          replay_frame_stack=None,
+          replay_storage_dir=None,
+          replay_storage_cache_rows=1024,
           param_noise=False,
           callback=None,
           load_path=None,
@@ -153,10 +160,19 @@ def learn(env,
         how often to save the model. This is so that the best version is restored
         at the end of the training. If you do not wish to restore the best version at
         the end of the training set this variable to None.
+    checkpoint_replay_buffer: bool
+        if True, every `checkpoint_freq` steps the current model, the replay buffer and the step counter
+        are saved together to `checkpoint_path`/resume, and training resumes from there when it starts,
+        at the saved step and thus with the exploration and beta schedules where they were. The buffer
+        is rewritten in full and synchronously on every save, which stalls training for the time it
+        takes to write it to disk.
     learning_starts: int
         how many steps of the model to collect transitions for before learning starts
     gamma: float
         discount factor
+    n_step: int
+        number of steps of the TD targets: the replay buffer stores discounted n-step rewards
+        and the targets bootstrap from the observation `n_step` steps later.
     target_network_update_freq: int
         update the target network every `target_network_update_freq` steps.
     prioritized_replay: True
@@ -170,6 +186,16 @@ def learn(env,
         to 1.0. If set to None equals to total_timesteps.
     prioritized_replay_eps: float
         epsilon to add to the TD errors when updating priorities.
+    prioritized_replay_type: str
+        'proportional' samples transitions proportionally to their priority,
+        'rank' proportionally to the inverse of their rank by priority (see RankBasedPrioritizedReplayBuffer).
+    replay_frame_stack: int or None
+        if not None, observations are stacks of that many frames (e.g. wrap_deepmind with frame_stack=True)
+        and the replay buffer stores every frame only once, rebuilding the stacks at sample time.
+    replay_storage_dir: str or None
+        if not None, the replay buffer is memory-mapped from files in this directory instead of held in RAM.
+    replay_storage_cache_rows: int
+        with replay_storage_dir, number of consecutive transitions of the memory-mapped buffer kept in RAM for writing.
     param_noise: bool
         whether or not to use parameter space noise (https://arxiv.org/abs/1706.01905)
     callback: (locals, globals) -> None
@@ -205,7 +231,7 @@ def learn(env,
         q_func=q_func,
         num_actions=env.action_space.n,
         optimizer=tf.train.AdamOptimizer(learning_rate=lr),
-        gamma=gamma,
+        gamma=gamma ** n_step,
         grad_norm_clipping=10,
         param_noise=param_noise
     )
@@ -220,14 +246,21 @@ def learn(env,
 
     # Create the replay buffer
     if prioritized_replay:
-        replay_buffer = PrioritizedReplayBuffer(buffer_size, alpha=prioritized_replay_alpha)
+        buffer_class = {
+            'proportional': PrioritizedReplayBuffer,
+            'rank': RankBasedPrioritizedReplayBuffer,
+        }[prioritized_replay_type]
+        replay_buffer = buffer_class(buffer_size, alpha=prioritized_replay_alpha, frame_stack=replay_frame_stack,
+                                     storage_dir=replay_storage_dir, cache_rows=replay_storage_cache_rows,
+                                     n_step=n_step, gamma=gamma)
         if prioritized_replay_beta_iters is None:
             prioritized_replay_beta_iters = total_timesteps
         beta_schedule = LinearSchedule(prioritized_replay_beta_iters,
                                        initial_p=prioritized_replay_beta0,
                                        final_p=1.0)
     else:
-        replay_buffer = ReplayBuffer(buffer_size)
+        replay_buffer = ReplayBuffer(buffer_size, frame_stack=replay_frame_stack, storage_dir=replay_storage_dir,
+                                     cache_rows=replay_storage_cache_rows, n_step=n_step, gamma=gamma)
         beta_schedule = None
     # Create the schedule for exploration starting from 1.
     exploration = LinearSchedule(schedule_timesteps=int(exploration_fraction * total_timesteps),
@@ -257,8 +290,27 @@ def learn(env,
             load_variables(load_path)
             logger.log('Loaded model from {}'.format(load_path))
 
-
-        for t in range(total_timesteps):
+        # The current model, the replay buffer and the step to resume from, saved together;
+        # the state written last marks a complete save
+        resume_dir = os.path.join(td, "resume")
+        resume_model_file = os.path.join(resume_dir, "model")
+        replay_buffer_dir = os.path.join(resume_dir, "replay_buffer")
+        t_start = 0
+        if checkpoint_replay_buffer:
+            assert checkpoint_path is not None, "checkpoint_replay_buffer requires a checkpoint_path"
+            if has_saved_state(resume_dir):
+                resume_state = load_state(resume_dir)
+                load_variables(resume_model_file)
+                replay_buffer.load(replay_buffer_dir)
+                # the episode that was running at the save is not continued, env was reset above
+                replay_buffer.flush()
+                t_start = resume_state['t']
+                episode_rewards = resume_state['episode_rewards']
+                saved_mean_reward = resume_state['saved_mean_reward']
+                model_saved = model_saved or resume_state['model_saved']
+                logger.log('Resuming from step {} with {} transitions in the replay buffer'.format(t_start, len(replay_buffer)))
+
+        for t in range(t_start, total_timesteps):
             if callback is not None:
                 if callback(locals(), globals()):
                     break
@@ -331,6 +383,14 @@ def learn(env,
                     save_variables(model_file)
                     model_saved = True
                     saved_mean_reward = mean_100ep_reward
+
+            if (checkpoint_replay_buffer and checkpoint_freq is not None and
+                    t > learning_starts and t % checkpoint_freq == 0):
+                clear_saved_state(resume_dir)
+                save_variables(resume_model_file)
+                replay_buffer.save(replay_buffer_dir)
+                save_arrays(resume_dir, {}, {'t': t + 1, 'episode_rewards': episode_rewards,
+                                             'saved_mean_reward': saved_mean_reward, 'model_saved': model_saved})
         if model_saved:
             if print_freq is not None:
                 logger.log("Restored model with mean reward: {}".format(saved_mean_reward))
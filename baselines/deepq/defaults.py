@@ -11,6 +11,7 @@ def atari():
         gamma=0.99,
         prioritized_replay=True,
         prioritized_replay_alpha=0.6,
+        replay_frame_stack=4,
         checkpoint_freq=10000,
         checkpoint_path=None,
         dueling=True
@@ -1,11 +1,17 @@
+import collections
+import ctypes
+import multiprocessing as mp
+
 import numpy as np
-import random
 
+from baselines.common.memmap_array import allocate, load_array, load_state, save_arrays
 from baselines.common.segment_tree import SumSegmentTree, MinSegmentTree
 
+_FIELDS = ('obses_t', 'actions', 'rewards', 'obses_tp1', 'dones')
+
 
 class ReplayBuffer(object):
-    def __init__(self, size):
+    def __init__(self, size, columnar=True, frame_stack=None, storage_dir=None, n_step=1, gamma=1.0, cache_rows=1024):
         """Create Replay buffer.
 
         Parameters
@@ -13,35 +19,312 @@ class ReplayBuffer(object):
         size: int
             Max number of transitions to store in the buffer. When the buffer
             overflows the old memories are dropped.
+        columnar: bool
+            if True, every field of a transition is stored in its own
+            preallocated numpy array (sized lazily from the first `add`) and
+            batches are gathered with fancy indexing. If False, transitions
+            are kept as a list of tuples, which also allows observations
+            that cannot be converted to a fixed-shape array.
+        frame_stack: int or None
+            if not None, observations are expected to be `frame_stack` frames
+            concatenated along the last axis (as produced by
+            baselines.common.atari_wrappers.FrameStack) and only the newest
+            frame of every transition is stored, plus the full stack of the
+            first observation of every episode. Stacked obs_t and obs_tp1 are
+            rebuilt at sample time. Requires columnar storage.
+        storage_dir: str or None
+            if not None, the columns (and frames) are memory-mapped files in
+            this directory instead of arrays in RAM, which allows buffers
+            larger than memory (see baselines.common.memmap_array.MemmapArray).
+            Requires columnar storage.
+        n_step: int
+            if larger than 1, every stored transition spans up to `n_step`
+            steps: its reward is the discounted sum of the rewards of the next
+            `n_step` transitions and obs_tp1 is the observation `n_step` steps
+            later, so the TD target has to bootstrap with gamma ** n_step.
+            Transitions are stored once they are complete, or earlier with
+            done set when an episode ends within `n_step` steps, or by
+            `flush`.
+        gamma: float
+            discount factor of the n-step rewards
+        cache_rows: int
+            with storage_dir, number of consecutive rows of every column kept
+            in RAM for writing, see MemmapArray
         """
+        assert frame_stack is None or columnar, "frame_stack requires columnar storage"
+        assert storage_dir is None or columnar, "storage_dir requires columnar storage"
         self._storage = []
+        self._columns = None
+        self._columnar = columnar
+        self._frame_stack = frame_stack
+        self._storage_dir = storage_dir
+        self._cache_rows = cache_rows
         self._maxsize = size
         self._next_idx = 0
+        self._size = 0
+        self._n_step = n_step
+        # transitions that still wait for the rewards of later steps
+        self._pending = collections.deque()
+        self._discounts = gamma ** np.arange(n_step)
+
+        if frame_stack is not None:
+            # frames of the last `size + frame_stack` transitions are kept, so
+            # that the oldest stored transition can still look back far enough,
+            # plus the frames of transitions that are not complete yet
+            self._frame_capacity = size + frame_stack + n_step - 1
+            self._frames = None
+            self._episode_starts = None
+            self._num_added = 0
+            self._num_episodes = 0
+            self._episode_step = 0
+            # the last obs_tp1 as passed in, for the identity check, and as an array
+            self._last_obs = None
+            self._last_obs_array = None
 
     def __len__(self):
-        return len(self._storage)
+        return self._size
+
+    def _allocate_columns(self, data):
+        columns = []
+        for i, value in enumerate(data):
+            if value is None:
+                columns.append(None)
+                continue
+            value = np.asarray(value)
+            # rewards and done flags may arrive as python ints, so store them
+            # as floats to avoid truncating later values
+            dtype = np.float32 if i in (2, 4) else value.dtype
+            columns.append(allocate((self._maxsize,) + value.shape, dtype=dtype, storage_dir=self._storage_dir,
+                                    cache_rows=self._cache_rows))
+        return tuple(columns)
+
+    def _split_frames(self, obs):
+        # (..., k * c) -> (k, ..., c)
+        obs = obs.reshape(obs.shape[:-1] + (self._frame_stack, -1))
+        return np.moveaxis(obs, -2, 0)
+
+    def _store_episode_start(self, obs_t):
+        frames = self._split_frames(np.asarray(obs_t))
+        if self._episode_starts is None:
+            self._episode_starts = np.empty((16,) + frames.shape, dtype=frames.dtype)
+        capacity = len(self._episode_starts)
+        if len(self) == 0:
+            oldest = self._num_episodes
+        else:
+            oldest = self._episode_idx[self._next_idx if len(self) == self._maxsize else 0]
+        if self._num_episodes - capacity >= oldest:
+            # the slot about to be reused still holds a live episode start,
+            # so grow the ring and keep every episode from `oldest` on
+            episodes = np.arange(oldest, self._num_episodes)
+            starts = np.empty((2 * capacity,) + frames.shape, dtype=frames.dtype)
+            starts[episodes % (2 * capacity)] = self._episode_starts[episodes % capacity]
+            self._episode_starts = starts
+        self._episode_starts[self._num_episodes % len(self._episode_starts)] = frames
+        self._num_episodes += 1
+        self._episode_step = 0
+
+    def _add_frames(self, obs_t, obs_tp1):
+        """Store the newest frame of obs_tp1 and return the position of the
+        transition in the frame ring, to be recorded in its slot."""
+        obs_tp1_array = np.asarray(obs_tp1)
+        frames_tp1 = self._split_frames(obs_tp1_array)
+        if self._frames is None:
+            self._frames = allocate((self._frame_capacity,) + frames_tp1.shape[1:], dtype=obs_tp1_array.dtype,
+                                    storage_dir=self._storage_dir, cache_rows=self._cache_rows)
+            self._frame_idx = np.zeros(self._maxsize, dtype=np.int64)
+            self._episode_idx = np.zeros(self._maxsize, dtype=np.int64)
+            self._step_idx = np.zeros(self._maxsize, dtype=np.int64)
+            if self._n_step > 1:
+                self._bootstrap = np.ones(self._maxsize, dtype=np.int64)
+
+        # a new episode starts whenever obs_t does not continue from the
+        # previous obs_tp1; deepq.learn passes the very same object, so the
+        # identity check usually makes the comparison free, LazyFrames included
+        if self._last_obs_array is None or not (
+                obs_t is self._last_obs or np.array_equal(np.asarray(obs_t), self._last_obs_array)):
+            self._store_episode_start(obs_t)
+        self._frames[self._num_added % self._frame_capacity] = frames_tp1[-1]
+        position = (self._num_added, self._num_episodes - 1, self._episode_step)
+        self._num_added += 1
+        self._episode_step += 1
+        self._last_obs = obs_tp1
+        self._last_obs_array = obs_tp1_array
+        return position
+
+    def _encode_frames(self, idxes):
+        k = self._frame_stack
+        step = self._step_idx[idxes][:, None]
+        # position within the episode of every frame of obs_t and obs_tp1;
+        # positions <= 0 come from the stack stored at the episode start
+        if self._n_step == 1:
+            pos = step + np.arange(-k + 1, 2)[None]
+        else:
+            bootstrap = self._bootstrap[idxes][:, None]
+            pos = np.concatenate([step + np.arange(-k + 1, 1)[None], step + bootstrap + np.arange(-k + 1, 1)[None]], 1)
+        from_start = pos <= 0
+        frame_idx = (self._frame_idx[idxes][:, None] - step + pos - 1) % self._frame_capacity
+        frames = self._frames[np.where(from_start, 0, frame_idx)]
+        episode_idx = np.broadcast_to(self._episode_idx[idxes][:, None] % len(self._episode_starts), pos.shape)
+        frames[from_start] = self._episode_starts[episode_idx[from_start], (k - 1 + pos)[from_start]]
+        # (batch, num_frames, ..., c) -> (batch, ..., num_frames * c)
+        num_frames = pos.shape[1]
+        frames = np.moveaxis(frames, 1, -2)
+        frames = frames.reshape(frames.shape[:-2] + (-1,))
+        c = frames.shape[-1] // num_frames
+        return frames[..., :k * c], frames[..., (num_frames - k) * c:]
 
     def add(self, obs_t, action, reward, obs_tp1, done):
+        if self._n_step == 1:
+            self._add_transition(obs_t, action, reward, obs_tp1, done)
+            return
+        position = None
+        if self._frame_stack is not None:
+            position = self._add_frames(obs_t, obs_tp1)
+            obs_t = obs_tp1 = None
+        self._pending.append((obs_t, action, reward, obs_tp1, position))
+        if done:
+            while self._pending:
+                self._add_pending(done)
+        elif len(self._pending) == self._n_step:
+            self._add_pending(done)
+
+    def flush(self):
+        """Store the transitions that still wait for the rewards of later
+        steps, with the rewards seen so far and bootstrapping from the last
+        obs_tp1 added, as for an episode cut short without done. Call it
+        before adding an episode that does not continue the last one, e.g.
+        after `load` when the environment is reset."""
+        while self._pending:
+            self._add_pending(0.0)
+
+    def _add_pending(self, done):
+        # the oldest pending transition is complete, its obs_tp1 is the
+        # observation after the newest one
+        bootstrap = len(self._pending)
+        rewards = [transition[2] for transition in self._pending]
+        reward = np.dot(self._discounts[:bootstrap], rewards)
+        obs_tp1 = self._pending[-1][3]
+        obs_t, action, _, _, position = self._pending.popleft()
+        self._add_transition(obs_t, action, reward, obs_tp1, done, position=position, bootstrap=bootstrap)
+
+    def _add_transition(self, obs_t, action, reward, obs_tp1, done, position=None, bootstrap=1):
+        if self._frame_stack is not None:
+            if position is None:
+                position = self._add_frames(obs_t, obs_tp1)
+            self._frame_idx[self._next_idx], self._episode_idx[self._next_idx], self._step_idx[self._next_idx] = \
+                position
+            if self._n_step > 1:
+                self._bootstrap[self._next_idx] = bootstrap
+            obs_t = obs_tp1 = None
         data = (obs_t, action, reward, obs_tp1, done)
 
-        if self._next_idx >= len(self._storage):
+        if self._columnar:
+            if self._columns is None:
+                self._columns = self._allocate_columns(data)
+            for column, value in zip(self._columns, data):
+                if column is not None:
+                    column[self._next_idx] = value
+        elif self._next_idx >= len(self._storage):
             self._storage.append(data)
         else:
             self._storage[self._next_idx] = data
+        self._size = min(self._size + 1, self._maxsize)
         self._next_idx = (self._next_idx + 1) % self._maxsize
 
     def _encode_sample(self, idxes):
+        if self._columnar:
+            idxes = np.asarray(idxes)
+            obses_t, actions, rewards, obses_tp1, dones = (
+                column[idxes] if column is not None else None for column in self._columns)
+            if self._frame_stack is not None:
+                obses_t, obses_tp1 = self._encode_frames(idxes)
+            return obses_t, actions, rewards, obses_tp1, dones
         obses_t, actions, rewards, obses_tp1, dones = [], [], [], [], []
         for i in idxes:
             data = self._storage[i]
             obs_t, action, reward, obs_tp1, done = data
-            obses_t.append(np.array(obs_t, copy=False))
-            actions.append(np.array(action, copy=False))
+            obses_t.append(np.asarray(obs_t))
+            actions.append(np.asarray(action))
             rewards.append(reward)
-            obses_tp1.append(np.array(obs_tp1, copy=False))
+            obses_tp1.append(np.asarray(obs_tp1))
             dones.append(done)
         return np.array(obses_t), np.array(actions), np.array(rewards), np.array(obses_tp1), np.array(dones)
 
+    def _save_items(self):
+        n = len(self)
+        state = {
+            'maxsize': self._maxsize,
+            'columnar': self._columnar,
+            'frame_stack': self._frame_stack,
+            'n_step': self._n_step,
+            'next_idx': self._next_idx,
+            'pending': list(self._pending),
+            'size': self._size,
+            'columns': [],
+        }
+        arrays = {}
+        if not self._columnar:
+            state['storage'] = self._storage
+        elif self._columns is not None:
+            for name, column in zip(_FIELDS, self._columns):
+                if column is not None:
+                    arrays[name] = column[:n]
+                    state['columns'].append(name)
+        if self._frame_stack is not None and self._frames is not None:
+            state.update(num_added=self._num_added, num_episodes=self._num_episodes,
+                         episode_step=self._episode_step, last_obs=self._last_obs_array)
+            arrays['frames'] = self._frames[:min(self._num_added, self._frame_capacity)]
+            arrays['episode_starts'] = self._episode_starts
+            arrays['frame_idx'] = self._frame_idx
+            arrays['episode_idx'] = self._episode_idx
+            arrays['step_idx'] = self._step_idx
+            if self._n_step > 1:
+                arrays['bootstrap'] = self._bootstrap
+        return arrays, state
+
+    def _load_items(self, path, state):
+        assert (state['maxsize'], state['columnar'], state['frame_stack'], state['n_step']) == \
+            (self._maxsize, self._columnar, self._frame_stack, self._n_step), \
+            "buffer was saved with a different configuration"
+        self._next_idx, self._size = state['next_idx'], state['size']
+        self._pending = collections.deque(state['pending'])
+        if not self._columnar:
+            self._storage = state['storage']
+        elif state['columns']:
+            self._columns = tuple(
+                load_array(path, name, self._maxsize, storage_dir=self._storage_dir, cache_rows=self._cache_rows)
+                if name in state['columns'] else None
+                for name in _FIELDS)
+        if 'num_added' in state:
+            self._num_added, self._num_episodes = state['num_added'], state['num_episodes']
+            self._episode_step, self._last_obs_array = state['episode_step'], state['last_obs']
+            self._last_obs = self._last_obs_array
+            self._frames = load_array(path, 'frames', self._frame_capacity, storage_dir=self._storage_dir,
+                                      cache_rows=self._cache_rows)
+            self._episode_starts = np.array(load_array(path, 'episode_starts'))
+            self._frame_idx = np.array(load_array(path, 'frame_idx'))
+            self._episode_idx = np.array(load_array(path, 'episode_idx'))
+            self._step_idx = np.array(load_array(path, 'step_idx'))
+            if self._n_step > 1:
+                self._bootstrap = np.array(load_array(path, 'bootstrap'))
+
+    def save(self, path):
+        """Save the content of the buffer to directory `path`.
+
+        Every column is written as an uncompressed .npy file, so that `load`
+        can map the files instead of reading them.
+        """
+        save_arrays(path, *self._save_items())
+
+    def load(self, path):
+        """Restore the content saved with `save` into this buffer, which has to
+        be created with the same size and storage mode.
+
+        A full buffer is mapped copy-on-write from the saved files and pages
+        are only read from disk when they are sampled.
+        """
+        self._load_items(path, load_state(path))
+
     def sample(self, batch_size):
         """Sample a batch of experiences.
 
@@ -64,12 +347,13 @@ class ReplayBuffer(object):
             done_mask[i] = 1 if executing act_batch[i] resulted in
             the end of an episode and 0 otherwise.
         """
-        idxes = [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
+        idxes = np.random.randint(len(self), size=batch_size)
         return self._encode_sample(idxes)
 
 
 class PrioritizedReplayBuffer(ReplayBuffer):
-    def __init__(self, size, alpha):
+    def __init__(self, size, alpha, columnar=True, frame_stack=None, storage_dir=None, n_step=1, gamma=1.0,
+                 cache_rows=1024):
         """Create Prioritized Replay buffer.
 
         Parameters
@@ -80,12 +364,26 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         alpha: float
             how much prioritization is used
             (0 - no prioritization, 1 - full prioritization)
+        columnar: bool
+            storage mode, see ReplayBuffer.__init__
+        frame_stack: int or None
+            frame deduplication, see ReplayBuffer.__init__
+        storage_dir: str or None
+            memory-mapped storage, see ReplayBuffer.__init__
+        n_step: int
+            n-step transitions, see ReplayBuffer.__init__
+        gamma: float
+            discount factor of the n-step rewards
+        cache_rows: int
+            write cache of memory-mapped storage, see ReplayBuffer.__init__
 
         See Also
         --------
         ReplayBuffer.__init__
         """
-        super(PrioritizedReplayBuffer, self).__init__(size)
+        super(PrioritizedReplayBuffer, self).__init__(size, columnar=columnar, frame_stack=frame_stack,
+                                                      storage_dir=storage_dir, n_step=n_step, gamma=gamma,
+                                                      cache_rows=cache_rows)
         assert alpha >= 0
         self._alpha = alpha
 
@@ -97,22 +395,17 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         self._it_min = MinSegmentTree(it_capacity)
         self._max_priority = 1.0
 
-    def add(self, *args, **kwargs):
-        """See ReplayBuffer.store_effect"""
+    def _add_transition(self, *args, **kwargs):
         idx = self._next_idx
-        super().add(*args, **kwargs)
+        super()._add_transition(*args, **kwargs)
         self._it_sum[idx] = self._max_priority ** self._alpha
         self._it_min[idx] = self._max_priority ** self._alpha
 
     def _sample_proportional(self, batch_size):
-        res = []
-        p_total = self._it_sum.sum(0, len(self._storage) - 1)
+        p_total = self._it_sum.sum(0, len(self) - 1)
         every_range_len = p_total / batch_size
-        for i in range(batch_size):
-            mass = random.random() * every_range_len + i * every_range_len
-            idx = self._it_sum.find_prefixsum_idx(mass)
-            res.append(idx)
-        return res
+        mass = (np.random.random(batch_size) + np.arange(batch_size)) * every_range_len
+        return self._it_sum.find_prefixsum_idx(mass)
 
     def sample(self, batch_size, beta):
         """Sample a batch of experiences.
@@ -154,18 +447,28 @@ class PrioritizedReplayBuffer(ReplayBuffer):
 
         idxes = self._sample_proportional(batch_size)
 
-        weights = []
-        p_min = self._it_min.min() / self._it_sum.sum()
-        max_weight = (p_min * len(self._storage)) ** (-beta)
+        p_total = self._it_sum.sum()
+        p_min = self._it_min.min() / p_total
+        max_weight = (p_min * len(self)) ** (-beta)
 
-        for idx in idxes:
-            p_sample = self._it_sum[idx] / self._it_sum.sum()
-            weight = (p_sample * len(self._storage)) ** (-beta)
-            weights.append(weight / max_weight)
-        weights = np.array(weights)
+        p_sample = self._it_sum[idxes] / p_total
+        weights = (p_sample * len(self)) ** (-beta) / max_weight
         encoded_sample = self._encode_sample(idxes)
         return tuple(list(encoded_sample) + [weights, idxes])
 
+    def _save_items(self):
+        arrays, state = super(PrioritizedReplayBuffer, self)._save_items()
+        arrays['it_sum'] = self._it_sum._value
+        arrays['it_min'] = self._it_min._value
+        state['max_priority'] = self._max_priority
+        return arrays, state
+
+    def _load_items(self, path, state):
+        super(PrioritizedReplayBuffer, self)._load_items(path, state)
+        self._it_sum._value = np.array(load_array(path, 'it_sum', len(self._it_sum._value)))
+        self._it_min._value = np.array(load_array(path, 'it_min', len(self._it_min._value)))
+        self._max_priority = state['max_priority']
+
     def update_priorities(self, idxes, priorities):
         """Update priorities of sampled transitions.
 
@@ -181,11 +484,342 @@ class PrioritizedReplayBuffer(ReplayBuffer):
             transitions at the sampled idxes denoted by
             variable `idxes`.
         """
+        idxes = np.asarray(idxes)
+        priorities = np.asarray(priorities)
+        assert len(idxes) == len(priorities)
+        assert np.all(priorities > 0)
+        assert np.all(0 <= idxes) and np.all(idxes < len(self))
+        self._it_sum.set(idxes, priorities ** self._alpha)
+        self._it_min.set(idxes, priorities ** self._alpha)
+
+        self._max_priority = max(self._max_priority, np.max(priorities))
+
+
+class RankBasedPrioritizedReplayBuffer(ReplayBuffer):
+    def __init__(self, size, alpha, columnar=True, frame_stack=None, storage_dir=None, n_step=1, gamma=1.0,
+                 sort_freq=None, cache_rows=1024):
+        """Create rank-based Prioritized Replay buffer.
+
+        Transitions are sampled with probability proportional to
+        (1 / rank) ** alpha, where rank is the position of the transition
+        when sorted by priority. Only the order of the priorities matters,
+        which makes sampling insensitive to outlier TD errors.
+
+        The priorities are kept in a binary max-heap and the position in the
+        heap array is used as an approximate rank, so adding a transition or
+        updating a priority costs O(log size). The heap is fully sorted every
+        `sort_freq` priority updates, which makes the ranks exact again.
+        Sampling is stratified: the rank distribution is split into
+        batch_size segments of equal probability and one rank is drawn
+        uniformly from each segment. The segment boundaries only depend on
+        the number of stored transitions and the batch size and are cached.
+
+        Parameters
+        ----------
+        size: int
+            Max number of transitions to store in the buffer. When the buffer
+            overflows the old memories are dropped.
+        alpha: float
+            how much prioritization is used
+            (0 - no prioritization, 1 - full prioritization)
+        columnar: bool
+            storage mode, see ReplayBuffer.__init__
+        frame_stack: int or None
+            frame deduplication, see ReplayBuffer.__init__
+        storage_dir: str or None
+            memory-mapped storage, see ReplayBuffer.__init__
+        n_step: int
+            n-step transitions, see ReplayBuffer.__init__
+        gamma: float
+            discount factor of the n-step rewards
+        sort_freq: int or None
+            number of updated priorities after which the heap is re-sorted,
+            defaults to size
+        cache_rows: int
+            write cache of memory-mapped storage, see ReplayBuffer.__init__
+
+        See Also
+        --------
+        ReplayBuffer.__init__
+        PrioritizedReplayBuffer.__init__
+        """
+        super(RankBasedPrioritizedReplayBuffer, self).__init__(size, columnar=columnar, frame_stack=frame_stack,
+                                                               storage_dir=storage_dir, n_step=n_step, gamma=gamma,
+                                                               cache_rows=cache_rows)
+        assert alpha >= 0
+        self._alpha = alpha
+        self._sort_freq = sort_freq or size
+        self._num_updates = 0
+        self._max_priority = 1.0
+
+        # heap position -> (priority, buffer index) and buffer index -> heap position
+        self._heap_priority = np.zeros(size, dtype=np.float64)
+        self._heap_idx = np.zeros(size, dtype=np.int64)
+        self._heap_pos = np.zeros(size, dtype=np.int64)
+
+        # unnormalized cumulative probability of the ranks 1..size
+        self._rank_cdf = np.cumsum(np.arange(1, size + 1, dtype=np.float64) ** (-alpha))
+        self._strata = None
+        self._strata_key = None
+
+    def _sift_up(self, pos):
+        heap_priority, heap_idx, heap_pos = self._heap_priority, self._heap_idx, self._heap_pos
+        priority, idx = heap_priority[pos], heap_idx[pos]
+        while pos > 0:
+            parent = (pos - 1) // 2
+            if heap_priority[parent] >= priority:
+                break
+            heap_priority[pos] = heap_priority[parent]
+            heap_idx[pos] = heap_idx[parent]
+            heap_pos[heap_idx[pos]] = pos
+            pos = parent
+        heap_priority[pos] = priority
+        heap_idx[pos] = idx
+        heap_pos[idx] = pos
+        return pos
+
+    def _sift_down(self, pos):
+        heap_priority, heap_idx, heap_pos = self._heap_priority, self._heap_idx, self._heap_pos
+        n = len(self)
+        priority, idx = heap_priority[pos], heap_idx[pos]
+        while True:
+            child = 2 * pos + 1
+            if child >= n:
+                break
+            if child + 1 < n and heap_priority[child + 1] > heap_priority[child]:
+                child += 1
+            if heap_priority[child] <= priority:
+                break
+            heap_priority[pos] = heap_priority[child]
+            heap_idx[pos] = heap_idx[child]
+            heap_pos[heap_idx[pos]] = pos
+            pos = child
+        heap_priority[pos] = priority
+        heap_idx[pos] = idx
+        heap_pos[idx] = pos
+
+    def _set_priority(self, idx, priority):
+        pos = self._heap_pos[idx]
+        old_priority = self._heap_priority[pos]
+        self._heap_priority[pos] = priority
+        if priority > old_priority:
+            self._sift_up(pos)
+        elif priority < old_priority:
+            self._sift_down(pos)
+
+    def sort(self):
+        """Sort the heap by priority, so that heap positions are exact ranks.
+
+        A sorted array is a valid heap as well.
+        """
+        n = len(self)
+        order = np.argsort(-self._heap_priority[:n], kind='stable')
+        self._heap_priority[:n] = self._heap_priority[:n][order]
+        self._heap_idx[:n] = self._heap_idx[:n][order]
+        self._heap_pos[self._heap_idx[:n]] = np.arange(n)
+        self._num_updates = 0
+
+    def _add_transition(self, *args, **kwargs):
+        idx = self._next_idx
+        n = len(self)
+        super()._add_transition(*args, **kwargs)
+        if n < len(self):
+            self._heap_priority[n] = self._max_priority
+            self._heap_idx[n] = idx
+            self._sift_up(n)
+        else:
+            self._set_priority(idx, self._max_priority)
+
+    def _sample_strata(self, batch_size):
+        # boundaries of batch_size rank segments of equal probability, the
+        # upper boundary of every segment is above its lower one
+        key = (len(self), batch_size)
+        if self._strata_key != key:
+            cdf = self._rank_cdf[:len(self)]
+            bounds = np.searchsorted(cdf, cdf[-1] * np.arange(1, batch_size) / batch_size, side='right')
+            lower = np.concatenate([[0], bounds])
+            upper = np.maximum(np.concatenate([bounds, [len(self)]]), lower + 1)
+            self._strata = np.minimum(lower, len(self) - 1), np.minimum(upper, len(self))
+            self._strata_key = key
+        return self._strata
+
+    def sample(self, batch_size, beta):
+        """Sample a batch of experiences.
+
+        See PrioritizedReplayBuffer.sample, the importance weights are
+        computed from the rank probabilities.
+        """
+        assert beta > 0
+
+        lower, upper = self._sample_strata(batch_size)
+        positions = lower + (np.random.random(batch_size) * (upper - lower)).astype(np.int64)
+        idxes = self._heap_idx[positions]
+
+        cdf = self._rank_cdf[:len(self)]
+        p_rank = (positions + 1.0) ** (-self._alpha) / cdf[-1]
+        p_min = len(self) ** (-self._alpha) / cdf[-1]
+        max_weight = (p_min * len(self)) ** (-beta)
+        weights = (p_rank * len(self)) ** (-beta) / max_weight
+        encoded_sample = self._encode_sample(idxes)
+        return tuple(list(encoded_sample) + [weights, idxes])
+
+    def update_priorities(self, idxes, priorities):
+        """Update priorities of sampled transitions.
+
+        See PrioritizedReplayBuffer.update_priorities
+        """
+        idxes = np.asarray(idxes)
+        priorities = np.asarray(priorities, dtype=np.float64)
         assert len(idxes) == len(priorities)
-        for idx, priority in zip(idxes, priorities):
-            assert priority > 0
-            assert 0 <= idx < len(self._storage)
-            self._it_sum[idx] = priority ** self._alpha
-            self._it_min[idx] = priority ** self._alpha
+        assert np.all(priorities > 0)
+        assert np.all(0 <= idxes) and np.all(idxes < len(self))
+        for idx, priority in zip(idxes.tolist(), priorities.tolist()):
+            self._set_priority(idx, priority)
+
+        self._max_priority = max(self._max_priority, np.max(priorities))
+        self._num_updates += len(idxes)
+        if self._num_updates >= self._sort_freq:
+            self.sort()
+
+    def _save_items(self):
+        arrays, state = super(RankBasedPrioritizedReplayBuffer, self)._save_items()
+        arrays['heap_priority'] = self._heap_priority
+        arrays['heap_idx'] = self._heap_idx
+        arrays['heap_pos'] = self._heap_pos
+        state.update(max_priority=self._max_priority, num_updates=self._num_updates)
+        return arrays, state
+
+    def _load_items(self, path, state):
+        super(RankBasedPrioritizedReplayBuffer, self)._load_items(path, state)
+        self._heap_priority = np.array(load_array(path, 'heap_priority'))
+        self._heap_idx = np.array(load_array(path, 'heap_idx'))
+        self._heap_pos = np.array(load_array(path, 'heap_pos'))
+        self._max_priority, self._num_updates = state['max_priority'], state['num_updates']
+
+
+class SharedReplayBuffer(ReplayBuffer):
+    def __init__(self, size, observation_space, action_space, context='spawn', n_step=1, gamma=1.0):
+        """Create Replay buffer in shared memory.
+
+        The columns are allocated up front from the spaces, so the buffer
+        can be passed to processes started from the same multiprocessing
+        context (e.g. as an argument of ctx.Process). Every process can then
+        `add` transitions and the parent samples them without any pickling.
+        Adds and the copy of sampled rows are serialized by a shared lock,
+        so that a sample never mixes a transition with the one that
+        overwrites its slot.
+        With n_step > 1, every process accumulates the n-step rewards of the
+        transitions it adds on its own.
+
+        Parameters
+        ----------
+        size: int
+            Max number of transitions to store in the buffer. When the buffer
+            overflows the old memories are dropped.
+        observation_space: gym.spaces.Box
+            space of obs_t and obs_tp1
+        action_space: gym.Space
+            space of the actions
+        context: str
+            multiprocessing context of the processes sharing the buffer
+        n_step: int
+            n-step transitions, see ReplayBuffer.__init__
+        gamma: float
+            discount factor of the n-step rewards
+        """
+        ReplayBuffer.__init__(self, size, n_step=n_step, gamma=gamma)
+        self._allocate_shared(observation_space, action_space, context)
+
+    def _allocate_shared(self, observation_space, action_space, context):
+        ctx = mp.get_context(context)
+        obs_spec = ((self._maxsize,) + observation_space.shape, np.dtype(observation_space.dtype))
+        self._column_specs = [
+            obs_spec,
+            ((self._maxsize,) + action_space.shape, np.dtype(action_space.dtype)),
+            ((self._maxsize,), np.dtype(np.float32)),
+            obs_spec,
+            ((self._maxsize,), np.dtype(np.float32)),
+        ]
+        self._shared_columns = [ctx.RawArray(ctypes.c_byte, int(np.prod(shape)) * dtype.itemsize)
+                                for shape, dtype in self._column_specs]
+        self._num_added = ctx.RawValue(ctypes.c_int64, 0)
+        self._lock = ctx.Lock()
+        self._columns = self._wrap_columns()
+
+    def _wrap_columns(self):
+        return tuple(np.frombuffer(buf, dtype=dtype).reshape(shape)
+                     for buf, (shape, dtype) in zip(self._shared_columns, self._column_specs))
+
+    def __getstate__(self):
+        # numpy views and segment trees are local to a process, only the
+        # shared memory itself is handed over
+        state = self.__dict__.copy()
+        for key in ['_columns', '_it_sum', '_it_min']:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._columns = self._wrap_columns()
+
+    def __len__(self):
+        return min(self._num_added.value, self._maxsize)
+
+    def save(self, path):
+        raise NotImplementedError('saving a buffer in shared memory is not supported')
+
+    def load(self, path):
+        raise NotImplementedError('loading a buffer into shared memory is not supported')
+
+    def _add_transition(self, obs_t, action, reward, obs_tp1, done, position=None, bootstrap=1):
+        data = (obs_t, action, reward, obs_tp1, done)
+        with self._lock:
+            idx = self._num_added.value % self._maxsize
+            for column, value in zip(self._columns, data):
+                column[idx] = value
+            self._num_added.value += 1
+
+    def _encode_sample(self, idxes):
+        with self._lock:
+            return ReplayBuffer._encode_sample(self, idxes)
+
+
+class SharedPrioritizedReplayBuffer(SharedReplayBuffer, PrioritizedReplayBuffer):
+    def __init__(self, size, alpha, observation_space, action_space, context='spawn', n_step=1, gamma=1.0):
+        """Create Prioritized Replay buffer in shared memory.
+
+        Transitions are added by any process as in SharedReplayBuffer. The
+        segment trees only live in the process that samples: transitions
+        added since the last `sample` or `update_priorities` call get the
+        max priority right before it.
+
+        See Also
+        --------
+        SharedReplayBuffer.__init__
+        PrioritizedReplayBuffer.__init__
+        """
+        PrioritizedReplayBuffer.__init__(self, size, alpha, n_step=n_step, gamma=gamma)
+        self._allocate_shared(observation_space, action_space, context)
+        self._num_synced = 0
+
+    def __len__(self):
+        return min(self._num_synced, self._maxsize)
+
+    def _sync_priorities(self):
+        num_added = self._num_added.value
+        first = max(self._num_synced, num_added - self._maxsize)
+        if first < num_added:
+            idxes = np.arange(first, num_added) % self._maxsize
+            self._it_sum.set(idxes, self._max_priority ** self._alpha)
+            self._it_min.set(idxes, self._max_priority ** self._alpha)
+        self._num_synced = num_added
 
-            self._max_priority = max(self._max_priority, priority)
+    def sample(self, batch_size, beta):
+        """See PrioritizedReplayBuffer.sample"""
+        self._sync_priorities()
+        return PrioritizedReplayBuffer.sample(self, batch_size, beta)
+
+    def update_priorities(self, idxes, priorities):
+        """See PrioritizedReplayBuffer.update_priorities"""
+        self._sync_priorities()
+        PrioritizedReplayBuffer.update_priorities(self, idxes, priorities)
@@ -0,0 +1,36 @@
+import multiprocessing as mp
+
+import gym
+import pytest
+import tensorflow as tf
+
+from baselines.common.tf_util import make_session
+from baselines.deepq.apex import learn
+
+
+def _cartpole():
+    return gym.make('CartPole-v0')
+
+
+def _actor_broken_env():
+    # the spaces can be read in the learner, but the actors cannot make the environment
+    if mp.parent_process() is not None:
+        raise ValueError('cannot make the environment')
+    return _cartpole()
+
+
+def _learn(env_fns):
+    make_session(make_default=True, graph=tf.Graph())
+    return learn(env_fns, network='mlp', num_layers=1, num_hidden=16, total_timesteps=400,
+                 learning_starts=100, buffer_size=1000, batch_size=16, print_freq=None, seed=0)
+
+
+def test_apex_smoke():
+    act = _learn([_cartpole, _cartpole])
+    assert act is not None
+
+
+def test_apex_actor_crash():
+    # the learner raises instead of waiting forever for learning_starts transitions
+    with pytest.raises(RuntimeError, match='actor [01] exited'):
+        _learn([_actor_broken_env, _actor_broken_env])
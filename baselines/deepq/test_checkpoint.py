@@ -0,0 +1,62 @@
+import gym
+import numpy as np
+import tensorflow as tf
+
+from baselines.common.tf_util import make_session
+from baselines.deepq.deepq import learn
+
+
+class EndlessEnv(gym.Env):
+    # an episode that runs through the save, so that n-step transitions are still pending
+    observation_space = gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+    action_space = gym.spaces.Discrete(2)
+
+    def __init__(self):
+        self.steps = 0
+
+    def reset(self):
+        self.steps = 0
+        return np.zeros(2, dtype=np.float32)
+
+    def step(self, action):
+        self.steps += 1
+        return np.full(2, self.steps % 3 - 1, dtype=np.float32), float(action), False, {}
+
+
+def _learn(checkpoint_path, total_timesteps, callback=None, env=None, **kwargs):
+    env = env or gym.make('CartPole-v0')
+    make_session(make_default=True, graph=tf.Graph())
+    return learn(env, network='mlp', num_layers=1, num_hidden=16, total_timesteps=total_timesteps,
+                 buffer_size=1000, learning_starts=50, exploration_fraction=0.5, checkpoint_freq=100,
+                 checkpoint_path=checkpoint_path, checkpoint_replay_buffer=True, print_freq=None,
+                 callback=callback, seed=0, **kwargs)
+
+
+def test_resume_from_checkpoint(tmpdir):
+    _learn(str(tmpdir), 250)
+
+    resumed = []
+    def callback(lcl, _glb):
+        if not resumed:
+            resumed.append((lcl['t'], len(lcl['replay_buffer']), lcl['exploration'].value(lcl['t'])))
+    _learn(str(tmpdir), 400, callback)
+
+    # the last save was at step 200, with the transitions of steps 0 to 200
+    t, buffer_len, eps = resumed[0]
+    assert t == 201
+    assert buffer_len == 201
+    assert eps < 1.0
+
+
+def test_resume_n_step(tmpdir):
+    _learn(str(tmpdir), 250, env=EndlessEnv(), n_step=3)
+
+    resumed = []
+    def callback(lcl, _glb):
+        if not resumed:
+            buffer = lcl['replay_buffer']
+            resumed.append((len(buffer), len(buffer._pending)))
+    _learn(str(tmpdir), 300, callback, env=EndlessEnv(), n_step=3)
+
+    # the two transitions still pending at the save are stored, cut short, before the new episode
+    assert resumed[0] == (201, 0)
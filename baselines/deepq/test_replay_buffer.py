@@ -0,0 +1,338 @@
+import numpy as np
+import pytest
+
+from baselines.common.atari_wrappers import LazyFrames
+from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, RankBasedPrioritizedReplayBuffer
+
+
+def _fill(buffer, n, obs_shape=(3,)):
+    for i in range(n):
+        obs = np.full(obs_shape, i, dtype=np.float32)
+        buffer.add(obs, i % 4, float(i), obs + 1, float(i % 7 == 0))
+
+
+@pytest.mark.parametrize('columnar', [True, False])
+def test_replay_buffer_sample(columnar):
+    buffer = ReplayBuffer(10, columnar=columnar)
+    _fill(buffer, 25)
+    assert len(buffer) == 10
+
+    obses_t, actions, rewards, obses_tp1, dones = buffer.sample(64)
+    assert obses_t.shape == (64, 3)
+    assert actions.shape == rewards.shape == dones.shape == (64,)
+    # only the last 10 transitions survive the overflow
+    assert np.all(rewards >= 15)
+    np.testing.assert_allclose(obses_t[:, 0], rewards)
+    np.testing.assert_allclose(obses_tp1, obses_t + 1)
+    np.testing.assert_array_equal(actions, rewards.astype(np.int64) % 4)
+
+
+def test_columnar_matches_list_storage():
+    columnar, listed = ReplayBuffer(16), ReplayBuffer(16, columnar=False)
+    _fill(columnar, 40, obs_shape=(2, 2))
+    _fill(listed, 40, obs_shape=(2, 2))
+
+    idxes = np.arange(16)
+    for x, y in zip(columnar._encode_sample(idxes), listed._encode_sample(idxes)):
+        np.testing.assert_allclose(x, y)
+
+
+def test_prioritized_replay_buffer_columnar():
+    buffer = PrioritizedReplayBuffer(8, alpha=0.6)
+    _fill(buffer, 12)
+    *encoded, weights, idxes = buffer.sample(5, beta=0.4)
+    assert encoded[0].shape == (5, 3)
+    assert weights.shape == (5,)
+    buffer.update_priorities(idxes, np.ones(5) * 2.0)
+
+
+def _check_heap(buffer):
+    n = len(buffer)
+    priority = buffer._heap_priority[:n]
+    assert np.all(priority[1:] <= priority[(np.arange(1, n) - 1) // 2])
+    np.testing.assert_array_equal(buffer._heap_pos[buffer._heap_idx[:n]], np.arange(n))
+
+
+def test_rank_based_heap():
+    rng = np.random.RandomState(0)
+    buffer = RankBasedPrioritizedReplayBuffer(50, alpha=0.7, sort_freq=1000)
+    _fill(buffer, 30)
+    _check_heap(buffer)
+    for _ in range(20):
+        *_, idxes = buffer.sample(8, beta=0.4)
+        buffer.update_priorities(idxes, rng.rand(8) + 0.01)
+        _fill(buffer, 3)
+        _check_heap(buffer)
+
+    buffer.sort()
+    _check_heap(buffer)
+    priorities = buffer._heap_priority[:len(buffer)]
+    assert np.all(np.diff(priorities) <= 0)
+
+
+def test_rank_based_sampling():
+    buffer = RankBasedPrioritizedReplayBuffer(100, alpha=1.0)
+    _fill(buffer, 100)
+    # priority i + 1 for transition i, so transition 99 has rank 1
+    buffer.update_priorities(np.arange(100), np.arange(1, 101))
+    buffer.sort()
+
+    counts = np.zeros(100)
+    for _ in range(200):
+        obses_t, actions, rewards, obses_tp1, dones, weights, idxes = buffer.sample(32, beta=0.5)
+        np.testing.assert_allclose(rewards, idxes)
+        counts += np.bincount(idxes, minlength=100)
+    # one sample is drawn uniformly from each of the 32 segments of equal
+    # probability, so the distribution of the ranks is matched up to a segment
+    p_rank = 1.0 / np.arange(1, 101)
+    np.testing.assert_allclose(np.cumsum(counts[::-1]) / counts.sum(), np.cumsum(p_rank) / p_rank.sum(), atol=1 / 32)
+    assert counts[99] > counts[50] > counts[0]
+
+    _, _, _, _, _, weights, idxes = buffer.sample(32, beta=1.0)
+    ranks = 100 - idxes
+    np.testing.assert_allclose(weights, ranks / 100.0)
+
+
+def _frame_stack_transitions(n, k=4, seed=0):
+    # mimics atari_wrappers.FrameStack: resets repeat the first frame k times
+    rng = np.random.RandomState(seed)
+    new_frame = lambda: rng.randint(0, 255, size=(5, 6, 1)).astype(np.uint8)
+    frames = [new_frame()] * k
+    for i in range(n):
+        obs = np.concatenate(frames, axis=-1)
+        frames = frames[1:] + [new_frame()]
+        obs_tp1 = np.concatenate(frames, axis=-1)
+        done = rng.rand() < 0.1
+        yield obs, i % 3, float(i), obs_tp1, float(done)
+        if done:
+            frames = [new_frame()] * k
+
+
+@pytest.mark.parametrize('size', [7, 50, 1000])
+def test_frame_stack_matches_columnar(size):
+    plain, dedup = ReplayBuffer(size), ReplayBuffer(size, frame_stack=4)
+    for transition in _frame_stack_transitions(300):
+        plain.add(*transition)
+        dedup.add(*transition)
+
+    idxes = np.arange(len(plain))
+    for x, y in zip(plain._encode_sample(idxes), dedup._encode_sample(idxes)):
+        np.testing.assert_array_equal(x, y)
+
+
+def test_frame_stack_stores_single_frames():
+    buffer = PrioritizedReplayBuffer(100, alpha=0.6, frame_stack=4)
+    for transition in _frame_stack_transitions(150):
+        buffer.add(*transition)
+    assert buffer._frames.shape == (104, 5, 6, 1)
+    obses_t, _, _, obses_tp1, _, weights, idxes = buffer.sample(32, beta=0.4)
+    assert obses_t.shape == obses_tp1.shape == (32, 5, 6, 4)
+    np.testing.assert_array_equal(obses_t[..., 1:], obses_tp1[..., :-1])
+
+
+def test_frame_stack_lazy_frames_continuation(monkeypatch):
+    # an obs_t that is the previous obs_tp1 object is recognized without comparing the frames
+    compared = []
+    array_equal = np.array_equal
+    monkeypatch.setattr(np, 'array_equal', lambda *args: compared.append(1) or array_equal(*args))
+    buffer = ReplayBuffer(100, frame_stack=4)
+    frames = [np.zeros((5, 6, 1), dtype=np.uint8)] * 4
+    obs = LazyFrames(frames)
+    for i in range(20):
+        frames = frames[1:] + [np.full((5, 6, 1), i, dtype=np.uint8)]
+        obs_tp1 = LazyFrames(frames)
+        buffer.add(obs, 0, 0.0, obs_tp1, 0.0)
+        obs = obs_tp1
+    assert not compared
+    assert buffer._num_episodes == 1
+
+
+def _n_step_reference(transitions, n, gamma, flush=False):
+    # n-step transitions computed from scratch, in insertion order; with
+    # flush, the last ones are cut short instead of left pending
+    out = []
+    for i, (obs, action, _, _, _) in enumerate(transitions):
+        reward, j = 0.0, i
+        while True:
+            reward += gamma ** (j - i) * transitions[j][2]
+            if transitions[j][4] or j - i == n - 1 or j == len(transitions) - 1:
+                break
+            j += 1
+        if not transitions[j][4] and j - i < n - 1 and not flush:
+            break  # still pending
+        out.append((obs, action, reward, transitions[j][3], transitions[j][4]))
+    return out
+
+
+@pytest.mark.parametrize('kwargs', [dict(), dict(columnar=False), dict(frame_stack=4), dict(alpha=0.6),
+                                    dict(alpha=0.6, frame_stack=4, sort_freq=5)])
+@pytest.mark.parametrize('size', [10, 200])
+def test_n_step(kwargs, size):
+    n, gamma = 3, 0.9
+    if 'sort_freq' in kwargs:
+        buffer = RankBasedPrioritizedReplayBuffer(size, n_step=n, gamma=gamma, **kwargs)
+    elif 'alpha' in kwargs:
+        buffer = PrioritizedReplayBuffer(size, n_step=n, gamma=gamma, **kwargs)
+    else:
+        buffer = ReplayBuffer(size, n_step=n, gamma=gamma, **kwargs)
+    transitions = list(_frame_stack_transitions(100))
+    for transition in transitions:
+        buffer.add(*transition)
+
+    expected = _n_step_reference(transitions, n, gamma)[-size:]
+    assert len(buffer) == len(expected)
+    idxes = (buffer._next_idx + np.arange(len(buffer))) % len(buffer)
+    for x, y in zip(buffer._encode_sample(idxes), zip(*expected)):
+        np.testing.assert_allclose(x, np.array(y), rtol=1e-6)
+    if 'alpha' in kwargs:
+        buffer.sample(8, beta=0.4)
+
+
+@pytest.mark.parametrize('kwargs', [dict(), dict(columnar=False), dict(frame_stack=4), dict(alpha=0.6)])
+def test_n_step_flush_after_load(tmpdir, kwargs):
+    # an episode cut short by a save is not merged with the next one after the load
+    n, gamma = 3, 0.9
+    make_buffer = lambda: (PrioritizedReplayBuffer if 'alpha' in kwargs else ReplayBuffer)(
+        200, n_step=n, gamma=gamma, **kwargs)
+    first = list(_frame_stack_transitions(40))
+    first = first[:max(i for i, transition in enumerate(first) if not transition[4]) + 1]
+    second = list(_frame_stack_transitions(40, seed=1))
+
+    saved = make_buffer()
+    for transition in first:
+        saved.add(*transition)
+    assert saved._pending
+    saved.save(str(tmpdir))
+    buffer = make_buffer()
+    buffer.load(str(tmpdir))
+    buffer.flush()
+    for transition in second:
+        buffer.add(*transition)
+
+    expected = _n_step_reference(first, n, gamma, flush=True) + _n_step_reference(second, n, gamma)
+    assert len(buffer) == len(expected)
+    for x, y in zip(buffer._encode_sample(np.arange(len(buffer))), zip(*expected)):
+        np.testing.assert_allclose(x, np.array(y), rtol=1e-6)
+
+
+def _shared_writer(buffer, worker_id, n):
+    for i in range(n):
+        obs = np.full(3, worker_id, dtype=np.float32)
+        buffer.add(obs, worker_id, float(i), obs + 1, 0.0)
+
+
+@pytest.mark.parametrize('prioritized', [False, True])
+def test_shared_replay_buffer(prioritized):
+    import multiprocessing as mp
+    from gym.spaces import Box, Discrete
+    from baselines.deepq.replay_buffer import SharedReplayBuffer, SharedPrioritizedReplayBuffer
+
+    spaces = Box(low=-10, high=10, shape=(3,), dtype=np.float32), Discrete(4)
+    if prioritized:
+        buffer = SharedPrioritizedReplayBuffer(64, 0.6, *spaces)
+    else:
+        buffer = SharedReplayBuffer(64, *spaces)
+    ctx = mp.get_context('spawn')
+    procs = [ctx.Process(target=_shared_writer, args=(buffer, worker_id, 20)) for worker_id in range(3)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+
+    sample = buffer.sample(32, beta=0.4) if prioritized else buffer.sample(32)
+    assert len(buffer) == 60
+    obses_t, actions, rewards, obses_tp1, dones = sample[:5]
+    np.testing.assert_array_equal(obses_t[:, 0], actions)
+    np.testing.assert_array_equal(obses_tp1, obses_t + 1)
+    assert np.all(rewards < 20)
+
+
+def _stress_writer(buffer, worker_id, n):
+    # every field of a transition is derived from the same value
+    for i in range(n):
+        value = worker_id * n + i
+        obs = np.full(buffer._column_specs[0][0][1:], value, dtype=np.float32)
+        buffer.add(obs, value % 4, float(value), obs + 1, float(value % 2))
+
+
+@pytest.mark.parametrize('prioritized', [False, True])
+def test_shared_replay_buffer_consistent_rows(prioritized):
+    # the writers keep overwriting the slots that are being sampled
+    import multiprocessing as mp
+    from gym.spaces import Box, Discrete
+    from baselines.deepq.replay_buffer import SharedReplayBuffer, SharedPrioritizedReplayBuffer
+
+    spaces = Box(low=0, high=1e6, shape=(64, 64), dtype=np.float32), Discrete(4)
+    if prioritized:
+        buffer = SharedPrioritizedReplayBuffer(8, 0.6, *spaces)
+    else:
+        buffer = SharedReplayBuffer(8, *spaces)
+    ctx = mp.get_context('spawn')
+    procs = [ctx.Process(target=_stress_writer, args=(buffer, worker_id, 3000)) for worker_id in range(2)]
+    for proc in procs:
+        proc.start()
+    try:
+        while buffer._num_added.value == 0 and any(proc.is_alive() for proc in procs):
+            pass
+        while any(proc.is_alive() for proc in procs):
+            if prioritized:
+                obses_t, actions, rewards, obses_tp1, dones = buffer.sample(16, beta=0.4)[:5]
+            else:
+                obses_t, actions, rewards, obses_tp1, dones = buffer.sample(16)
+            np.testing.assert_array_equal(obses_t, np.broadcast_to(rewards[:, None, None], obses_t.shape))
+            np.testing.assert_array_equal(obses_tp1, obses_t + 1)
+            np.testing.assert_array_equal(actions, rewards % 4)
+            np.testing.assert_array_equal(dones, rewards % 2)
+    finally:
+        for proc in procs:
+            proc.join()
+
+
+@pytest.mark.parametrize('cache_rows', [0, 8])
+def test_memmap_storage_matches_ram(tmpdir, cache_rows):
+    ram = ReplayBuffer(50, frame_stack=4)
+    mapped = ReplayBuffer(50, frame_stack=4, storage_dir=str(tmpdir), cache_rows=cache_rows)
+    for transition in _frame_stack_transitions(120):
+        ram.add(*transition)
+        mapped.add(*transition)
+    assert mapped._frames._cache_rows == mapped._columns[1]._cache_rows == cache_rows
+
+    idxes = np.arange(len(ram))
+    for x, y in zip(ram._encode_sample(idxes), mapped._encode_sample(idxes)):
+        np.testing.assert_array_equal(x, y)
+
+
+@pytest.mark.parametrize('kwargs', [dict(), dict(columnar=False), dict(frame_stack=4), dict(alpha=0.6),
+                                    dict(alpha=0.6, sort_freq=7), dict(frame_stack=4, n_step=3, gamma=0.9)])
+@pytest.mark.parametrize('n', [30, 120])
+def test_save_load(tmpdir, kwargs, n):
+    def make_buffer():
+        if 'sort_freq' in kwargs:
+            return RankBasedPrioritizedReplayBuffer(50, **kwargs)
+        if 'alpha' in kwargs:
+            return PrioritizedReplayBuffer(50, **kwargs)
+        return ReplayBuffer(50, **kwargs)
+
+    saved = make_buffer()
+    for transition in _frame_stack_transitions(n):
+        saved.add(*transition)
+    if 'alpha' in kwargs:
+        saved.update_priorities(np.arange(10), np.arange(1, 11))
+    saved.save(str(tmpdir))
+
+    loaded = make_buffer()
+    loaded.load(str(tmpdir))
+    assert len(loaded) == len(saved)
+    # both buffers keep going identically after the restore
+    for transition in _frame_stack_transitions(10, seed=1):
+        saved.add(*transition)
+        loaded.add(*transition)
+    idxes = np.arange(len(saved))
+    for x, y in zip(saved._encode_sample(idxes), loaded._encode_sample(idxes)):
+        np.testing.assert_array_equal(x, y)
+    if 'sort_freq' in kwargs:
+        np.testing.assert_array_equal(saved._heap_idx, loaded._heap_idx)
+    elif 'alpha' in kwargs:
+        np.testing.assert_array_equal(saved._it_sum._value, loaded._it_sum._value)
+    # saving back to the directory the buffer was mapped from is fine
+    loaded.save(str(tmpdir))
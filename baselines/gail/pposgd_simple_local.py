@@ -6,6 +6,7 @@ import time
 import os
 from baselines.common.mpi_adam import MpiAdam
 from baselines.common.mpi_moments import mpi_moments
+from baselines.common.advantages import gae
 from mpi4py import MPI
 from collections import deque
 from baselines.gail.statistics import stats
@@ -77,17 +78,8 @@ def traj_segment_generator(pi, env, reward_giver, horizon, stochastic):
         t += 1
 
 def add_vtarg_and_adv(seg, gamma, lam):
-    new = np.append(seg["new"], 0) # last element is only used for last vtarg, but we already zeroed it if last new = 1
-    vpred = np.append(seg["vpred"], seg["nextvpred"])
-    T = len(seg["rew"])
-    seg["adv"] = gaelam = np.ones(T, 'float32')
-    rew = seg["rew"]
-    lastgaelam = 0
-    for t in reversed(range(T)):
-        nonterminal = 1-new[t+1]
-        delta = rew[t] + gamma * vpred[t+1] * nonterminal - vpred[t]
-        gaelam[t] = lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
-    seg["tdlamret"] = seg["adv"] + seg["vpred"]
+    # nextvpred is only used for the last vtarg, and is already zeroed if the last new = 1
+    seg["adv"], seg["tdlamret"] = gae(seg["rew"], seg["vpred"], seg["new"], seg["nextvpred"], False, gamma, lam)
 
 def learn(env, policy_fn, reward_giver, expert_dataset,
         pretrained, pretrained_weight, *,
@@ -5,6 +5,7 @@ import tensorflow as tf, numpy as np
 import time
 from baselines.common.mpi_adam import MpiAdam
 from baselines.common.mpi_moments import mpi_moments
+from baselines.common.advantages import gae
 from mpi4py import MPI
 from collections import deque
 
@@ -67,17 +68,8 @@ def add_vtarg_and_adv(seg, gamma, lam):
     """
     Compute target value using TD(lambda) estimator, and advantage with GAE(lambda)
     """
-    new = np.append(seg["new"], 0) # last element is only used for last vtarg, but we already zeroed it if last new = 1
-    vpred = np.append(seg["vpred"], seg["nextvpred"])
-    T = len(seg["rew"])
-    seg["adv"] = gaelam = np.empty(T, 'float32')
-    rew = seg["rew"]
-    lastgaelam = 0
-    for t in reversed(range(T)):
-        nonterminal = 1-new[t+1]
-        delta = rew[t] + gamma * vpred[t+1] * nonterminal - vpred[t]
-        gaelam[t] = lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
-    seg["tdlamret"] = seg["adv"] + seg["vpred"]
+    # nextvpred is only used for the last vtarg, and is already zeroed if the last new = 1
+    seg["adv"], seg["tdlamret"] = gae(seg["rew"], seg["vpred"], seg["new"], seg["nextvpred"], False, gamma, lam)
 
 def learn(env, policy_fn, *,
         timesteps_per_actorbatch, # timesteps per actor per update
@@ -17,6 +17,7 @@ from baselines import logger
 from baselines.common import colorize
 from baselines.common.mpi_adam import MpiAdam
 from baselines.common.cg import cg
+from baselines.common.advantages import gae
 from baselines.gail.statistics import stats
 
 
@@ -89,17 +90,8 @@ def traj_segment_generator(pi, env, reward_giver, horizon, stochastic):
 
 
 def add_vtarg_and_adv(seg, gamma, lam):
-    new = np.append(seg["new"], 0)  # last element is only used for last vtarg, but we already zeroed it if last new = 1
-    vpred = np.append(seg["vpred"], seg["nextvpred"])
-    T = len(seg["rew"])
-    seg["adv"] = gaelam = np.empty(T, 'float32')
-    rew = seg["rew"]
-    lastgaelam = 0
-    for t in reversed(range(T)):
-        nonterminal = 1-new[t+1]
-        delta = rew[t] + gamma * vpred[t+1] * nonterminal - vpred[t]
-        gaelam[t] = lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
-    seg["tdlamret"] = seg["adv"] + seg["vpred"]
+    # nextvpred is only used for the last vtarg, and is already zeroed if the last new = 1
+    seg["adv"], seg["tdlamret"] = gae(seg["rew"], seg["vpred"], seg["new"], seg["nextvpred"], False, gamma, lam)
 
 
 def learn(env, policy_func, reward_giver, expert_dataset, rank,
@@ -110,7 +102,9 @@ def learn(env, policy_func, reward_giver, expert_dataset, rank,
           max_kl, cg_iters, cg_damping=1e-2,
           vf_stepsize=3e-4, d_stepsize=3e-4, vf_iters=3,
           max_timesteps=0, max_episodes=0, max_iters=0,
-          callback=None
+          callback=None,
+          batched_linesearch=False,
+          linesearch_candidates=10
           ):
 
     nworkers = MPI.COMM_WORLD.Get_size()
@@ -128,19 +122,21 @@ def learn(env, policy_func, reward_giver, expert_dataset, rank,
     ob = U.get_placeholder_cached(name="ob")
     ac = pi.pdtype.sample_placeholder([None])
 
-    kloldnew = oldpi.pd.kl(pi.pd)
-    ent = pi.pd.entropy()
-    meankl = tf.reduce_mean(kloldnew)
-    meanent = tf.reduce_mean(ent)
-    entbonus = entcoeff * meanent
+    def policy_losses(pi):
+        kloldnew = oldpi.pd.kl(pi.pd)
+        ent = pi.pd.entropy()
+        meankl = tf.reduce_mean(kloldnew)
+        meanent = tf.reduce_mean(ent)
+        entbonus = entcoeff * meanent
 
-    vferr = tf.reduce_mean(tf.square(pi.vpred - ret))
+        ratio = tf.exp(pi.pd.logp(ac) - oldpi.pd.logp(ac))  # advantage * pnew / pold
+        surrgain = tf.reduce_mean(ratio * atarg)
 
-    ratio = tf.exp(pi.pd.logp(ac) - oldpi.pd.logp(ac))  # advantage * pnew / pold
-    surrgain = tf.reduce_mean(ratio * atarg)
+        optimgain = surrgain + entbonus
+        return [optimgain, meankl, entbonus, surrgain, meanent]
 
-    optimgain = surrgain + entbonus
-    losses = [optimgain, meankl, entbonus, surrgain, meanent]
+    losses = optimgain, meankl, entbonus, surrgain, meanent = policy_losses(pi)
+    vferr = tf.reduce_mean(tf.square(pi.vpred - ret))
     loss_names = ["optimgain", "meankl", "entloss", "surrgain", "entropy"]
 
     dist = meankl
@@ -173,6 +169,13 @@ def learn(env, policy_func, reward_giver, expert_dataset, rank,
     compute_fvp = U.function([flat_tangent, ob, ac, atarg], fvp)
     compute_vflossandgrad = U.function([ob, ret], U.flatgrad(vferr, vf_var_list))
 
+    if batched_linesearch:
+        # The policy rebuilt at the parameters of every step size of the line search
+        fullstep_ph = tf.placeholder(dtype=tf.float32, shape=[None], name="fullstep")
+        candidate_losses = U.linesearch_candidates(lambda: policy_losses(policy_func("pi", ob_space, ac_space, reuse=True)),
+                                                   var_list, fullstep_ph, linesearch_candidates)
+        compute_candidate_losses = U.function([fullstep_ph, ob, ac, atarg], candidate_losses)
+
     @contextmanager
     def timed(msg):
         if rank == 0:
@@ -275,10 +278,15 @@ def learn(env, policy_func, reward_giver, expert_dataset, rank,
                 surrbefore = lossbefore[0]
                 stepsize = 1.0
                 thbefore = get_flat()
-                for _ in range(10):
+                if batched_linesearch:
+                    candidate_meanlosses = allmean(compute_candidate_losses(fullstep, *args))
+                for i in range(linesearch_candidates):
                     thnew = thbefore + fullstep * stepsize
-                    set_from_flat(thnew)
-                    meanlosses = surr, kl, *_ = allmean(np.array(compute_losses(*args)))
+                    if batched_linesearch:
+                        meanlosses = surr, kl, *_ = candidate_meanlosses[i]
+                    else:
+                        set_from_flat(thnew)
+                        meanlosses = surr, kl, *_ = allmean(np.array(compute_losses(*args)))
                     improve = surr - surrbefore
                     logger.log("Expected: %.3f Actual: %.3f" % (expectedimprove, improve))
                     if not np.isfinite(meanlosses).all():
@@ -289,6 +297,8 @@ def learn(env, policy_func, reward_giver, expert_dataset, rank,
                         logger.log("surrogate didn't improve. shrinking step.")
                     else:
                         logger.log("Stepsize OK!")
+                        if batched_linesearch:
+                            set_from_flat(thnew)
                         break
                     stepsize *= .5
                 else:
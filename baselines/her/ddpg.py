@@ -25,7 +25,8 @@ class DDPG(object):
                  Q_lr, pi_lr, norm_eps, norm_clip, max_u, action_l2, clip_obs, scope, T,
                  rollout_batch_size, subtract_goals, relative_goals, clip_pos_returns, clip_return,
                  bc_loss, q_filter, num_demo, demo_batch_size, prm_loss_weight, aux_loss_weight,
-                 sample_transitions, gamma, reuse=False, **kwargs):
+                 sample_transitions, gamma, buffer_storage_dir=None, buffer_storage_cache_rows=64, reuse=False,
+                 **kwargs):
         """Implementation of DDPG that is used in combination with Hindsight Experience Replay (HER).
             Added functionality to use demonstrations for training to Overcome exploration problem.
 
@@ -54,6 +55,8 @@ class DDPG(object):
             clip_return (float): clip returns to be in [-clip_return, clip_return]
             sample_transitions (function) function that samples from the replay buffer
             gamma (float): gamma used for Q learning updates
+            buffer_storage_dir (str): if not None, the replay buffer is memory-mapped from files in this directory
+            buffer_storage_cache_rows (int): number of episodes of the memory-mapped replay buffer kept in RAM for writing
             reuse (boolean): whether or not the networks should be reused
             bc_loss: whether or not the behavior cloning loss should be used as an auxilliary loss
             q_filter: whether or not a filter on the q value update should be used when training with demonstartions
@@ -101,7 +104,8 @@ class DDPG(object):
         buffer_shapes['ag'] = (self.T, self.dimg)
 
         buffer_size = (self.buffer_size // self.rollout_batch_size) * self.rollout_batch_size
-        self.buffer = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions)
+        self.buffer = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions,
+                                   storage_dir=self.buffer_storage_dir, cache_rows=self.buffer_storage_cache_rows)
 
         global DEMO_BUFFER
         DEMO_BUFFER = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions) #initialize the demo buffer; in the same way as the primary data buffer
@@ -24,6 +24,8 @@ DEFAULT_PARAMS = {
     'Q_lr': 0.001,  # critic learning rate
     'pi_lr': 0.001,  # actor learning rate
     'buffer_size': int(1E6),  # for experience replay
+    'buffer_storage_dir': None,  # if set, the replay buffer is memory-mapped from files in this directory
+    'buffer_storage_cache_rows': 64,  # number of episodes of the memory-mapped replay buffer kept in RAM for writing
     'polyak': 0.95,  # polyak averaging coefficient
     'action_l2': 1.0,  # quadratic penalty on actions (before rescaling by max_u)
     'clip_obs': 200.,
@@ -105,7 +107,7 @@ def prepare_params(kwargs):
         kwargs['pi_lr'] = kwargs['lr']
         kwargs['Q_lr'] = kwargs['lr']
         del kwargs['lr']
-    for name in ['buffer_size', 'hidden', 'layers',
+    for name in ['buffer_size', 'buffer_storage_dir', 'buffer_storage_cache_rows', 'hidden', 'layers',
                  'network_class',
                  'polyak',
                  'batch_size', 'Q_lr', 'pi_lr',
@@ -2,9 +2,11 @@ import threading
 
 import numpy as np
 
+from baselines.common.memmap_array import allocate, load_array, load_state, save_arrays
+
 
 class ReplayBuffer:
-    def __init__(self, buffer_shapes, size_in_transitions, T, sample_transitions):
+    def __init__(self, buffer_shapes, size_in_transitions, T, sample_transitions, storage_dir=None, cache_rows=64):
         """Creates a replay buffer.
 
         Args:
@@ -13,14 +15,21 @@ class ReplayBuffer:
             size_in_transitions (int): the size of the buffer, measured in transitions
             T (int): the time horizon for episodes
             sample_transitions (function): a function that samples from the replay buffer
+            storage_dir (str): if not None, the buffers are memory-mapped files in this directory
+                (see baselines.common.memmap_array.MemmapArray)
+            cache_rows (int): number of episodes kept in RAM for writing when storage_dir is used. Only
+                episodes written to consecutive rows, while the buffer fills up, go through it; once the
+                buffer is full, episodes replace random rows and are written to the files directly
         """
         self.buffer_shapes = buffer_shapes
         self.size = size_in_transitions // T
         self.T = T
         self.sample_transitions = sample_transitions
+        self.storage_dir = storage_dir
+        self.cache_rows = cache_rows
 
         # self.buffers is {key: array(size_in_episodes x T or T+1 x dim_key)}
-        self.buffers = {key: np.empty([self.size, *shape])
+        self.buffers = {key: allocate([self.size, *shape], dtype='float64', storage_dir=storage_dir, cache_rows=cache_rows)
                         for key, shape in buffer_shapes.items()}
 
         # memory management
@@ -65,8 +74,14 @@ class ReplayBuffer:
             idxs = self._get_storage_idx(batch_size)
 
             # load inputs into buffers
+            rows = np.atleast_1d(idxs)
             for key in self.buffers.keys():
-                self.buffers[key][idxs] = episode_batch[key]
+                if self.storage_dir is not None and np.all(np.diff(rows) == 1):
+                    # row by row, through the write cache of the memory-mapped storage
+                    for row, episode in zip(rows, episode_batch[key]):
+                        self.buffers[key][int(row)] = episode
+                else:
+                    self.buffers[key][idxs] = episode_batch[key]
 
             self.n_transitions_stored += batch_size * self.T
 
@@ -86,6 +101,28 @@ class ReplayBuffer:
         with self.lock:
             self.current_size = 0
 
+    def save(self, path):
+        """Saves the stored episodes to directory `path` as uncompressed .npy files.
+        """
+        with self.lock:
+            arrays = {key: self.buffers[key][:self.current_size] for key in self.buffers.keys()}
+            state = {'size': self.size, 'current_size': self.current_size,
+                     'n_transitions_stored': self.n_transitions_stored}
+            save_arrays(path, arrays, state)
+
+    def load(self, path):
+        """Restores episodes saved with save; a full buffer is mapped copy-on-write
+        from the files instead of being read.
+        """
+        state = load_state(path)
+        assert state['size'] == self.size, "buffer was saved with a different size"
+        with self.lock:
+            for key in self.buffers.keys():
+                self.buffers[key] = load_array(path, key, self.size, storage_dir=self.storage_dir,
+                                               cache_rows=self.cache_rows)
+            self.current_size = state['current_size']
+            self.n_transitions_stored = state['n_transitions_stored']
+
     def _get_storage_idx(self, inc=None):
         inc = inc or 1   # size increment
         assert inc <= self.size, "Batch committed to replay is too large!"
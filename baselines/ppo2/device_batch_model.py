@@ -0,0 +1,101 @@
+import tensorflow as tf
+from baselines.common.distributions import make_pdtype
+from baselines.common.input import observation_placeholder
+from baselines.ppo2.model import Model
+
+class DeviceBatchModel(Model):
+    """
+    Model that keeps the batch of an update in TensorFlow variables - the batch
+    is copied to the device once per update, and the minibatches are gathered
+    from it inside the graph instead of being sliced and fed for every
+    minibatch. Used by ppo2.learn with device_batch=True, for feed-forward
+    policies only.
+    """
+    def __init__(self, *, policy, ob_space, ac_space, nbatch_act, nbatch_train,
+                nsteps, ent_coef, vf_coef, max_grad_norm, mpi_rank_weight=1, comm=None, double_buffered=False):
+
+        self.nbatch = nbatch_act * nsteps
+        self.nbatch_train = nbatch_train
+        self.nminibatches = self.nbatch // nbatch_train
+        assert self.nbatch % nbatch_train == 0, 'nbatch_train ({}) should divide nbatch ({}) evenly'.format(nbatch_train, self.nbatch)
+        self._ob_space = ob_space
+        self._ac_space = ac_space
+
+        super().__init__(
+                policy=policy,
+                ob_space=ob_space,
+                ac_space=ac_space,
+                nbatch_act=nbatch_act,
+                nbatch_train=nbatch_train,
+                nsteps=nsteps,
+                ent_coef=ent_coef,
+                vf_coef=vf_coef,
+                max_grad_norm=max_grad_norm,
+                mpi_rank_weight=mpi_rank_weight,
+                comm=comm,
+                double_buffered=double_buffered)
+
+        self.sess.run([var.initializer for var in self._batch_vars + [self._perm]])
+
+    def _train_policy(self, policy, nbatch, nsteps, sess):
+        # Built after the act model, so that its random ops get the same seeds as with Model
+        with tf.variable_scope('batch'):
+            # Placeholders to upload the batch with, and the variables that keep it
+            self._batch_ph = [
+                observation_placeholder(self._ob_space, batch_size=self.nbatch, name='obs'),
+                tf.placeholder(tf.float32, [self.nbatch], name='returns'),
+                make_pdtype(self._ac_space).sample_placeholder([self.nbatch], name='actions'),
+                tf.placeholder(tf.float32, [self.nbatch], name='values'),
+                tf.placeholder(tf.float32, [self.nbatch], name='neglogpacs'),
+            ]
+            # Local variables, so that they are neither saved nor synced between MPI workers
+            self._batch_vars = [tf.Variable(tf.zeros(ph.shape, ph.dtype), trainable=False, name=ph.op.name.split('/')[-1],
+                                            collections=[tf.GraphKeys.LOCAL_VARIABLES]) for ph in self._batch_ph]
+            self._load_batch_op = tf.group(*[tf.assign(var, ph) for var, ph in zip(self._batch_vars, self._batch_ph)])
+
+            # Order of the batch in the current epoch
+            self._perm = tf.Variable(tf.range(self.nbatch), trainable=False, name='perm',
+                                     collections=[tf.GraphKeys.LOCAL_VARIABLES])
+            self._shuffle_op = tf.assign(self._perm, tf.random_shuffle(self._perm))
+
+            # Index of the minibatch in the epoch
+            self.MINIBATCH = tf.placeholder(tf.int32, [], name='minibatch')
+            mbinds = self._perm[self.MINIBATCH * nbatch:(self.MINIBATCH + 1) * nbatch]
+            self._minibatch = [tf.gather(var, mbinds) for var in self._batch_vars]
+
+        return policy(nbatch, nsteps, sess, observ_placeholder=self._minibatch[0])
+
+    def _train_inputs(self, train_model):
+        return self._loss_inputs(self._minibatch)
+
+    def _loss_inputs(self, minibatch):
+        """
+        Actions, normalized advantages, returns, old negative log probabilities
+        and old values of a minibatch gathered from the batch variables.
+        """
+        _, R, A, OLDVPRED, OLDNEGLOGPAC = minibatch
+        # Normalize the advantages of the minibatch, as Model.train does
+        advs = R - OLDVPRED
+        mean, var = tf.nn.moments(advs, axes=[0])
+        ADV = (advs - mean) / (tf.sqrt(var) + 1e-8)
+        return A, ADV, R, OLDNEGLOGPAC, OLDVPRED
+
+    def train_batch(self, lr, cliprange, noptepochs, obs, returns, masks, actions, values, neglogpacs):
+        """
+        Train for noptepochs epochs on the batch of an update, in a new random
+        order every epoch, and return the stats of every minibatch. Only the
+        learning rate, clip range and minibatch index are fed per minibatch.
+        """
+        self.sess.run(self._load_batch_op, dict(zip(self._batch_ph, (obs, returns, actions, values, neglogpacs))))
+
+        mblossvals = []
+        for _ in range(noptepochs):
+            self.sess.run(self._shuffle_op)
+            for minibatch in range(self.nminibatches):
+                td_map = {
+                    self.MINIBATCH : minibatch,
+                    self.LR : lr,
+                    self.CLIPRANGE : cliprange
+                }
+                mblossvals.append(self.sess.run(self.stats_list + [self._train_op], td_map)[:-1])
+        return mblossvals
@@ -0,0 +1,75 @@
+import tensorflow as tf
+from baselines.ppo2.device_batch_model import DeviceBatchModel
+
+class FusedUpdateModel(DeviceBatchModel):
+    """
+    Model that runs all the epochs and minibatches of an update in a single
+    session call - a tf.while_loop over the batch kept by DeviceBatchModel
+    shuffles it at the start of every epoch, and builds and applies the
+    gradients of every minibatch. Used by ppo2.learn with fused_update=True,
+    for feed-forward policies only. Meant for small policies, whose training
+    is dominated by the overhead of the session calls.
+    """
+    def __init__(self, *, policy, ob_space, ac_space, nbatch_act, nbatch_train,
+                nsteps, ent_coef, vf_coef, max_grad_norm, mpi_rank_weight=1, comm=None, double_buffered=False):
+
+        # Resource variables are read anew wherever they are used, so that every iteration
+        # of the loop sees the parameters and optimizer state left by the previous one
+        with tf.variable_scope(tf.get_variable_scope(), use_resource=True):
+            super().__init__(
+                    policy=policy,
+                    ob_space=ob_space,
+                    ac_space=ac_space,
+                    nbatch_act=nbatch_act,
+                    nbatch_train=nbatch_train,
+                    nsteps=nsteps,
+                    ent_coef=ent_coef,
+                    vf_coef=vf_coef,
+                    max_grad_norm=max_grad_norm,
+                    mpi_rank_weight=mpi_rank_weight,
+                    comm=comm,
+                    double_buffered=double_buffered)
+
+            self.NOPTEPOCHS = tf.placeholder(tf.int32, [], name='noptepochs')
+            niters = self.NOPTEPOCHS * self.nminibatches
+            params = list(self.var)
+
+            def body(i, perm, stats_sum):
+                minibatch = i % self.nminibatches
+                # New order of the batch at the start of every epoch
+                perm = tf.cond(tf.equal(minibatch, 0), lambda: tf.random_shuffle(perm), lambda: perm)
+                mbinds = perm[minibatch * nbatch_train:(minibatch + 1) * nbatch_train]
+                gathered = [tf.gather(var, mbinds) for var in self._batch_vars]
+
+                with tf.variable_scope('ppo2_model', reuse=True):
+                    train_model = policy(nbatch_train, nsteps, self.sess, observ_placeholder=gathered[0])
+                A, ADV, R, OLDNEGLOGPAC, OLDVPRED = self._loss_inputs(gathered)
+                loss, stats = self._loss(train_model, A, ADV, R, OLDNEGLOGPAC, OLDVPRED, self.CLIPRANGE, ent_coef, vf_coef)
+                grads_and_var = self._gradients(loss, params, max_grad_norm)
+
+                with tf.control_dependencies(stats):
+                    train_op = self.trainer.apply_gradients(grads_and_var)
+                # The next iteration starts once the parameters are updated
+                with tf.control_dependencies([train_op]):
+                    return i + 1, tf.identity(perm), stats_sum + tf.stack(stats)
+
+            # The batch is loaded in the same session call, before the loop starts
+            with tf.control_dependencies([self._load_batch_op]):
+                start = [tf.zeros([], tf.int32), tf.range(self.nbatch), tf.zeros([len(self.stats_list)])]
+            _, _, stats_sum = tf.while_loop(lambda i, *_: i < niters, body, start,
+                                            back_prop=False, parallel_iterations=1)
+            self._fused_stats = stats_sum / tf.to_float(niters)
+
+    def train_fused(self, lr, cliprange, noptepochs, obs, returns, masks, actions, values, neglogpacs):
+        """
+        Train for noptepochs epochs on the batch of an update, as train_batch
+        does but in a single session call, and return the stats averaged over
+        the minibatches.
+        """
+        td_map = dict(zip(self._batch_ph, (obs, returns, actions, values, neglogpacs)))
+        td_map.update({
+            self.NOPTEPOCHS : noptepochs,
+            self.LR : lr,
+            self.CLIPRANGE : cliprange
+        })
+        return self.sess.run(self._fused_stats, td_map).tolist()
@@ -26,7 +26,8 @@ class Model(object):
     - Save load the model
     """
     def __init__(self, *, policy, ob_space, ac_space, nbatch_act, nbatch_train,
-                nsteps, ent_coef, vf_coef, max_grad_norm, mpi_rank_weight=1, comm=None, microbatch_size=None):
+                nsteps, ent_coef, vf_coef, max_grad_norm, mpi_rank_weight=1, comm=None, microbatch_size=None,
+                double_buffered=False):
         self.sess = sess = get_session()
 
         if MPI is not None and comm is None:
@@ -34,27 +35,81 @@ class Model(object):
 
         with tf.variable_scope('ppo2_model', reuse=tf.AUTO_REUSE):
             # CREATE OUR TWO MODELS
-            # act_model that is used for sampling
-            act_model = policy(nbatch_act, 1, sess)
+            # act_model that is used for sampling, stepped on one half of the
+            # environments at a time with a DoubleBufferedVecEnv
+            act_model = policy(None if double_buffered else nbatch_act, 1, sess)
 
             # Train model for training
             if microbatch_size is None:
-                train_model = policy(nbatch_train, nsteps, sess)
+                train_model = self._train_policy(policy, nbatch_train, nsteps, sess)
             else:
-                train_model = policy(microbatch_size, nsteps, sess)
+                train_model = self._train_policy(policy, microbatch_size, nsteps, sess)
 
         # CREATE THE PLACEHOLDERS
-        self.A = A = train_model.pdtype.sample_placeholder([None])
-        self.ADV = ADV = tf.placeholder(tf.float32, [None])
-        self.R = R = tf.placeholder(tf.float32, [None])
-        # Keep track of old actor
-        self.OLDNEGLOGPAC = OLDNEGLOGPAC = tf.placeholder(tf.float32, [None])
-        # Keep track of old critic
-        self.OLDVPRED = OLDVPRED = tf.placeholder(tf.float32, [None])
+        self.A, self.ADV, self.R, self.OLDNEGLOGPAC, self.OLDVPRED = self._train_inputs(train_model)
+        A, ADV, R, OLDNEGLOGPAC, OLDVPRED = self.A, self.ADV, self.R, self.OLDNEGLOGPAC, self.OLDVPRED
         self.LR = LR = tf.placeholder(tf.float32, [])
         # Cliprange
         self.CLIPRANGE = CLIPRANGE = tf.placeholder(tf.float32, [])
 
+        loss, self.stats_list = self._loss(train_model, A, ADV, R, OLDNEGLOGPAC, OLDVPRED, CLIPRANGE, ent_coef, vf_coef)
+
+        # UPDATE THE PARAMETERS USING LOSS
+        # 1. Get the model parameters
+        params = tf.trainable_variables('ppo2_model')
+        # 2. Build our trainer
+        if comm is not None and comm.Get_size() > 1:
+            self.trainer = MpiAdamOptimizer(comm, learning_rate=LR, mpi_rank_weight=mpi_rank_weight, epsilon=1e-5)
+        else:
+            self.trainer = tf.train.AdamOptimizer(learning_rate=LR, epsilon=1e-5)
+        # 3. Calculate the gradients
+        grads_and_var = self._gradients(loss, params, max_grad_norm)
+
+        grads, self.var = zip(*grads_and_var)
+        self.grads = list(grads)
+        self._train_op = self.trainer.apply_gradients(grads_and_var)
+        self.loss_names = ['policy_loss', 'value_loss', 'policy_entropy', 'approxkl', 'clipfrac']
+
+
+        self.train_model = train_model
+        self.act_model = act_model
+        self.step = act_model.step
+        self.step_deterministic = act_model.step_deterministic
+        self.value = act_model.value
+        self.initial_state = act_model.initial_state
+
+        self.save = functools.partial(save_variables, sess=sess)
+        self.load = functools.partial(load_variables, sess=sess)
+
+        initialize()
+        global_variables = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope="")
+        if MPI is not None:
+            sync_from_root(sess, global_variables, comm=comm) #pylint: disable=E1101
+
+    def _train_policy(self, policy, nbatch, nsteps, sess):
+        """
+        Build the policy that is trained, on minibatches of nbatch samples.
+        """
+        return policy(nbatch, nsteps, sess)
+
+    def _train_inputs(self, train_model):
+        """
+        Build the actions, advantages, returns, old negative log
+        probabilities and old values that the loss is computed from.
+        """
+        A = train_model.pdtype.sample_placeholder([None])
+        ADV = tf.placeholder(tf.float32, [None])
+        R = tf.placeholder(tf.float32, [None])
+        # Keep track of old actor
+        OLDNEGLOGPAC = tf.placeholder(tf.float32, [None])
+        # Keep track of old critic
+        OLDVPRED = tf.placeholder(tf.float32, [None])
+        return A, ADV, R, OLDNEGLOGPAC, OLDVPRED
+
+    def _loss(self, train_model, A, ADV, R, OLDNEGLOGPAC, OLDVPRED, CLIPRANGE, ent_coef, vf_coef):
+        """
+        Build the PPO loss of train_model, and the stats of self.loss_names.
+        """
         neglogpac = train_model.pd.neglogp(A)
 
         # Calculate the entropy
@@ -90,47 +145,21 @@ class Model(object):
 
         # Total loss
         loss = pg_loss - entropy * ent_coef + vf_loss * vf_coef
+        return loss, [pg_loss, vf_loss, entropy, approxkl, clipfrac]
 
-        # UPDATE THE PARAMETERS USING LOSS
-        # 1. Get the model parameters
-        params = tf.trainable_variables('ppo2_model')
-        # 2. Build our trainer
-        if comm is not None and comm.Get_size() > 1:
-            self.trainer = MpiAdamOptimizer(comm, learning_rate=LR, mpi_rank_weight=mpi_rank_weight, epsilon=1e-5)
-        else:
-            self.trainer = tf.train.AdamOptimizer(learning_rate=LR, epsilon=1e-5)
-        # 3. Calculate the gradients
+    def _gradients(self, loss, params, max_grad_norm):
+        """
+        Build the gradients of loss, clipped to a global norm of max_grad_norm.
+        """
         grads_and_var = self.trainer.compute_gradients(loss, params)
         grads, var = zip(*grads_and_var)
 
         if max_grad_norm is not None:
             # Clip the gradients (normalize)
             grads, _grad_norm = tf.clip_by_global_norm(grads, max_grad_norm)
-        grads_and_var = list(zip(grads, var))
         # zip aggregate each gradient with parameters associated
         # For instance zip(ABCD, xyza) => Ax, By, Cz, Da
-
-        self.grads = grads
-        self.var = var
-        self._train_op = self.trainer.apply_gradients(grads_and_var)
-        self.loss_names = ['policy_loss', 'value_loss', 'policy_entropy', 'approxkl', 'clipfrac']
-        self.stats_list = [pg_loss, vf_loss, entropy, approxkl, clipfrac]
-
-
-        self.train_model = train_model
-        self.act_model = act_model
-        self.step = act_model.step
-        self.step_deterministic = act_model.step_deterministic
-        self.value = act_model.value
-        self.initial_state = act_model.initial_state
-
-        self.save = functools.partial(save_variables, sess=sess)
-        self.load = functools.partial(load_variables, sess=sess)
-
-        initialize()
-        global_variables = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope="")
-        if MPI is not None:
-            sync_from_root(sess, global_variables, comm=comm) #pylint: disable=E1101
+        return list(zip(grads, var))
 
     def train(self, lr, cliprange, obs, returns, masks, actions, values, neglogpacs, states=None):
         # Here we calculate advantage A(s,a) = R + yV(s') - V(s)
@@ -12,7 +12,9 @@ try:
     from mpi4py import MPI
 except ImportError:
     MPI = None
-from baselines.ppo2.runner import Runner
+from baselines.common.vec_env.async_vec_env import AsyncVecEnv
+from baselines.common.vec_env.double_buffered_vec_env import DoubleBufferedVecEnv
+from baselines.ppo2.runner import Runner, AsyncRunner
 
 
 def constfn(val):
@@ -23,7 +25,8 @@ def constfn(val):
 def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2048, ent_coef=0.0, lr=3e-4,
             vf_coef=0.5,  max_grad_norm=0.5, gamma=0.99, lam=0.95,
             log_interval=10, nminibatches=4, noptepochs=4, cliprange=0.2,
-            save_interval=0, load_path=None, model_fn=None, update_fn=None, init_fn=None, mpi_rank_weight=1, comm=None, **network_kwargs):
+            save_interval=0, load_path=None, model_fn=None, update_fn=None, init_fn=None, mpi_rank_weight=1, comm=None,
+            device_batch=False, fused_update=False, borrow_obs=False, **network_kwargs):
     '''
     Learn policy using PPO algorithm (https://arxiv.org/abs/1707.06347)
 
@@ -38,6 +41,9 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
 
     env: baselines.common.vec_env.VecEnv     environment. Needs to be vectorized for parallel environment simulation.
                                       The environments produced by gym.make can be wrapped using baselines.common.vec_env.DummyVecEnv class.
+                                      An (unwrapped) AsyncVecEnv is stepped with ppo2.runner.AsyncRunner, which acts on the
+                                      environments in the order they finish their steps. With a DoubleBufferedVecEnv, the
+                                      act model is built with a batch size of None and stepped on one half at a time.
 
 
     nsteps: int                       number of steps of the vectorized environment per update (i.e. batch size is nsteps * nenv where
@@ -72,6 +78,18 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
 
     load_path: str                    path to load the model from
 
+    device_batch: bool                upload the batch of every update to the device once and gather the minibatches from it
+                                      inside the graph (see ppo2.device_batch_model.DeviceBatchModel), instead of feeding every
+                                      minibatch. Only for feed-forward policies.
+
+    fused_update: bool                run all the epochs and minibatches of an update in a single session call, as a tf.while_loop
+                                      over the batch uploaded as with device_batch (see ppo2.fused_update_model.FusedUpdateModel).
+                                      Only for feed-forward policies.
+
+    borrow_obs: bool                  let a ShmemVecEnv env hand out its shared observation buffer instead of a copy, and a VecFrameStack
+                                      env a view of its frames, while the runner steps it, which copies the observations right away anyway.
+                                      The env is set back afterwards.
+
     **network_kwargs:                 keyword arguments to the policy / network builder. See baselines.common/policies.py/build_policy and arguments to a particular type of network
                                       For instance, 'mlp' network architecture has arguments num_hidden and num_layers.
     '''
@@ -99,18 +117,29 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
 
     # Instantiate the model object (that creates act_model and train_model)
     if model_fn is None:
-        from baselines.ppo2.model import Model
-        model_fn = Model
+        if fused_update:
+            from baselines.ppo2.fused_update_model import FusedUpdateModel
+            model_fn = FusedUpdateModel
+        elif device_batch:
+            from baselines.ppo2.device_batch_model import DeviceBatchModel
+            model_fn = DeviceBatchModel
+        else:
+            from baselines.ppo2.model import Model
+            model_fn = Model
 
     model = model_fn(policy=policy, ob_space=ob_space, ac_space=ac_space, nbatch_act=nenvs, nbatch_train=nbatch_train,
                     nsteps=nsteps, ent_coef=ent_coef, vf_coef=vf_coef,
-                    max_grad_norm=max_grad_norm, comm=comm, mpi_rank_weight=mpi_rank_weight)
+                    max_grad_norm=max_grad_norm, comm=comm, mpi_rank_weight=mpi_rank_weight,
+                    double_buffered=isinstance(env, DoubleBufferedVecEnv))
 
     if load_path is not None:
         print("Loading model from: ", load_path)
         model.load(load_path)
     # Instantiate the runner object
-    runner = Runner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
+    if isinstance(env, AsyncVecEnv):
+        runner = AsyncRunner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
+    else:
+        runner = Runner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam, borrow_obs=borrow_obs)
     if eval_env is not None:
         eval_runner = Runner(env = eval_env, model = model, nsteps = nsteps, gamma = gamma, lam= lam)
 
@@ -160,7 +189,15 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
         # Here what we're going to do is for each minibatch calculate the loss and append it.
         mblossvals = []
 
-        if states is None: # nonrecurrent version
+        if fused_update:
+            assert states is None, 'fused_update does not support recurrent policies'
+            # The whole update is a single session call, which returns the stats averaged over the minibatches
+            mblossvals = [model.train_fused(lrnow, cliprangenow, noptepochs, obs, returns, masks, actions, values, neglogpacs)]
+        elif device_batch:
+            assert states is None, 'device_batch does not support recurrent policies'
+            # The batch is uploaded once, and the minibatches are shuffled and gathered in the graph
+            mblossvals = model.train_batch(lrnow, cliprangenow, noptepochs, obs, returns, masks, actions, values, neglogpacs)
+        elif states is None: # nonrecurrent version
             # Index of each element of batch_size
             # Create the indices array
             inds = np.arange(nbatch)
@@ -1,5 +1,8 @@
 import numpy as np
-from baselines.common.runners import AbstractEnvRunner
+from contextlib import contextmanager
+from baselines.common.advantages import gae
+from baselines.common.runners import AbstractEnvRunner, AsyncEnvRunner
+from baselines.common.vec_env import VecFrameStack
 
 class Runner(AbstractEnvRunner):
     """
@@ -10,36 +13,58 @@ class Runner(AbstractEnvRunner):
     run():
     - Make a mini batch
     """
-    def __init__(self, *, env, model, nsteps, gamma, lam):
+    def __init__(self, *, env, model, nsteps, gamma, lam, borrow_obs=False):
         super().__init__(env=env, model=model, nsteps=nsteps)
         # Lambda used in GAE (General Advantage Estimation)
         self.lam = lam
         # Discount rate
         self.gamma = gamma
+        self.borrow_obs = borrow_obs
+
+    @contextmanager
+    def _borrowing_obs(self):
+        """
+        With borrow_obs, let a ShmemVecEnv hand out its shared buffer instead
+        of a copy, and a VecFrameStack a view of its frames, while run() steps
+        the env - the observations are copied into self.obs right after every
+        step. The settings of the env are restored afterwards, for its other
+        users.
+        """
+        flags = []
+        if self.borrow_obs:
+            if hasattr(self.env.unwrapped, 'borrow_obs'):
+                flags.append((self.env.unwrapped, 'borrow_obs'))
+            if isinstance(self.env, VecFrameStack):
+                flags.append((self.env, 'lazy'))
+        saved = [getattr(obj, attr) for obj, attr in flags]
+        for obj, attr in flags:
+            setattr(obj, attr, True)
+        try:
+            yield
+        finally:
+            for (obj, attr), value in zip(flags, saved):
+                setattr(obj, attr, value)
 
     def run(self):
         # Here, we init the lists that will contain the mb of experiences
         mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_neglogpacs = [],[],[],[],[],[]
         mb_states = self.states
         epinfos = []
-        # For n in range number of steps
-        for _ in range(self.nsteps):
-            # Given observations, get action value and neglopacs
-            # We already have self.obs because Runner superclass run self.obs[:] = env.reset() on init
-            actions, values, self.states, neglogpacs = self.model.step(self.obs, S=self.states, M=self.dones)
-            mb_obs.append(self.obs.copy())
-            mb_actions.append(actions)
-            mb_values.append(values)
-            mb_neglogpacs.append(neglogpacs)
-            mb_dones.append(self.dones)
+        # Given observations, get action value and neglopacs, then take actions in env and look the results
+        # We already have self.obs because Runner superclass run self.obs[:] = env.reset() on init
+        with self._borrowing_obs():
+            for obs, dones, (actions, values, _, neglogpacs), rewards, infos in self.run_steps():
+                mb_obs.append(obs)
+                mb_actions.append(actions)
+                mb_values.append(values)
+                mb_neglogpacs.append(neglogpacs)
+                mb_dones.append(dones)
 
-            # Take actions in env and look the results
-            # Infos contains a ton of useful informations
-            self.obs[:], rewards, self.dones, infos = self.env.step(actions)
-            for info in infos:
-                maybeepinfo = {sub_key:info[key][sub_key] for key in info.keys() for sub_key in info[key]}
-                if maybeepinfo: epinfos.append(maybeepinfo)
-            mb_rewards.append(rewards)
+                # Infos contains a ton of useful informations
+                for info in infos:
+                    maybeepinfo = {sub_key:info[key][sub_key] for key in info.keys() for sub_key in info[key]}
+                    if maybeepinfo: epinfos.append(maybeepinfo)
+                mb_rewards.append(rewards)
         #batch of steps to batch of rollouts
         mb_obs = np.asarray(mb_obs, dtype=self.obs.dtype)
         mb_rewards = np.asarray(mb_rewards, dtype=np.float32)
@@ -50,21 +75,31 @@ class Runner(AbstractEnvRunner):
         last_values = self.model.value(self.obs, S=self.states, M=self.dones)
 
         # discount/bootstrap off value fn
-        mb_returns = np.zeros_like(mb_rewards)
-        mb_advs = np.zeros_like(mb_rewards)
-        lastgaelam = 0
-        for t in reversed(range(self.nsteps)):
-            if t == self.nsteps - 1:
-                nextnonterminal = 1.0 - self.dones
-                nextvalues = last_values
-            else:
-                nextnonterminal = 1.0 - mb_dones[t+1]
-                nextvalues = mb_values[t+1]
-            delta = mb_rewards[t] + self.gamma * nextvalues * nextnonterminal - mb_values[t]
-            mb_advs[t] = lastgaelam = delta + self.gamma * self.lam * nextnonterminal * lastgaelam
-        mb_returns = mb_advs + mb_values
+        _, mb_returns = gae(mb_rewards, mb_values, mb_dones, last_values, self.dones, self.gamma, self.lam)
         return (*map(sf01, (mb_obs, mb_returns, mb_dones, mb_actions, mb_values, mb_neglogpacs)),
             mb_states, epinfos)
+
+
+class AsyncRunner(AsyncEnvRunner):
+    """
+    Runner for an AsyncVecEnv, see AsyncEnvRunner. run() returns the same
+    mini batch as Runner.run().
+    """
+    def __init__(self, *, env, model, nsteps, gamma, lam):
+        super().__init__(env=env, model=model, nsteps=nsteps)
+        self.lam = lam
+        self.gamma = gamma
+
+    def run(self):
+        rollout, last, epinfos = self.collect()
+        mb_rewards, mb_values, mb_dones = rollout['rewards'], rollout['values'], rollout['dones']
+
+        # discount/bootstrap off value fn
+        _, mb_returns = gae(mb_rewards, mb_values, mb_dones, last['last_values'], last['last_dones'],
+                            self.gamma, self.lam)
+        return (*map(sf01, (rollout['obs'], mb_returns, mb_dones, rollout['actions'], mb_values,
+                            rollout['neglogpacs'])),
+            self.states, epinfos)
 # obs, returns, masks, actions, values, neglogpacs, states = runner.run()
 def sf01(arr):
     """
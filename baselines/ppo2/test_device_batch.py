@@ -0,0 +1,104 @@
+import time
+import gym
+import pytest
+import tensorflow as tf
+import numpy as np
+from functools import partial
+
+from baselines.bench import Monitor
+from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
+from baselines.common.policies import build_policy
+from baselines.common.tf_util import make_session
+from baselines.ppo2.ppo2 import learn
+
+from baselines.ppo2.model import Model
+from baselines.ppo2.device_batch_model import DeviceBatchModel
+from baselines.ppo2.fused_update_model import FusedUpdateModel
+
+def env_fn():
+    env = gym.make('CartPole-v0')
+    env.seed(0)
+    # ppo2.learn logs the stats of the episodes from the first update on
+    return Monitor(env, None)
+
+def test_device_batch():
+    # with a single minibatch, the order of the samples does not change the updates
+    learn_fn = partial(learn, network='mlp', nsteps=32, total_timesteps=64, nminibatches=1, noptepochs=2, seed=0)
+
+    env_ref = DummyVecEnv([env_fn])
+    sess_ref = make_session(make_default=True, graph=tf.Graph())
+    learn_fn(env=env_ref)
+    vars_ref = {v.name: sess_ref.run(v) for v in tf.trainable_variables()}
+
+    env_test = DummyVecEnv([env_fn])
+    sess_test = make_session(make_default=True, graph=tf.Graph())
+    learn_fn(env=env_test, device_batch=True)
+    vars_test = {v.name: sess_test.run(v) for v in tf.trainable_variables()}
+
+    for v in vars_ref:
+        np.testing.assert_allclose(vars_ref[v], vars_test[v], atol=1e-5)
+
+def _random_batch(nbatch):
+    rng = np.random.RandomState(0)
+    return (rng.randn(nbatch, 4).astype(np.float32), rng.randn(nbatch).astype(np.float32),
+            np.ones(nbatch, dtype=bool), rng.randint(2, size=nbatch), rng.randn(nbatch).astype(np.float32),
+            rng.rand(nbatch).astype(np.float32))
+
+def _make_model(model_fn, nbatch, nminibatches):
+    env = DummyVecEnv([env_fn] * 8)
+    sess = make_session(make_default=True, graph=tf.Graph())
+    model = model_fn(policy=build_policy(env, 'mlp'), ob_space=env.observation_space, ac_space=env.action_space,
+                     nbatch_act=env.num_envs, nbatch_train=nbatch // nminibatches, nsteps=nbatch // env.num_envs,
+                     ent_coef=0.01, vf_coef=0.5, max_grad_norm=0.5)
+    return sess, model, tf.trainable_variables('ppo2_model')
+
+def test_fused_update():
+    # with a single minibatch, the order of the samples does not change the updates
+    batch = _random_batch(256)
+    sess_ref, model_ref, vars_ref = _make_model(DeviceBatchModel, 256, 1)
+    sess_test, model_test, vars_test = _make_model(FusedUpdateModel, 256, 1)
+    for var_ref, var_test in zip(vars_ref, vars_test):
+        var_test.load(sess_ref.run(var_ref), sess_test)
+
+    with sess_ref.graph.as_default():
+        stats_ref = np.mean(model_ref.train_batch(3e-3, 0.2, 3, *batch), axis=0)
+    with sess_test.graph.as_default():
+        stats_test = model_test.train_fused(3e-3, 0.2, 3, *batch)
+
+    np.testing.assert_allclose(stats_ref, stats_test, rtol=1e-5, atol=1e-6)
+    for var_ref, var_test in zip(vars_ref, vars_test):
+        np.testing.assert_allclose(sess_ref.run(var_ref), sess_test.run(var_test), atol=1e-6)
+
+def _train_time(model_fn, batch, noptepochs, nminibatches, nrepeats):
+    nbatch = len(batch[0])
+    _, model, _ = _make_model(model_fn, nbatch, nminibatches)
+    times = []
+    for _ in range(nrepeats):
+        tstart = time.perf_counter()
+        if model_fn is FusedUpdateModel:
+            model.train_fused(3e-4, 0.2, noptepochs, *batch)
+        elif model_fn is DeviceBatchModel:
+            model.train_batch(3e-4, 0.2, noptepochs, *batch)
+        else:
+            # the per-minibatch slicing and feeding of ppo2.learn
+            inds = np.arange(nbatch)
+            for _ in range(noptepochs):
+                np.random.shuffle(inds)
+                for start in range(0, nbatch, nbatch // nminibatches):
+                    mbinds = inds[start:start + nbatch // nminibatches]
+                    model.train(3e-4, 0.2, *(arr[mbinds] for arr in batch))
+        times.append(time.perf_counter() - tstart)
+    return min(times)
+
+@pytest.mark.slow
+def test_device_batch_benchmark():
+    nbatch, noptepochs, nminibatches = 2048, 4, 32
+    batch = _random_batch(nbatch)
+    feed = _train_time(Model, batch, noptepochs, nminibatches, nrepeats=5)
+    device = _train_time(DeviceBatchModel, batch, noptepochs, nminibatches, nrepeats=5)
+    fused = _train_time(FusedUpdateModel, batch, noptepochs, nminibatches, nrepeats=5)
+    print('{} epochs of {} minibatches: feed {:8.2f} ms, device batch {:8.2f} ms, fused update {:8.2f} ms'.format(
+        noptepochs, nminibatches, 1e3 * feed, 1e3 * device, 1e3 * fused))
+
+if __name__ == '__main__':
+    test_device_batch()
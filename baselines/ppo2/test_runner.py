@@ -0,0 +1,61 @@
+import numpy as np
+
+from baselines.common.tests.test_double_buffered_runner import WalkEnv, ParityModel
+from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
+from baselines.common.vec_env.vec_frame_stack import VecFrameStack
+from baselines.common.vec_env.shmem_vec_env import ShmemVecEnv
+from baselines.ppo2.runner import Runner
+
+
+class BorrowCheckModel(ParityModel):
+    """Records whether the env hands out its shared buffer when stepped."""
+    def __init__(self, env):
+        self.env = env
+        self.borrowed = []
+
+    def step(self, obs, S=None, M=None):
+        self.borrowed.append(self.env.borrow_obs)
+        return super().step(obs, S, M)
+
+    def value(self, obs, S=None, M=None):
+        return obs[:, 1]
+
+
+def test_runner_borrow_obs():
+    fns = [lambda env_id=env_id: WalkEnv(env_id) for env_id in range(3)]
+    env = ShmemVecEnv(fns)
+    try:
+        model = BorrowCheckModel(env)
+        runner = Runner(env=env, model=model, nsteps=8, gamma=0.99, lam=0.95, borrow_obs=True)
+        ref = Runner(env=DummyVecEnv(fns), model=BorrowCheckModel(env), nsteps=8, gamma=0.99, lam=0.95)
+        for _ in range(2):
+            for x, y in zip(runner.run()[:-2], ref.run()[:-2]):
+                np.testing.assert_array_equal(x, y)
+        assert all(model.borrowed)
+        # the env of the caller is set back after every run
+        assert not env.borrow_obs
+    finally:
+        env.close()
+
+
+class LazyCheckModel(BorrowCheckModel):
+    def step(self, obs, S=None, M=None):
+        self.borrowed.append(self.env.lazy)
+        return ParityModel.step(self, obs[..., -2:], S, M)
+
+    def value(self, obs, S=None, M=None):
+        return obs[:, -1]
+
+
+def test_runner_lazy_frame_stack():
+    fns = [lambda env_id=env_id: WalkEnv(env_id) for env_id in range(3)]
+    env = VecFrameStack(DummyVecEnv(fns), 3)
+    model = LazyCheckModel(env)
+    runner = Runner(env=env, model=model, nsteps=8, gamma=0.99, lam=0.95, borrow_obs=True)
+    ref_env = VecFrameStack(DummyVecEnv(fns), 3)
+    ref = Runner(env=ref_env, model=LazyCheckModel(ref_env), nsteps=8, gamma=0.99, lam=0.95)
+    for _ in range(2):
+        for x, y in zip(runner.run()[:-2], ref.run()[:-2]):
+            np.testing.assert_array_equal(x, y)
+    assert all(model.borrowed)
+    assert not env.lazy
@@ -0,0 +1,28 @@
+import gym
+import tensorflow as tf
+import numpy as np
+from functools import partial
+
+from baselines.common.tf_util import make_session
+from baselines.trpo_mpi.trpo_mpi import learn
+
+def test_graph_cg():
+    learn_fn = partial(learn, network='mlp', timesteps_per_batch=256, total_timesteps=512, seed=0)
+
+    env_ref = gym.make('CartPole-v0')
+    env_ref.seed(0)
+    sess_ref = make_session(make_default=True, graph=tf.Graph())
+    learn_fn(env=env_ref)
+    vars_ref = {v.name: sess_ref.run(v) for v in tf.trainable_variables()}
+
+    env_test = gym.make('CartPole-v0')
+    env_test.seed(0)
+    sess_test = make_session(make_default=True, graph=tf.Graph())
+    learn_fn(env=env_test, graph_cg=True)
+    vars_test = {v.name: sess_test.run(v) for v in tf.trainable_variables()}
+
+    for v in vars_ref:
+        np.testing.assert_allclose(vars_ref[v], vars_test[v], atol=1e-5)
+
+if __name__ == '__main__':
+    test_graph_cg()
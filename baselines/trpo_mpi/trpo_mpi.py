@@ -7,9 +7,10 @@ from baselines.common import colorize
 from collections import deque
 from baselines.common import set_global_seeds
 from baselines.common.mpi_adam import MpiAdam
-from baselines.common.cg import cg
+from baselines.common.cg import cg, tf_cg
 from baselines.common.input import observation_placeholder
 from baselines.common.policies import build_policy
+from baselines.common.advantages import gae
 from contextlib import contextmanager
 import os
 
@@ -75,17 +76,8 @@ def traj_segment_generator(pi, env, horizon, stochastic):
         t += 1
 
 def add_vtarg_and_adv(seg, gamma, lam):
-    new = np.append(seg["new"], 0) # last element is only used for last vtarg, but we already zeroed it if last new = 1
-    vpred = np.append(seg["vpred"], seg["nextvpred"])
-    T = len(seg["rew"])
-    seg["adv"] = gaelam = np.empty(T, 'float32')
-    rew = seg["rew"]
-    lastgaelam = 0
-    for t in reversed(range(T)):
-        nonterminal = 1-new[t+1]
-        delta = rew[t] + gamma * vpred[t+1] * nonterminal - vpred[t]
-        gaelam[t] = lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
-    seg["tdlamret"] = seg["adv"] + seg["vpred"]
+    # nextvpred is only used for the last vtarg, and is already zeroed if the last new = 1
+    seg["adv"], seg["tdlamret"] = gae(seg["rew"], seg["vpred"], seg["new"], seg["nextvpred"], False, gamma, lam)
 
 def learn(*,
         network,
@@ -105,6 +97,9 @@ def learn(*,
         callback=None,
         save_interval=0,
         load_path=None,
+        graph_cg=False,
+        batched_linesearch=False,
+        linesearch_candidates=10,
         **network_kwargs
         ):
     '''
@@ -145,6 +140,15 @@ def learn(*,
 
     load_path               str, path to load the model from (default: None, i.e. no model is loaded)
 
+    graph_cg                bool, run the conjugate gradient iterations and the Fisher-vector products in a single session call,
+                            with one MPI allreduce per iteration, instead of one session call per Fisher-vector product
+
+    batched_linesearch      bool, evaluate the losses at all the step sizes of the line search in a single session call and MPI allreduce,
+                            instead of one per step size tried. Every step size gets a copy of the policy run on the whole batch, so this
+                            takes about linesearch_candidates times the memory of a loss evaluation
+
+    linesearch_candidates   int, number of step sizes the line search tries, halving from the full step (default: 10)
+
     **network_kwargs        keyword arguments to the policy / network builder. See baselines.common/policies.py/build_policy and arguments to a particular type of network
 
     Returns:
@@ -189,19 +193,21 @@ def learn(*,
 
     ac = pi.pdtype.sample_placeholder([None])
 
-    kloldnew = oldpi.pd.kl(pi.pd)
-    ent = pi.pd.entropy()
-    meankl = tf.reduce_mean(kloldnew)
-    meanent = tf.reduce_mean(ent)
-    entbonus = ent_coef * meanent
+    def policy_losses(pi):
+        kloldnew = oldpi.pd.kl(pi.pd)
+        ent = pi.pd.entropy()
+        meankl = tf.reduce_mean(kloldnew)
+        meanent = tf.reduce_mean(ent)
+        entbonus = ent_coef * meanent
 
-    vferr = tf.reduce_mean(tf.square(pi.vf - ret))
+        ratio = tf.exp(pi.pd.logp(ac) - oldpi.pd.logp(ac)) # advantage * pnew / pold
+        surrgain = tf.reduce_mean(ratio * atarg)
 
-    ratio = tf.exp(pi.pd.logp(ac) - oldpi.pd.logp(ac)) # advantage * pnew / pold
-    surrgain = tf.reduce_mean(ratio * atarg)
+        optimgain = surrgain + entbonus
+        return [optimgain, meankl, entbonus, surrgain, meanent]
 
-    optimgain = surrgain + entbonus
-    losses = [optimgain, meankl, entbonus, surrgain, meanent]
+    losses = optimgain, meankl, entbonus, surrgain, meanent = policy_losses(pi)
+    vferr = tf.reduce_mean(tf.square(pi.vf - ret))
     loss_names = ["optimgain", "meankl", "entloss", "surrgain", "entropy"]
 
     dist = meankl
@@ -219,14 +225,16 @@ def learn(*,
     klgrads = tf.gradients(dist, var_list)
     flat_tangent = tf.placeholder(dtype=tf.float32, shape=[None], name="flat_tan")
     shapes = [var.get_shape().as_list() for var in var_list]
-    start = 0
-    tangents = []
-    for shape in shapes:
-        sz = U.intprod(shape)
-        tangents.append(tf.reshape(flat_tangent[start:start+sz], shape))
-        start += sz
-    gvp = tf.add_n([tf.reduce_sum(g*tangent) for (g, tangent) in zipsame(klgrads, tangents)]) #pylint: disable=E1111
-    fvp = U.flatgrad(gvp, var_list)
+    def build_fvp(flat_tangent):
+        start = 0
+        tangents = []
+        for shape in shapes:
+            sz = U.intprod(shape)
+            tangents.append(tf.reshape(flat_tangent[start:start+sz], shape))
+            start += sz
+        gvp = tf.add_n([tf.reduce_sum(g*tangent) for (g, tangent) in zipsame(klgrads, tangents)]) #pylint: disable=E1111
+        return U.flatgrad(gvp, var_list)
+    fvp = build_fvp(flat_tangent)
 
     assign_old_eq_new = U.function([],[], updates=[tf.assign(oldv, newv)
         for (oldv, newv) in zipsame(get_variables("oldpi"), get_variables("pi"))])
@@ -236,6 +244,30 @@ def learn(*,
     compute_fvp = U.function([flat_tangent, ob, ac, atarg], fvp)
     compute_vflossandgrad = U.function([ob, ret], U.flatgrad(vferr, vf_var_list))
 
+    if graph_cg:
+        # Conjugate gradient and shs in the graph, the Fisher-vector products averaged
+        # over the workers through a buffer allocated once
+        fvp_buffer = np.empty(sum(U.intprod(shape) for shape in shapes), np.float32)
+        def allmean_inplace(x):
+            MPI.COMM_WORLD.Allreduce(x, fvp_buffer, op=MPI.SUM)
+            return fvp_buffer / nworkers
+        def build_damped_fvp(p):
+            fvp_p = build_fvp(p)
+            if nworkers > 1:
+                fvp_p = tf.reshape(tf.py_func(allmean_inplace, [fvp_p], tf.float32, stateful=True), tf.shape(p))
+            return fvp_p + cg_damping * p
+        flat_g = tf.placeholder(dtype=tf.float32, shape=[None], name="flat_g")
+        stepdir_graph, cg_iters_run, cg_residual = tf_cg(build_damped_fvp, flat_g, cg_iters=cg_iters)
+        shs_graph = .5 * tf.reduce_sum(stepdir_graph * build_damped_fvp(stepdir_graph))
+        compute_stepdir = U.function([flat_g, ob, ac, atarg], [stepdir_graph, shs_graph, cg_iters_run, cg_residual])
+
+    if batched_linesearch:
+        # The policy rebuilt at the parameters of every step size of the line search
+        fullstep_ph = tf.placeholder(dtype=tf.float32, shape=[None], name="fullstep")
+        candidate_losses = U.linesearch_candidates(lambda: policy_losses(policy(observ_placeholder=ob)),
+                                                   var_list, fullstep_ph, linesearch_candidates, scope="pi")
+        compute_candidate_losses = U.function([fullstep_ph, ob, ac, atarg], candidate_losses)
+
     @contextmanager
     def timed(msg):
         if rank == 0:
@@ -329,38 +361,55 @@ def learn(*,
             logger.log("Got zero gradient. not updating")
         else:
             with timed("cg"):
-                stepdir = cg(fisher_vector_product, g, cg_iters=cg_iters, verbose=rank==0)
-            assert np.isfinite(stepdir).all()
-            shs = .5*stepdir.dot(fisher_vector_product(stepdir))
-            lm = np.sqrt(shs / max_kl)
-            # logger.log("lagrange multiplier:", lm, "gnorm:", np.linalg.norm(g))
-            fullstep = stepdir / lm
-            expectedimprove = g.dot(fullstep)
-            surrbefore = lossbefore[0]
-            stepsize = 1.0
-            thbefore = get_flat()
-            for _ in range(10):
-                thnew = thbefore + fullstep * stepsize
-                set_from_flat(thnew)
-                meanlosses = surr, kl, *_ = allmean(np.array(compute_losses(*args)))
-                improve = surr - surrbefore
-                logger.log("Expected: %.3f Actual: %.3f"%(expectedimprove, improve))
-                if not np.isfinite(meanlosses).all():
-                    logger.log("Got non-finite value of losses -- bad!")
-                elif kl > max_kl * 1.5:
-                    logger.log("violated KL constraint. shrinking step.")
-                elif improve < 0:
-                    logger.log("surrogate didn't improve. shrinking step.")
+                if graph_cg:
+                    stepdir, shs, cg_iters_run, cg_residual = compute_stepdir(g, *fvpargs)
+                    if rank == 0: logger.log("cg: %i iterations, residual %.3g" % (cg_iters_run, cg_residual))
                 else:
-                    logger.log("Stepsize OK!")
-                    break
-                stepsize *= .5
+                    stepdir = cg(fisher_vector_product, g, cg_iters=cg_iters, verbose=rank==0)
+            assert np.isfinite(stepdir).all()
+            if not graph_cg:
+                shs = .5*stepdir.dot(fisher_vector_product(stepdir))
+            if not shs > 0:
+                # no curvature left along the step direction, e.g. for a gradient too small for cg
+                logger.log("Got non-positive shs. not updating")
+                meanlosses = lossbefore
             else:
-                logger.log("couldn't compute a good step")
-                set_from_flat(thbefore)
-            if nworkers > 1 and iters_so_far % 20 == 0:
-                paramsums = MPI.COMM_WORLD.allgather((thnew.sum(), vfadam.getflat().sum())) # list of tuples
-                assert all(np.allclose(ps, paramsums[0]) for ps in paramsums[1:])
+                lm = np.sqrt(shs / max_kl)
+                # logger.log("lagrange multiplier:", lm, "gnorm:", np.linalg.norm(g))
+                fullstep = stepdir / lm
+                expectedimprove = g.dot(fullstep)
+                surrbefore = lossbefore[0]
+                stepsize = 1.0
+                thbefore = get_flat()
+                if batched_linesearch:
+                    candidate_meanlosses = allmean(compute_candidate_losses(fullstep, *args))
+                for i in range(linesearch_candidates):
+                    thnew = thbefore + fullstep * stepsize
+                    if batched_linesearch:
+                        meanlosses = surr, kl, *_ = candidate_meanlosses[i]
+                    else:
+                        set_from_flat(thnew)
+                        meanlosses = surr, kl, *_ = allmean(np.array(compute_losses(*args)))
+                    improve = surr - surrbefore
+                    logger.log("Expected: %.3f Actual: %.3f"%(expectedimprove, improve))
+                    if not np.isfinite(meanlosses).all():
+                        logger.log("Got non-finite value of losses -- bad!")
+                    elif kl > max_kl * 1.5:
+                        logger.log("violated KL constraint. shrinking step.")
+                    elif improve < 0:
+                        logger.log("surrogate didn't improve. shrinking step.")
+                    else:
+                        logger.log("Stepsize OK!")
+                        if batched_linesearch:
+                            set_from_flat(thnew)
+                        break
+                    stepsize *= .5
+                else:
+                    logger.log("couldn't compute a good step")
+                    set_from_flat(thbefore)
+                if nworkers > 1 and iters_so_far % 20 == 0:
+                    paramsums = MPI.COMM_WORLD.allgather((thnew.sum(), vfadam.getflat().sum())) # list of tuples
+                    assert all(np.allclose(ps, paramsums[0]) for ps in paramsums[1:])
 
         for (lossname, lossval) in zip(loss_names, meanlosses):
             logger.logkv(lossname, lossval)